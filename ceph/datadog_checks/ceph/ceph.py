@@ -13,6 +13,7 @@ import re
 # project
 from checks import AgentCheck
 from utils.subprocess_output import get_subprocess_output
+from datadog_checks.utils.subprocess_output import get_subprocesses_output
 from config import _is_affirmative
 
 # third party
@@ -24,6 +25,8 @@ class Ceph(AgentCheck):
 
     DEFAULT_CEPH_CMD = '/usr/bin/ceph'
     DEFAULT_CEPH_CLUSTER = 'ceph'
+    # seconds after which the ceph commands are killed
+    DEFAULT_TIMEOUT = 20
     DEFAULT_HEALTH_CHECKS = [
         'OSD_DOWN',
         'OSD_ORPHAN',
@@ -65,12 +68,21 @@ class Ceph(AgentCheck):
         except Exception as e:
             raise Exception('Unable to run cmd=%s: %s' % (' '.join(args), str(e)))
 
-        raw = {}
+        # the commands are run concurrently
+        commands = {}
         for cmd in ('mon_status', 'status', 'df detail', 'osd pool stats', 'osd perf', 'health detail'):
+            commands[cmd] = ceph_args + cmd.split() + ['-fjson']
+        timeout = float(instance.get('timeout', self.init_config.get('default_timeout', self.DEFAULT_TIMEOUT)))
+        results = get_subprocesses_output(commands, self.log, timeout=timeout)
+
+        raw = {}
+        for cmd, result in results.iteritems():
             try:
-                args = ceph_args + cmd.split() + ['-fjson']
-                output,_,_ = get_subprocess_output(args, self.log)
-                res = json.loads(output)
+                if result.error is not None:
+                    raise result.error
+                if result.timed_out:
+                    raise Exception('timed out after %ss' % timeout)
+                res = json.loads(result.output)
             except Exception as e:
                 self.log.warning('Unable to parse data from cmd=%s: %s' % (cmd, str(e)))
                 continue
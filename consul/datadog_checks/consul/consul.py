@@ -11,6 +11,8 @@ from urlparse import urljoin
 
 # project
 from checks import AgentCheck
+from config import _is_affirmative
+from datadog_checks.utils.payload_cache import PayloadCache
 from utils.containers import hash_mutable
 
 # 3p
@@ -76,34 +78,44 @@ class ConsulCheck(AgentCheck):
         AgentCheck.__init__(self, name, init_config, agentConfig, instances)
 
         self._instance_states = defaultdict(lambda: ConsulCheckInstanceState())
+        # decoded responses of the endpoints, only used with `cache_unchanged_payloads`
+        self._payload_cache = PayloadCache()
 
     def consul_request(self, instance, endpoint):
         url = urljoin(instance.get('url'), endpoint)
-        try:
-
-            clientcertfile = instance.get('client_cert_file', self.init_config.get('client_cert_file', False))
-            privatekeyfile = instance.get('private_key_file', self.init_config.get('private_key_file', False))
-            cabundlefile = instance.get('ca_bundle_file', self.init_config.get('ca_bundle_file', True))
-            acl_token = instance.get('acl_token', None)
-
-            headers = {}
-            if acl_token:
-                headers['X-Consul-Token'] = acl_token
-
-            if clientcertfile:
-                if privatekeyfile:
-                    resp = requests.get(url, cert=(clientcertfile,privatekeyfile), verify=cabundlefile, headers=headers)
+        clientcertfile = instance.get('client_cert_file', self.init_config.get('client_cert_file', False))
+        privatekeyfile = instance.get('private_key_file', self.init_config.get('private_key_file', False))
+        cabundlefile = instance.get('ca_bundle_file', self.init_config.get('ca_bundle_file', True))
+        acl_token = instance.get('acl_token', None)
+        cache_payloads = _is_affirmative(instance.get('cache_unchanged_payloads', False))
+
+        headers = {}
+        if acl_token:
+            headers['X-Consul-Token'] = acl_token
+
+        def get(extra_headers=None):
+            request_headers = dict(headers, **extra_headers) if extra_headers else headers
+            try:
+                if clientcertfile:
+                    if privatekeyfile:
+                        resp = requests.get(url, cert=(clientcertfile,privatekeyfile), verify=cabundlefile,
+                                            headers=request_headers)
+                    else:
+                        resp = requests.get(url, cert=clientcertfile, verify=cabundlefile, headers=request_headers)
                 else:
-                    resp = requests.get(url, cert=clientcertfile, verify=cabundlefile, headers=headers)
-            else:
-                resp = requests.get(url, verify=cabundlefile, headers=headers)
+                    resp = requests.get(url, verify=cabundlefile, headers=request_headers)
+
+            except requests.exceptions.Timeout:
+                self.log.exception('Consul request to {0} timed out'.format(url))
+                raise
 
-        except requests.exceptions.Timeout:
-            self.log.exception('Consul request to {0} timed out'.format(url))
-            raise
+            resp.raise_for_status()
+            return resp
 
-        resp.raise_for_status()
-        return resp.json()
+        if cache_payloads:
+            # the payload is requested again without the conditional headers if it's not cached anymore
+            return self._payload_cache.load_json(url, get(self._payload_cache.request_headers(url)), get)
+        return get().json()
 
     ### Consul Config Accessors
     def _get_local_config(self, instance, instance_state):
@@ -257,6 +269,7 @@ class ConsulCheck(AgentCheck):
             self.gauge("consul.peers", len(peers), tags=main_tags + ["mode:follower"])
             self.log.debug("This consul agent is not the cluster leader." +
                            "Skipping service and catalog checks for this instance")
+            self._submit_payload_cache_stats(instance, main_tags)
             return
         else:
             self.gauge("consul.peers", len(peers), tags=main_tags + ["mode:leader"])
@@ -414,6 +427,12 @@ class ConsulCheck(AgentCheck):
         if perform_network_latency_checks:
             self.check_network_latency(instance, agent_dc, main_tags)
 
+        self._submit_payload_cache_stats(instance, main_tags)
+
+    def _submit_payload_cache_stats(self, instance, tags):
+        if _is_affirmative(instance.get('cache_unchanged_payloads', False)):
+            self._payload_cache.submit_stats(self.gauge, 'consul.payload_cache', tags=tags)
+
     def _get_coord_datacenters(self, instance):
         return self.consul_request(instance, '/v1/coordinate/datacenters')
 
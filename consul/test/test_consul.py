@@ -2,9 +2,11 @@
 # All rights reserved
 # Licensed under Simplified BSD License (see LICENSE)
 
+import json
 import random
 
 # 3p
+import mock
 from nose.plugins.attrib import attr
 from requests import HTTPError
 
@@ -72,6 +74,12 @@ MOCK_BAD_CONFIG = {
     }]
 }
 
+def _response(payload, status_code=200, headers=None):
+    response = mock.MagicMock(status_code=status_code, content=payload, headers=headers or {}, encoding='utf-8')
+    response.json.side_effect = lambda: json.loads(payload)
+    return response
+
+
 def _get_random_ip():
     rand_int = int(15 * random.random()) + 10
     return "10.0.2.{0}".format(rand_int)
@@ -640,6 +648,24 @@ class TestCheckConsul(AgentCheckTest):
         self.assertIn('prev_consul_leader:%s' % other_url, event['tags'])
         self.assertIn('curr_consul_leader:%s' % our_url, event['tags'])
 
+    def test_cache_unchanged_payloads(self):
+        self.check = load_check(self.CHECK_NAME, MOCK_CONFIG, self.DEFAULT_AGENT_CONFIG)
+        instance = {'url': 'http://localhost:8500', 'cache_unchanged_payloads': True}
+        payload = '{"Config": {"Datacenter": "dc1"}}'
+
+        with mock.patch('requests.get', return_value=_response(payload, headers={'ETag': '"1"'})):
+            first = self.check.consul_request(instance, '/v1/agent/self')
+        with mock.patch('requests.get', return_value=_response('', status_code=304)) as get:
+            self.assertIs(self.check.consul_request(instance, '/v1/agent/self'), first)
+        self.assertEquals(get.call_args[1]['headers']['If-None-Match'], '"1"')
+
+        # a 304 for a payload which isn't cached is requested again without conditional headers
+        self.check = load_check(self.CHECK_NAME, MOCK_CONFIG, self.DEFAULT_AGENT_CONFIG)
+        with mock.patch('requests.get', side_effect=[_response('', status_code=304), _response(payload)]) as get:
+            self.assertEquals(self.check.consul_request(instance, '/v1/agent/self'), json.loads(payload))
+        self.assertEquals(get.call_count, 2)
+        self.assertNotIn('If-None-Match', get.call_args[1]['headers'])
+
     def test_network_latency_checks(self):
         self.check = load_check(self.CHECK_NAME, MOCK_CONFIG_NETWORK_LATENCY_CHECKS,
                                 self.DEFAULT_AGENT_CONFIG)
@@ -0,0 +1,66 @@
+# (C) Datadog, Inc. 2018
+# All rights reserved
+# Licensed under a 3-clause BSD style license (see LICENSE)
+"""
+Per-call cost of the `AgentCheck` methods every check runs for each sample:
+- `submit_metric`: `gauge` with a tag list submitted again and again, down to the aggregator stub
+- `normalize`: metric names normalization, with and without the cache of normalized names
+
+Usage: python benchmarks/bench_agent_check.py
+"""
+import sys
+
+from datadog_checks.checks import AgentCheck
+from datadog_checks.stubs import aggregator
+
+from common import measure, report
+
+CALLS = 10000
+
+TAGS = ['kube_namespace:default', 'kube_deployment:web', u'pod_name:web-5d8f9c7b4-x2x9q', 'container_name:nginx']
+NAMES = [
+    'Kafka.Server.BrokerTopicMetrics.MessagesInPerSec',
+    'jvm.gc.G1 Young Generation.collection_count',
+    'CamelCaseMetric__with--separators',
+    'simple.metric',
+]
+
+
+def bench_submit_metric():
+    check = AgentCheck()
+
+    def submit():
+        aggregator.reset()
+        for i in xrange(CALLS):
+            check.gauge('bench.metric', i, tags=TAGS)
+
+    seconds = measure(submit) / CALLS
+    report('agent_check.submit_metric', seconds, tags=len(TAGS), usec_per_call='{:.2f}'.format(seconds * 1e6))
+
+
+def bench_normalize():
+    check = AgentCheck()
+    calls = CALLS // len(NAMES)
+
+    def uncached():
+        for _ in xrange(calls):
+            for name in NAMES:
+                check._normalize(name, 'prefix', True)
+
+    def cached():
+        for _ in xrange(calls):
+            for name in NAMES:
+                check.normalize(name, 'prefix', fix_case=True)
+
+    for variant, func in (('uncached', uncached), ('cached', cached)):
+        seconds = measure(func) / (calls * len(NAMES))
+        report('agent_check.normalize.{}'.format(variant), seconds, usec_per_call='{:.2f}'.format(seconds * 1e6))
+
+
+def main(argv):
+    bench_submit_metric()
+    bench_normalize()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
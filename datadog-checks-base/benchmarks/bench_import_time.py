@@ -0,0 +1,78 @@
+# (C) Datadog, Inc. 2018
+# All rights reserved
+# Licensed under a 3-clause BSD style license (see LICENSE)
+"""
+Import time and memory of the base package modules and of the integrations, each one being
+imported in a fresh interpreter. `modules` is the number of modules the import loaded, and
+`rss_kb` how much the maximum resident set size grew. The integrations which can't be imported
+(missing dependencies, Agent 5 only checks) are reported with their error.
+
+Usage: python benchmarks/bench_import_time.py [integration ...]
+"""
+import json
+import os
+import subprocess
+import sys
+
+from common import report
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ROOT_DIR = os.path.dirname(BASE_DIR)
+REPEAT = 3
+
+BASE_MODULES = [
+    'datadog_checks.checks',
+    'datadog_checks.checks.prometheus',
+    'datadog_checks.checks.libs.thread_pool',
+    'datadog_checks.checks.libs.vmware.all_metrics',
+]
+
+CHILD = """
+import json, resource, sys, time
+modules, rss = len(sys.modules), resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+start = time.time()
+try:
+    __import__(sys.argv[1])
+except Exception as e:
+    print(json.dumps({'error': '{}: {}'.format(type(e).__name__, e)}))
+else:
+    print(json.dumps({
+        'seconds': time.time() - start,
+        'modules': len(sys.modules) - modules,
+        'rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss,
+    }))
+"""
+
+
+def integrations():
+    for name in sorted(os.listdir(ROOT_DIR)):
+        if os.path.isfile(os.path.join(ROOT_DIR, name, 'datadog_checks', name, '__init__.py')):
+            yield name
+
+
+def import_module(module, path):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(path + [os.environ.get('PYTHONPATH', '')]))
+    output = subprocess.check_output([sys.executable, '-c', CHILD, module], env=env)
+    return json.loads(output.splitlines()[-1])
+
+
+def run(module, path):
+    # best of a few fresh interpreters
+    results = [import_module(module, path) for _ in range(REPEAT)]
+    if 'error' in results[0]:
+        return results[0]
+    return min(results, key=lambda result: result['seconds'])
+
+
+def main(argv):
+    for module in BASE_MODULES:
+        result = run(module, [BASE_DIR])
+        report('import.{}'.format(module), result.pop('seconds', 0), **result)
+
+    for name in argv or integrations():
+        result = run('datadog_checks.{}'.format(name), [BASE_DIR, os.path.join(ROOT_DIR, name)])
+        report('import.integration.{}'.format(name), result.pop('seconds', 0), **result)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,154 @@
+# (C) Datadog, Inc. 2018
+# All rights reserved
+# Licensed under a 3-clause BSD style license (see LICENSE)
+"""
+Hot paths of the prometheus mixin on the recorded payloads of `tests/fixtures/prometheus`:
+- `parse`: `parse_metric_family` on the protobuf payload and on the text payloads, with the default
+  and the fast text parsers
+- `process_metric`: dispatch and submission of the parsed kube-state-metrics families, half of them mapped
+- `submit_histograms`: submission of the buckets and quantiles of a synthetic payload of histograms and summaries
+- `process`: a whole run on the kube-state-metrics payload, with and without label joins
+
+Usage: python benchmarks/bench_prometheus.py
+"""
+import sys
+
+from datadog_checks.checks.prometheus import PrometheusCheck
+from datadog_checks.stubs import aggregator
+
+from common import FixtureResponse, measure, read_fixture, report
+
+PROTOBUF_CONTENT_TYPE = 'application/vnd.google.protobuf; proto=io.prometheus.client.MetricFamily; encoding=delimited'
+TEXT_CONTENT_TYPE = 'text/plain; version=0.0.4'
+ENDPOINT = 'http://localhost:8080/metrics'
+
+LABEL_JOINS = {
+    'kube_pod_info': {
+        'label_to_match': 'pod',
+        'labels_to_get': ['node', 'pod_ip'],
+    },
+    'kube_deployment_labels': {
+        'label_to_match': 'deployment',
+        'labels_to_get': ['label_addonmanager_kubernetes_io_mode', 'label_k8s_app'],
+    },
+}
+
+
+def build_check(fast_text_parser=False):
+    check = PrometheusCheck('prometheus_bench', {}, {}, {})
+    check.NAMESPACE = 'bench'
+    check.FAST_TEXT_PARSER = fast_text_parser
+    return check
+
+
+def families(check, response):
+    return list(check.parse_metric_family(response))
+
+
+def bench_parse():
+    payloads = [
+        ('protobuf', 'protobuf.bin', PROTOBUF_CONTENT_TYPE),
+        ('text', 'metrics.txt', TEXT_CONTENT_TYPE),
+        ('text', 'ksm.txt', TEXT_CONTENT_TYPE),
+    ]
+    for fmt, fixture, content_type in payloads:
+        response = FixtureResponse(read_fixture('prometheus', fixture), content_type)
+        parsers = [('default', False)] + ([('fast', True)] if fmt == 'text' else [])
+        # all the families are handled, the fast parser would skip the others
+        names = [message.name for message in families(build_check(), response)]
+        for parser, fast_text_parser in parsers:
+            check = build_check(fast_text_parser)
+            check.metrics_mapper = dict((name, name) for name in names)
+            count = len(families(check, response))
+            seconds = measure(lambda: families(check, response), repeat=5, number=5)
+            report('prometheus.parse.{}'.format(fmt), seconds, payload=fixture, parser=parser,
+                   bytes=len(response.content), families=count)
+
+
+def bench_process_metric():
+    response = FixtureResponse(read_fixture('prometheus', 'ksm.txt'), TEXT_CONTENT_TYPE)
+    check = build_check()
+    messages = families(check, response)
+    check.metrics_mapper = dict((message.name, message.name) for message in messages[::2])
+    samples = sum(len(message.metric) for message in messages)
+
+    def process_metrics():
+        aggregator.reset()
+        for message in messages:
+            check.process_metric(message, ignore_unmapped=True)
+
+    seconds = measure(process_metrics, repeat=5, number=5)
+    report('prometheus.process_metric', seconds, payload='ksm.txt', families=len(messages), samples=samples,
+           usec_per_sample='{:.2f}'.format(seconds / samples * 1e6))
+
+
+def histogram_payload(series, buckets=10, quantiles=5):
+    lines = ['# TYPE bench_duration_seconds histogram']
+    for i in xrange(series):
+        labels = 'pod="pod-{}",code="200"'.format(i)
+        for b in xrange(buckets):
+            lines.append('bench_duration_seconds_bucket{{{},le="{}"}} {}'.format(labels, 0.01 * 2 ** b, b))
+        lines.append('bench_duration_seconds_bucket{{{},le="+Inf"}} {}'.format(labels, buckets))
+        lines.append('bench_duration_seconds_count{{{}}} {}'.format(labels, buckets))
+        lines.append('bench_duration_seconds_sum{{{}}} 1.5'.format(labels))
+    lines.append('# TYPE bench_latency_seconds summary')
+    for i in xrange(series):
+        labels = 'pod="pod-{}",code="200"'.format(i)
+        for q in xrange(quantiles):
+            lines.append('bench_latency_seconds{{{},quantile="0.{}"}} 0.1'.format(labels, q + 5))
+        lines.append('bench_latency_seconds_count{{{}}} {}'.format(labels, quantiles))
+        lines.append('bench_latency_seconds_sum{{{}}} 1.5'.format(labels))
+    return '\n'.join(lines) + '\n'
+
+
+def bench_submit_histograms(series=1000):
+    response = FixtureResponse(histogram_payload(series), TEXT_CONTENT_TYPE)
+    for parser, fast_text_parser in (('default', False), ('fast', True)):
+        check = build_check(fast_text_parser)
+        check.metrics_mapper = {'bench_duration_seconds': 'duration', 'bench_latency_seconds': 'latency'}
+        messages = families(check, response)
+
+        def submit():
+            aggregator.reset()
+            for message in messages:
+                check.process_metric(message, custom_tags=['env:bench'])
+
+        # warm the caches up
+        submit()
+        samples = len(aggregator.metrics('bench.duration.count')) + len(aggregator.metrics('bench.latency.quantile'))
+        seconds = measure(submit, repeat=5, number=5)
+        report('prometheus.submit_histograms', seconds, parser=parser, series=series * 2, samples=samples,
+               usec_per_sample='{:.2f}'.format(seconds / samples * 1e6))
+
+
+def bench_process():
+    response = FixtureResponse(read_fixture('prometheus', 'ksm.txt'), TEXT_CONTENT_TYPE)
+    for label_joins in (None, LABEL_JOINS):
+        check = build_check()
+        check.poll = lambda *args, **kwargs: response
+        check.metrics_mapper = {
+            'kube_pod_status_ready': 'pod.ready',
+            'kube_pod_status_scheduled': 'pod.scheduled',
+            'kube_deployment_status_replicas': 'deploy.replicas.available',
+        }
+        check.label_joins = label_joins or {}
+        # warm the caches up
+        check.process(ENDPOINT)
+
+        def process():
+            aggregator.reset()
+            check.process(ENDPOINT, ignore_unmapped=True)
+
+        report('prometheus.process', measure(process, repeat=5, number=5), payload='ksm.txt',
+               label_joins=bool(label_joins))
+
+
+def main(argv):
+    bench_parse()
+    bench_process_metric()
+    bench_submit_histograms()
+    bench_process()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
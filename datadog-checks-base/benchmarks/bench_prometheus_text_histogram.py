@@ -0,0 +1,61 @@
+# (C) Datadog, Inc. 2018
+# All rights reserved
+# Licensed under a 3-clause BSD style license (see LICENSE)
+"""
+Reassembly of text format histograms into MetricFamily protobufs, on a synthetic payload
+with one series per pod. The duration per series must stay flat as the number of series
+grows: `PrometheusScraper._extract_metric_from_map` is expected to be linear.
+
+Usage: python benchmarks/bench_prometheus_text_histogram.py [series ...]
+"""
+import sys
+
+from datadog_checks.checks.prometheus import PrometheusCheck
+
+from common import measure, report
+
+METRIC_NAME = 'bench_request_duration_seconds'
+BUCKETS = ['0.005', '0.05', '0.5', '5', '+Inf']
+
+
+def build_messages(series):
+    """
+    Build the maps `parse_metric_family` hands to `_extract_metric_from_map` for the text format
+    """
+    buckets, counts, sums = [], [], []
+    for i in xrange(series):
+        labels = {'namespace': 'default', 'pod': 'pod-{}'.format(i), 'code': '200'}
+        for idx, upper_bound in enumerate(BUCKETS):
+            bucket_labels = dict(labels, le=upper_bound)
+            buckets.append({'labels': bucket_labels, 'value': float(idx)})
+        counts.append({'labels': labels, 'value': float(len(BUCKETS))})
+        sums.append({'labels': labels, 'value': 1.5})
+
+    messages = {
+        '{}_bucket'.format(METRIC_NAME): buckets,
+        '{}_count'.format(METRIC_NAME): counts,
+        '{}_sum'.format(METRIC_NAME): sums,
+    }
+    return messages, {METRIC_NAME: 'histogram'}, {METRIC_NAME: 'Synthetic request durations.'}
+
+
+def run(series):
+    check = PrometheusCheck('prometheus_bench', {}, {}, {})
+    messages, obj_map, obj_help = build_messages(series)
+
+    def extract():
+        check._extract_metric_from_map(METRIC_NAME, messages, obj_map, obj_help)
+
+    return measure(extract)
+
+
+def main(argv):
+    series_counts = [int(arg) for arg in argv] or [5000, 50000]
+    for series in series_counts:
+        seconds = run(series)
+        report('prometheus.text.histogram_reassembly', seconds, series=series,
+               usec_per_series='{:.2f}'.format(seconds / series * 1e6))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,71 @@
+# (C) Datadog, Inc. 2018
+# All rights reserved
+# Licensed under a 3-clause BSD style license (see LICENSE)
+"""
+Per-call cost of the tag normalization done on every submission by `AgentCheck._normalize_tags`,
+for a tag list submitted again and again by a check. `baseline` is the conversion of every tag
+done before the normalization was cached, on lists of `str` tags and on lists mixing `str`,
+unicode and number tags.
+
+Usage: python benchmarks/bench_tag_normalization.py [tag_count ...]
+"""
+import sys
+
+from datadog_checks.checks import AgentCheck
+
+from common import measure, report
+
+CALLS = 10000
+
+
+def build_tags(count, mixed):
+    # a mix of the types checks submit: str, unicode and numbers
+    tags = []
+    for i in xrange(count):
+        if mixed and i % 5 == 0:
+            tags.append(u'unicode_tag_{}:value_{}'.format(i, i))
+        elif mixed and i % 5 == 1:
+            tags.append(i)
+        else:
+            tags.append('tag_{}:value_{}'.format(i, i))
+    return tags
+
+
+def baseline_normalize_tags(tags):
+    normalized_tags = []
+    for tag in tags:
+        if not isinstance(tag, basestring):
+            tag = str(tag)
+        elif isinstance(tag, unicode):
+            tag = tag.encode('utf-8')
+        normalized_tags.append(tag)
+    return normalized_tags
+
+
+def run(count, mixed):
+    check = AgentCheck()
+    tags = build_tags(count, mixed)
+
+    def baseline():
+        for _ in xrange(CALLS):
+            baseline_normalize_tags(list(tags))
+
+    def current():
+        for _ in xrange(CALLS):
+            check._normalize_tags(tags, None)
+
+    return measure(baseline) / CALLS, measure(current) / CALLS
+
+
+def main(argv):
+    tag_counts = [int(arg) for arg in argv] or [10, 50]
+    for count in tag_counts:
+        for kind, mixed in (('str', False), ('mixed', True)):
+            baseline, current = run(count, mixed)
+            for name, seconds in (('baseline', baseline), ('current', current)):
+                report('agent_check.normalize_tags.{}.{}'.format(kind, name), seconds, tags=count,
+                       usec_per_call='{:.2f}'.format(seconds * 1e6))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
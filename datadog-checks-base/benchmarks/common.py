@@ -0,0 +1,46 @@
+# (C) Datadog, Inc. 2018
+# All rights reserved
+# Licensed under a 3-clause BSD style license (see LICENSE)
+import os
+import timeit
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tests', 'fixtures')
+
+# Every result reported, collected by `run.py`
+RESULTS = []
+
+
+def measure(func, repeat=3, number=1):
+    """
+    Run `func` `number` times in a row, `repeat` times, and return the best
+    duration of a single call in seconds
+    """
+    return min(timeit.repeat(func, repeat=repeat, number=number)) / number
+
+
+def report(name, seconds, **extra):
+    RESULTS.append(dict(extra, name=name, seconds=seconds))
+    details = ' '.join('{}={}'.format(k, v) for k, v in sorted(extra.items()))
+    print('{:<50} {:>12.6f}s {}'.format(name, seconds, details))
+
+
+def read_fixture(*path):
+    with open(os.path.join(FIXTURES_DIR, *path), 'rb') as f:
+        return f.read()
+
+
+class FixtureResponse(object):
+    """
+    Serves a recorded payload like the `requests.Response` returned by `PrometheusScraper.poll`
+    """
+    status_code = 200
+
+    def __init__(self, content, content_type):
+        self.content = content
+        self.headers = {'Content-Type': content_type}
+
+    def iter_lines(self, **_):
+        return iter(self.content.split('\n'))
+
+    def close(self):
+        pass
@@ -0,0 +1,102 @@
+# (C) Datadog, Inc. 2018
+# All rights reserved
+# Licensed under a 3-clause BSD style license (see LICENSE)
+"""
+Run the benchmarks with their default parameters and write their results as JSON, along with
+the versions they ran with, so that they can be compared release over release.
+
+With `--compare`, the ratio of each duration to the one of a previous results file is printed,
+results being matched by name and order of appearance.
+
+Usage: python benchmarks/run.py [-o results.json] [--compare baseline.json] [benchmark ...]
+"""
+from collections import defaultdict
+import argparse
+import datetime
+import glob
+import importlib
+import json
+import os
+import platform
+import sys
+
+import common
+
+from datadog_checks import __version__
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def available_benchmarks():
+    for path in sorted(glob.glob(os.path.join(BENCHMARKS_DIR, 'bench_*.py'))):
+        yield os.path.splitext(os.path.basename(path))[0][len('bench_'):]
+
+
+def run(benchmarks):
+    stdout = sys.stdout
+    # the tables printed by the benchmarks go to stderr, leaving stdout to the json results
+    sys.stdout = sys.stderr
+    try:
+        for benchmark in benchmarks:
+            importlib.import_module('bench_{}'.format(benchmark)).main([])
+    finally:
+        sys.stdout = stdout
+
+    return {
+        'version': __version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'date': datetime.datetime.utcnow().isoformat(),
+        'benchmarks': list(benchmarks),
+        'results': common.RESULTS,
+    }
+
+
+def _keyed(results):
+    occurrences = defaultdict(int)
+    keyed = {}
+    for result in results:
+        keyed[(result['name'], occurrences[result['name']])] = result
+        occurrences[result['name']] += 1
+    return keyed
+
+
+def compare(results, baseline):
+    baseline_results = _keyed(baseline['results'])
+    print('Compared to {} ({})'.format(baseline.get('version'), baseline.get('date')))
+    for key, result in sorted(_keyed(results['results']).items()):
+        previous = baseline_results.get(key)
+        if previous is None or not previous['seconds'] or not result['seconds']:
+            ratio = 'n/a'
+        else:
+            ratio = '{:.2f}x'.format(result['seconds'] / previous['seconds'])
+        details = ' '.join(
+            '{}={}'.format(k, v) for k, v in sorted(result.items()) if k not in ('name', 'seconds')
+        )
+        print('{:<50} {:>8} {}'.format(key[0], ratio, details))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Run the benchmarks of datadog_checks')
+    parser.add_argument('benchmarks', nargs='*', help='benchmarks to run, all by default: {}'.format(
+        ', '.join(available_benchmarks())))
+    parser.add_argument('-o', '--output', help='write the json results to this file instead of stdout')
+    parser.add_argument('--compare', help='json results to compare the durations to')
+    args = parser.parse_args(argv)
+
+    results = run(args.benchmarks or list(available_benchmarks()))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    elif not args.compare:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        print('')
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -4,6 +4,7 @@
 from collections import defaultdict
 import logging
 import re
+import string
 import json
 import copy
 import traceback
@@ -19,9 +20,14 @@ try:
 except ImportError:
     from ..stubs import aggregator
 
+from .libs.profiler import CheckProfiler
+from ..utils.containers import LRUCache, immutable
 from ..utils.proxy import config_proxy_skip
 from ..config import is_affirmative
 
+# Tag lists only made of `str` tags don't need to be converted, see `AgentCheck._normalize_tags`
+STR_TAG_TYPES = frozenset([str])
+
 
 class AgentCheck(object):
     """
@@ -29,6 +35,27 @@ class AgentCheck(object):
     """
     OK, WARNING, CRITICAL, UNKNOWN = (0, 1, 2, 3)
 
+    # Number of distinct tag lists whose normalization is kept, see `_normalize_tags`
+    NORMALIZED_TAGS_CACHE_SIZE = 10000
+    # Number of metric names whose normalization is kept, see `normalize`
+    NORMALIZED_NAMES_CACHE_SIZE = 5000
+
+    # `normalize` translates the separators of a name to `_`, then the runs of `_` are collapsed,
+    # dropped at both ends and around dots in a single pass: the match of each group is replaced
+    # by `NORMALIZE_REPLACEMENTS[group index]`.
+    NORMALIZE_TABLE = string.maketrans(",+*-/()[]{} \t\n\r\f\v", "_" * 17)
+    NORMALIZE_UNDERSCORES_RE = re.compile(r"(^_+|_+$)|(_*\._*)|(__+)")
+    NORMALIZE_REPLACEMENTS = (None, "", ".", "_")
+
+    FIRST_CAP_RE = re.compile('(.)([A-Z][a-z]+)')
+    ALL_CAP_RE = re.compile('([a-z0-9])([A-Z])')
+    METRIC_REPLACEMENT = re.compile(r'([^a-zA-Z0-9_.]+)|(^[^a-zA-Z]+)')
+    DOT_UNDERSCORE_CLEANUP = re.compile(r'_*\._*')
+
+    # If set to True, `check` receives an immutable version of the instance, built once,
+    # instead of a deep copy made on every run. Modifying it raises a TypeError.
+    FROZEN_INSTANCES = False
+
     def __init__(self, *args, **kwargs):
         """
         args: `name`, `init_config`, `agentConfig` (deprecated), `instances`
@@ -40,6 +67,12 @@ class AgentCheck(object):
         self.init_config = kwargs.get('init_config', {})
         self.agentConfig = kwargs.get('agentConfig', {})
         self.warnings = []
+        self._normalized_tags = LRUCache(self.NORMALIZED_TAGS_CACHE_SIZE)
+        self._normalized_names = LRUCache(self.NORMALIZED_NAMES_CACHE_SIZE)
+        self._underscore_separated_names = LRUCache(self.NORMALIZED_NAMES_CACHE_SIZE)
+        # the instance passed to `check` with `FROZEN_INSTANCES`, and the one it was built from
+        self._frozen_instance = None
+        self._frozen_instance_source = None
 
         if len(args) > 0:
             self.name = args[0]
@@ -71,6 +104,18 @@ class AgentCheck(object):
 
         self.default_integration_http_timeout = float(self.agentConfig.get('default_integration_http_timeout', 9))
 
+        # Optional `datadog.check.*` metrics about the runs, enabled with the `profiling` option of the
+        # `init_config`, or the `check_profiling` option of the agent for all the checks
+        self._profiler = None
+        init_config = self.init_config or {}
+        if is_affirmative(init_config.get('profiling', datadog_agent.get_config('check_profiling'))):
+            self._profiler = CheckProfiler(
+                self,
+                aggregator.GAUGE,
+                cprofile_runs=int(init_config.get('profiling_cprofile_runs', 0)),
+                cprofile_path=init_config.get('profiling_cprofile_path'),
+            )
+
         self._deprecations = {
             'increment': [
                 False,
@@ -110,6 +155,52 @@ class AgentCheck(object):
 
         aggregator.submit_metric(self, self.check_id, mtype, name, float(value), tags, hostname)
 
+    def submit_metrics(self, metrics):
+        """
+        Submit a batch of samples, `metrics` being an iterable of
+        `(mtype, name, value, tags, hostname)` rows, `mtype` one of the `aggregator` types.
+
+        Samples with a `None` value are ignored. The tags are normalized once per list
+        object, so rows sharing the same list of tags only pay for it once.
+        """
+        rows = []
+        normalized = {}  # id(tags): (tags, normalized tags)
+        for mtype, name, value, tags, hostname in metrics:
+            if value is None:
+                continue
+            entry = normalized.get(id(tags))
+            if entry is None or entry[0] is not tags:
+                entry = normalized[id(tags)] = (tags, self._normalize_tags(tags, None))
+            rows.append((mtype, name, float(value), entry[1], hostname or ""))
+
+        self._submit_rows(rows)
+
+    def submit_metric_columns(self, mtype, names, values, tags=None, hostname=None):
+        """
+        Submit a batch of samples of type `mtype` sharing the same `tags` and `hostname`,
+        `names` and `values` being parallel sequences.
+        """
+        tags = self._normalize_tags(tags, None)
+        if hostname is None:
+            hostname = ""
+
+        self._submit_rows([
+            (mtype, name, float(value), tags, hostname) for name, value in zip(names, values) if value is not None
+        ])
+
+    def _submit_rows(self, rows):
+        """
+        Send normalized `(mtype, name, value, tags, hostname)` rows to the aggregator,
+        in a single call when it supports it
+        """
+        submit_metrics = getattr(aggregator, 'submit_metrics', None)
+        if submit_metrics is not None:
+            submit_metrics(self, self.check_id, rows)
+            return
+
+        for mtype, name, value, tags, hostname in rows:
+            aggregator.submit_metric(self, self.check_id, mtype, name, value, tags, hostname)
+
     def gauge(self, name, value, tags=None, hostname=None, device_name=None):
         self._submit_metric(aggregator.GAUGE, name, value, tags=tags, hostname=hostname, device_name=device_name)
 
@@ -188,7 +279,17 @@ class AgentCheck(object):
         :param prefix A prefix to to add to the normalized name, default None
         :param fix_case A boolean, indicating whether to make sure that
                         the metric name returned is in underscore_case
+
+        The normalized names are cached, see `_normalized_names` for hit statistics.
         """
+        key = (metric, prefix, fix_case)
+        name = self._normalized_names.get(key)
+        if name is None:
+            name = self._normalize(metric, prefix, fix_case)
+            self._normalized_names.set(key, name)
+        return name
+
+    def _normalize(self, metric, prefix, fix_case):
         if isinstance(metric, unicode):
             metric_name = unicodedata.normalize('NFKD', metric).encode('ascii', 'ignore')
         else:
@@ -199,31 +300,31 @@ class AgentCheck(object):
             if prefix is not None:
                 prefix = self.convert_to_underscore_separated(prefix)
         else:
-            name = re.sub(r"[,\+\*\-/()\[\]{}\s]", "_", metric_name)
-        # Eliminate multiple _
-        name = re.sub(r"__+", "_", name)
-        # Don't start/end with _
-        name = re.sub(r"^_", "", name)
-        name = re.sub(r"_$", "", name)
-        # Drop ._ and _.
-        name = re.sub(r"\._", ".", name)
-        name = re.sub(r"_\.", ".", name)
+            name = metric_name.translate(self.NORMALIZE_TABLE)
+        if '_' in name:
+            name = self.NORMALIZE_UNDERSCORES_RE.sub(self._normalize_replacement, name)
 
         if prefix is not None:
             return prefix + "." + name
         else:
             return name
 
-    FIRST_CAP_RE = re.compile('(.)([A-Z][a-z]+)')
-    ALL_CAP_RE = re.compile('([a-z0-9])([A-Z])')
-    METRIC_REPLACEMENT = re.compile(r'([^a-zA-Z0-9_.]+)|(^[^a-zA-Z]+)')
-    DOT_UNDERSCORE_CLEANUP = re.compile(r'_*\._*')
+    @classmethod
+    def _normalize_replacement(cls, match):
+        return cls.NORMALIZE_REPLACEMENTS[match.lastindex]
 
     def convert_to_underscore_separated(self, name):
         """
         Convert from CamelCase to camel_case
         And substitute illegal metric characters
         """
+        metric_name = self._underscore_separated_names.get(name)
+        if metric_name is None:
+            metric_name = self._convert_to_underscore_separated(name)
+            self._underscore_separated_names.set(name, metric_name)
+        return metric_name
+
+    def _convert_to_underscore_separated(self, name):
         metric_name = self.FIRST_CAP_RE.sub(r'\1_\2', name)
         metric_name = self.ALL_CAP_RE.sub(r'\1_\2', metric_name).lower()
         metric_name = self.METRIC_REPLACEMENT.sub('_', metric_name)
@@ -235,6 +336,10 @@ class AgentCheck(object):
         - append `device_name` as `device:` tag
         - normalize tags to type `str`
         - always return a list
+
+        A list of `str` tags is only copied. The normalization of the other ones is cached,
+        keyed on the tags and their types since equal values like `1`, `True` and `1.0` have
+        different string forms, and a copy of the cached tags is returned.
         """
         if tags is None:
             normalized_tags = []
@@ -245,7 +350,20 @@ class AgentCheck(object):
             self._log_deprecation("device_name")
             normalized_tags.append("device:%s" % device_name)
 
-        return self._normalize_tags_type(normalized_tags)
+        if STR_TAG_TYPES.issuperset(map(type, normalized_tags)):
+            return normalized_tags
+
+        try:
+            key = tuple(zip(map(type, normalized_tags), normalized_tags))
+            cached = self._normalized_tags.get(key)
+        except TypeError:
+            # unhashable tags, they are normalized without caching
+            return self._normalize_tags_type(normalized_tags)
+
+        if cached is None:
+            cached = tuple(self._normalize_tags_type(normalized_tags))
+            self._normalized_tags.set(key, cached)
+        return list(cached)
 
     def _normalize_tags_type(self, tags):
         """
@@ -254,6 +372,10 @@ class AgentCheck(object):
         """
         normalized_tags = []
         if tags is not None:
+            # fast path, nothing to convert
+            if STR_TAG_TYPES.issuperset(map(type, tags)):
+                return list(tags)
+
             for tag in tags:
                 if not isinstance(tag, basestring):
                     try:
@@ -286,7 +408,14 @@ class AgentCheck(object):
 
     def run(self):
         try:
-            self.check(copy.deepcopy(self.instances[0]))
+            if self.FROZEN_INSTANCES:
+                instance = self._get_frozen_instance()
+            else:
+                instance = copy.deepcopy(self.instances[0])
+            if self._profiler is not None:
+                self._profiler.run(self.check, instance)
+            else:
+                self.check(instance)
             result = ''
 
         except Exception, e:
@@ -299,6 +428,15 @@ class AgentCheck(object):
 
         return result
 
+    def _get_frozen_instance(self):
+        """
+        Return the immutable version of the instance, only built again if the instance is replaced
+        """
+        if self._frozen_instance_source is not self.instances[0]:
+            self._frozen_instance = immutable(self.instances[0])
+            self._frozen_instance_source = self.instances[0]
+        return self._frozen_instance
+
     def _get_requests_proxy(self):
         no_proxy_settings = {
             "http": None,
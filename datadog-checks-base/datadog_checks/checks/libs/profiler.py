@@ -0,0 +1,134 @@
+# (C) Datadog, Inc. 2018
+# All rights reserved
+# Licensed under a 3-clause BSD style license (see LICENSE)
+import os
+import time
+
+from ...utils.lazy import lazy_import
+
+cProfile = lazy_import('cProfile')
+
+
+def _cpu_time():
+    user, system = os.times()[:2]
+    return user + system
+
+
+class CheckProfiler(object):
+    """
+    Measures where the time goes in the runs of a check, and submits it as `datadog.check.*` metrics:
+    - `run_time`, `cpu_time`: wall and CPU time of `check`, in seconds
+    - `submission_time`: time spent submitting metrics, service checks and events, tagged by `method`
+    - `samples`: number of metric samples submitted
+    - `contexts`: number of distinct metric name and tags combinations submitted
+
+    The first `cprofile_runs` runs can also be profiled with cProfile, their stats are
+    dumped to `cprofile_path` after the last one.
+    """
+    METHODS = {
+        '_submit_metric': 'metric',
+        '_submit_rows': 'metric',
+        'service_check': 'service_check',
+        'event': 'event',
+    }
+
+    def __init__(self, check, gauge_type, cprofile_runs=0, cprofile_path=None):
+        self.check = check
+        self.gauge_type = gauge_type
+        self.cprofile_runs = cprofile_runs if cprofile_path else 0
+        self.cprofile_path = cprofile_path
+        self._cprofile = cProfile.Profile() if self.cprofile_runs else None
+        self._profiled_runs = 0
+
+        # the metrics of the profiler are not accounted for
+        self._submit_metric = check._submit_metric
+        self._instrument()
+        self._reset()
+
+    def _instrument(self):
+        """
+        Shadow the submission methods of the check with timed versions, on the instance only
+        """
+        for method_name, method_tag in self.METHODS.iteritems():
+            setattr(self.check, method_name, self._timed(getattr(self.check, method_name), method_tag))
+
+        submit_metric = self.check._submit_metric
+
+        def count_sample(mtype, name, value, tags=None, hostname=None, device_name=None):
+            submit_metric(mtype, name, value, tags=tags, hostname=hostname, device_name=device_name)
+            self.samples += 1
+            self._add_context(name, tags)
+        self.check._submit_metric = count_sample
+
+        submit_rows = self.check._submit_rows
+
+        def count_rows(rows):
+            submit_rows(rows)
+            self.samples += len(rows)
+            for _, name, _, tags, _ in rows:
+                self._add_context(name, tags)
+        self.check._submit_rows = count_rows
+
+    def _timed(self, method, method_tag):
+        def timed(*args, **kwargs):
+            start = time.time()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.submission_times[method_tag] += time.time() - start
+        return timed
+
+    def _add_context(self, name, tags):
+        try:
+            self.contexts.add((name, tuple(tags) if tags else ()))
+        except TypeError:
+            pass
+
+    def _reset(self):
+        self.samples = 0
+        self.contexts = set()
+        self.submission_times = dict.fromkeys(self.METHODS.itervalues(), 0.0)
+
+    def run(self, func, *args):
+        """
+        Run `func(*args)` and submit its measures, even if it fails
+        """
+        self._reset()
+        cprofile = self._cprofile if self._profiled_runs < self.cprofile_runs else None
+
+        start, cpu_start = time.time(), _cpu_time()
+        if cprofile is not None:
+            cprofile.enable()
+        try:
+            return func(*args)
+        finally:
+            if cprofile is not None:
+                cprofile.disable()
+            run_time, cpu_time = time.time() - start, _cpu_time() - cpu_start
+
+            if cprofile is not None:
+                self._profiled_runs += 1
+                if self._profiled_runs == self.cprofile_runs:
+                    self._dump_cprofile()
+
+            self._submit(run_time, cpu_time)
+
+    def _dump_cprofile(self):
+        try:
+            self._cprofile.dump_stats(self.cprofile_path)
+            self.check.log.info("cProfile stats of %s runs dumped to %s", self.cprofile_runs, self.cprofile_path)
+        except Exception as e:
+            self.check.log.warning("Unable to dump cProfile stats to %s: %s", self.cprofile_path, e)
+        self._cprofile = None
+
+    def _submit(self, run_time, cpu_time):
+        tags = ['check:{}'.format(self.check.name)]
+        self._gauge('datadog.check.run_time', run_time, tags)
+        self._gauge('datadog.check.cpu_time', cpu_time, tags)
+        for method_tag, seconds in self.submission_times.iteritems():
+            self._gauge('datadog.check.submission_time', seconds, tags + ['method:{}'.format(method_tag)])
+        self._gauge('datadog.check.samples', self.samples, tags)
+        self._gauge('datadog.check.contexts', len(self.contexts), tags)
+
+    def _gauge(self, name, value, tags):
+        self._submit_metric(self.gauge_type, name, value, tags=tags)
@@ -22,11 +22,18 @@
 
 # flake8: noqa
 
+import collections
 import Queue
 import sys
 import threading
+import time
 import traceback
 
+try:
+    import datadog_agent
+except ImportError:
+    from ...stubs import datadog_agent
+
 
 # Item pushed on the work queue to tell the worker threads to terminate
 SENTINEL = "QUIT"
@@ -630,6 +637,319 @@ class OrderedResultCollector(AbstractResultCollector):
                     self._to_notify._set_value(lst)
 
 
+## Shared pool
+#
+# A SharedPool is a fixed set of worker threads shared by all the checks
+# of the process (see get_shared_pool()). Each check submits its jobs
+# through its own SharedPoolClient, which bounds how many of its jobs are
+# queued or running at the same time (its quota): the other ones wait in
+# the backlog of the client, so a slow check can't starve the others.
+#
+# Python threads can't be killed: a job running for longer than its
+# timeout is cancelled by setting a TimeoutError as its result, and its
+# worker is retired (it will exit once the job returns) and replaced by a
+# new one, so the pool keeps its capacity. The job keeps the slot of its
+# client until it returns, so a client never runs more than `quota` jobs.
+
+class CancelledError(Exception):
+    """Result of a job cancelled before it completed"""
+    pass
+
+
+# States of a SharedJob
+BACKLOG, QUEUED, RUNNING, DONE, CANCELLED = range(5)
+
+
+class SharedApplyResult(ApplyResult):
+    """ApplyResult of a SharedJob, the job can be cancelled"""
+    def __init__(self, callback=None):
+        ApplyResult.__init__(self, callback=callback)
+        self._job = None
+
+    def cancel(self):
+        """Cancel the job if it's not completed yet, return whether it
+        was cancelled"""
+        return self._job.client.pool._cancel(self._job, CancelledError("Job cancelled"))
+
+
+class SharedJob(Job):
+    """Job submitted by a SharedPoolClient"""
+    def __init__(self, client, func, args, kwds, apply_result, timeout):
+        Job.__init__(self, func, args, kwds, apply_result)
+        self.client = client
+        self.timeout = timeout
+        self.submitted = time.time()
+        self.started = None
+        self.state = BACKLOG
+        self.worker = None
+
+    def process(self):
+        pool = self.client.pool
+        if not pool._start_job(self):
+            return
+        try:
+            result = self._func(*self._args, **self._kwds)
+        except:
+            if pool._finish_job(self):
+                self._result._set_exception()
+        else:
+            if pool._finish_job(self):
+                self._result._set_value(result)
+
+
+class SharedPoolWorker(threading.Thread):
+    """Worker thread of a SharedPool, exits after its current job once
+    retired"""
+    def __init__(self, workq, *args, **kwds):
+        threading.Thread.__init__(self, *args, **kwds)
+        self.daemon = True
+        self._workq = workq
+        self.retired = False
+
+    def run(self):
+        while not self.retired:
+            workunit = self._workq.get()
+            if is_sentinel(workunit):
+                break
+            workunit.process()
+
+
+class SharedPoolClient(object):
+    """
+    Submits the jobs of a check to a SharedPool, with at most `quota` of
+    them queued or running at the same time. `timeout` is the default
+    timeout of the jobs, in seconds, enforced by cancel_expired()
+    """
+    def __init__(self, pool, name, quota, timeout=None):
+        self.pool = pool
+        self.name = name
+        self.quota = quota
+        self.timeout = timeout
+        self.timeouts = 0
+        # guarded by the lock of the pool
+        self._backlog = collections.deque()
+        self._active = 0  # jobs queued or running
+        self._running = 0
+        self._latencies = []  # time spent waiting by the jobs started since the last stats()
+
+    def apply_async(self, func, args=(), kwds=dict(), callback=None, timeout=None):
+        """Submit func(*args, **kwds), same as Pool.apply_async(). The
+        job is cancelled by cancel_expired() if it runs for longer than
+        `timeout` seconds (defaults to the timeout of the client)"""
+        apply_result = SharedApplyResult(callback=callback)
+        job = SharedJob(self, func, args, kwds, apply_result,
+                        timeout if timeout is not None else self.timeout)
+        apply_result._job = job
+        self.pool._submit(job)
+        return apply_result
+
+    def cancel_expired(self):
+        """Cancel the jobs of the client running for longer than their
+        timeout, return how many were cancelled"""
+        return self.pool.cancel_expired(self)
+
+    def cancel_pending(self):
+        """Cancel the jobs of the client which didn't start yet"""
+        with self.pool._lock:
+            pending = list(self._backlog)
+        pending.extend(self.pool._queued_jobs(self))
+        for job in pending:
+            self.pool._cancel(job, CancelledError("Job cancelled"))
+
+    def qsize(self):
+        """Number of jobs of the client waiting to run"""
+        with self.pool._lock:
+            return len(self._backlog) + self._active - self._running
+
+    def stats(self):
+        """Return the queue depth and latency of the client since the
+        last call"""
+        with self.pool._lock:
+            latencies, self._latencies = self._latencies, []
+            return {
+                'backlog': len(self._backlog),
+                'queued': self._active - self._running,
+                'running': self._running,
+                'timeouts': self.timeouts,
+                'max_latency': max(latencies) if latencies else 0.0,
+                'avg_latency': sum(latencies) / len(latencies) if latencies else 0.0,
+            }
+
+    def submit_stats(self, gauge, tags=None):
+        """Submit the stats of the client and of the pool with the
+        `gauge` function of a check"""
+        tags = list(tags or []) + ['pool_client:%s' % self.name]
+        for key, value in self.stats().iteritems():
+            gauge('datadog.check.shared_pool.%s' % key, value, tags=tags)
+        for key, value in self.pool.stats().iteritems():
+            gauge('datadog.check.shared_pool.%s' % key, value, tags=tags)
+
+    def close(self):
+        """Cancel the pending jobs of the client"""
+        self.cancel_pending()
+
+
+class SharedPool(object):
+    """Pool of worker threads shared by several SharedPoolClients"""
+    def __init__(self, nworkers, name="SharedPool"):
+        self.name = name
+        self._workq = Queue.Queue()
+        self._lock = threading.Lock()
+        self._workers = []
+        self._running = set()
+        self._retired = set()  # retired workers still stuck with their job
+        self._worker_idx = 0
+        with self._lock:
+            for _ in xrange(nworkers):
+                self._start_worker()
+
+    def client(self, name, quota, timeout=None):
+        """Return a new client submitting at most `quota` jobs at the
+        same time"""
+        return SharedPoolClient(self, name, quota, timeout)
+
+    def _start_worker(self):
+        thr = SharedPoolWorker(self._workq, name="Worker-%s-%d" % (self.name, self._worker_idx))
+        self._worker_idx += 1
+        thr.start()
+        self._workers.append(thr)
+
+    def _submit(self, job):
+        client = job.client
+        with self._lock:
+            if client._active < client.quota:
+                client._active += 1
+                job.state = QUEUED
+                self._workq.put(job)
+            else:
+                client._backlog.append(job)
+
+    def _release_slot(self, job):
+        """Release the slot of a queued or running job, and queue the next
+        job of its client. The lock must be held"""
+        client = job.client
+        client._active -= 1
+        if client._backlog and client._active < client.quota:
+            next_job = client._backlog.popleft()
+            next_job.state = QUEUED
+            client._active += 1
+            self._workq.put(next_job)
+
+    def _start_job(self, job):
+        with self._lock:
+            if job.state != QUEUED:
+                # cancelled while queued
+                return False
+            job.state = RUNNING
+            job.started = time.time()
+            job.worker = threading.current_thread()
+            job.client._running += 1
+            job.client._latencies.append(job.started - job.submitted)
+            self._running.add(job)
+            return True
+
+    def _finish_job(self, job):
+        """Return whether the job completed, False if it was cancelled
+        while running"""
+        with self._lock:
+            if job.state != RUNNING:
+                # cancelled while running, its slot is only released now
+                job.client._running -= 1
+                self._release_slot(job)
+                return False
+            job.state = DONE
+            job.client._running -= 1
+            self._running.discard(job)
+            self._release_slot(job)
+            return True
+
+    def _cancel(self, job, error):
+        with self._lock:
+            if job.state in (DONE, CANCELLED):
+                return False
+            if job.state == BACKLOG:
+                job.client._backlog.remove(job)
+            elif job.state == RUNNING:
+                # the worker is stuck with the job, replace it. The slot of
+                # the job is released by _finish_job() once it returns
+                self._running.discard(job)
+                job.worker.retired = True
+                if job.worker in self._workers:
+                    self._retired.add(job.worker)
+                    self._workers.remove(job.worker)
+                    self._start_worker()
+            else:
+                self._release_slot(job)
+            job.state = CANCELLED
+
+        try:
+            raise error
+        except:
+            job._result._set_exception()
+        return True
+
+    def _queued_jobs(self, client):
+        with self._workq.mutex:
+            return [job for job in self._workq.queue
+                    if not is_sentinel(job) and job.client is client and job.state == QUEUED]
+
+    def cancel_expired(self, client=None):
+        """Cancel the jobs running for longer than their timeout, only
+        the ones of `client` if given. Return how many were cancelled"""
+        now = time.time()
+        with self._lock:
+            expired = [job for job in self._running
+                       if job.timeout is not None and now - job.started > job.timeout
+                       and (client is None or job.client is client)]
+        cancelled = 0
+        for job in expired:
+            if self._cancel(job, TimeoutError("Job running for more than %ss" % job.timeout)):
+                job.client.timeouts += 1
+                cancelled += 1
+        return cancelled
+
+    def stats(self):
+        """Return the state of the pool"""
+        with self._lock:
+            self._retired = set(t for t in self._retired if t.is_alive())
+            return {
+                'workers': len(self._workers),
+                'busy_workers': len(self._running),
+                'retired_workers': len(self._retired),
+                'queue_size': self._workq.qsize(),
+            }
+
+    def terminate(self):
+        """Stop the worker threads once they're done with their current
+        job, the pool can't be used afterwards"""
+        with self._lock:
+            workers, self._workers = self._workers, []
+        for _ in workers:
+            self._workq.put(SENTINEL)
+        return workers
+
+
+_shared_pool = None
+_shared_pool_lock = threading.Lock()
+
+# Number of threads of the shared pool, unless `shared_pool_size` is set in
+# the configuration of the agent
+DEFAULT_SHARED_POOL_SIZE = 16
+
+
+def get_shared_pool(nworkers=None):
+    """Return the SharedPool of the process, it is created with `nworkers`
+    threads on the first call (defaults to the `shared_pool_size` option of
+    the agent, or DEFAULT_SHARED_POOL_SIZE)"""
+    global _shared_pool
+    with _shared_pool_lock:
+        if _shared_pool is None:
+            if nworkers is None:
+                nworkers = int(datadog_agent.get_config('shared_pool_size') or DEFAULT_SHARED_POOL_SIZE)
+            _shared_pool = SharedPool(nworkers)
+        return _shared_pool
+
+
 def _test():
     """Some tests"""
     import thread
@@ -12,29 +12,31 @@ class Scraper(PrometheusScraper):
         super(Scraper, self).__init__()
         self.check = check
 
-    def _submit_gauge(self, metric_name, val, metric, custom_tags=None, hostname=None):
+    def _submit_gauge(self, metric_name, val, metric, custom_tags=None, hostname=None, tags=None):
         """
         Submit a metric as a gauge, additional tags provided will be added to
         the ones from the label provided via the metrics object.
 
         `custom_tags` is an array of 'tag:value' that will be added to the
         metric when sending the gauge to Datadog.
+        `tags` are the tags already rendered for the metric, see `_get_metric_tags`.
+        They're shared and immutable.
         """
-        _tags = []
-        if custom_tags is not None:
-            _tags += custom_tags
-        for label in metric.label:
-            if self.exclude_labels is None or label.name not in self.exclude_labels:
-                tag_name = label.name
-                if self.labels_mapper is not None and label.name in self.labels_mapper:
-                    tag_name = self.labels_mapper[label.name]
-                _tags.append('{}:{}'.format(tag_name, label.value))
+        _tags = self._get_metric_tags(metric, custom_tags) if tags is None else tags
         _tags = self._finalize_tags_to_submit(_tags, metric_name, val, metric, custom_tags=custom_tags, hostname=hostname)
-        self.check.gauge('{}.{}'.format(self.NAMESPACE, metric_name), val, _tags, hostname=hostname)
+        name = '{}.{}'.format(self.NAMESPACE, metric_name)
+        self._record_gauge(name, val, _tags, hostname=hostname)
+        self.check.gauge(name, val, _tags, hostname=hostname)
 
     def _submit_service_check(self, *args, **kwargs):
         self.check.service_check(*args, **kwargs)
 
+    def _submit_debug_gauge(self, *args, **kwargs):
+        self.check.gauge(*args, **kwargs)
+
+    def _submit_cached_gauge(self, *args, **kwargs):
+        self.check.gauge(*args, **kwargs)
+
 
 class GenericPrometheusCheck(AgentCheck):
     """
@@ -50,6 +52,10 @@ class GenericPrometheusCheck(AgentCheck):
         - bar
         - foo
     """
+    # Propagated to the scrapers, see `PrometheusScraper.FAST_TEXT_PARSER` and `SKIP_UNHANDLED_FAMILIES`
+    FAST_TEXT_PARSER = False
+    SKIP_UNHANDLED_FAMILIES = False
+
     def __init__(self, name, init_config, agentConfig, instances=None, default_instances={}, default_namespace=""):
         super(GenericPrometheusCheck, self).__init__(name, init_config, agentConfig, instances)
         self.scrapers_map = {}
@@ -92,6 +98,8 @@ class GenericPrometheusCheck(AgentCheck):
         # Otherwise we create the scraper
         scraper = Scraper(self)
         scraper.NAMESPACE = namespace
+        scraper.FAST_TEXT_PARSER = self.FAST_TEXT_PARSER
+        scraper.SKIP_UNHANDLED_FAMILIES = self.SKIP_UNHANDLED_FAMILIES
         # Metrics are preprocessed if no mapping
         metrics_mapper = {}
         # We merge list and dictionnaries from optional defaults & instance settings
@@ -117,6 +125,10 @@ class GenericPrometheusCheck(AgentCheck):
         scraper.ssl_cert = instance.get("ssl_cert", default_instance.get("ssl_cert", None))
         scraper.ssl_private_key = instance.get("ssl_private_key", default_instance.get("ssl_private_key", None))
         scraper.ssl_ca_cert = instance.get("ssl_ca_cert", default_instance.get("ssl_ca_cert", None))
+        scraper.send_debug_metrics = instance.get("send_debug_metrics", default_instance.get("send_debug_metrics", False))
+        scraper.cache_unchanged_payloads = instance.get(
+            "cache_unchanged_payloads", default_instance.get("cache_unchanged_payloads", False))
+        scraper.prometheus_timeout = instance.get("prometheus_timeout", default_instance.get("prometheus_timeout", 1))
 
         self.scrapers_map[endpoint] = scraper
 
@@ -2,16 +2,24 @@
 # All rights reserved
 # Licensed under a 3-clause BSD style license (see LICENSE)
 
-from fnmatch import fnmatchcase
-import requests
-from collections import defaultdict
-from google.protobuf.internal.decoder import _DecodeVarint32  # pylint: disable=E0611,E0401
-from ...utils.prometheus import metrics_pb2
-
-from prometheus_client.parser import text_fd_to_metric_families
+from fnmatch import translate
+import re
+from collections import OrderedDict, defaultdict, namedtuple
+from itertools import chain
 
 # toolkit
 from .. import AgentCheck
+from ...utils.containers import ImmutableList, LRUCache
+from ...utils.lazy import lazy_import
+from ...utils.payload_cache import PayloadCache
+from .text_parser import LabelList, filter_metric_families, parse_text_metric_families
+
+# Only imported when first used: checks using the fast text parser never need protobuf nor prometheus_client
+requests = lazy_import('requests')
+protobuf_decoder = lazy_import('google.protobuf.internal.decoder')
+protobuf_message = lazy_import('google.protobuf.message')
+prometheus_parser = lazy_import('prometheus_client.parser')
+metrics_pb2 = lazy_import('datadog_checks.utils.prometheus.metrics_pb2')
 
 
 class PrometheusFormat:
@@ -27,6 +35,20 @@ class UnknownFormatError(TypeError):
     pass
 
 
+# How `process_metric` handles a family, see `PrometheusScraper._get_metric_handler`
+MetricHandler = namedtuple('MetricHandler', 'ignored mapped_name method wildcard')
+
+
+class MetricTags(ImmutableList):
+    """
+    Rendered tags of a label set, see `PrometheusScraper._get_metric_tags`. `suffixed` holds
+    their variants with a bucket upper bound or quantile tag, by tag name and value.
+    """
+    def __init__(self, tags):
+        super(MetricTags, self).__init__(tags)
+        self.suffixed = {}
+
+
 class PrometheusScraper(object):
     # pylint: disable=E1101
     # This class is not supposed to be used by itself, it provides scraping behavior but
@@ -35,6 +57,24 @@ class PrometheusScraper(object):
     UNWANTED_LABELS = ["le", "quantile"]  # are specifics keys for prometheus itself
     REQUESTS_CHUNK_SIZE = 1024 * 10  # use 10kb as chunk size when using the Stream feature in requests.get
 
+    # If set to True, text payloads are parsed by the fast parser of `text_parser` instead of `prometheus_client`:
+    # lines are tokenized once, families that would not be submitted (see `_is_metric_handled`) and
+    # `exclude_labels` are dropped while parsing, and lightweight objects are yielded instead of protobufs.
+    # Note that excluded labels are then not visible to the magic methods of the check either.
+    FAST_TEXT_PARSER = False
+
+    # If set to True, the families that would not be submitted (see `_is_metric_handled`) are skipped before
+    # being decoded: the name of protobuf messages is peeked from their header, and text lines are filtered
+    # according to the `# HELP`/`# TYPE` lines. This is implied for the text format by `FAST_TEXT_PARSER`.
+    SKIP_UNHANDLED_FAMILIES = False
+
+    # Maximum number of label sets whose rendered tags are cached, see `_get_metric_tags`
+    TAGS_CACHE_SIZE = 20000
+
+    # Maximum number of metrics buffered while waiting for the label join sources of a scrape,
+    # see `_label_join_sources_first`
+    LABEL_JOIN_BUFFER_SIZE = 10000
+
     def __init__(self, *args, **kwargs):
         super(PrometheusScraper, self).__init__(*args, **kwargs)
 
@@ -52,7 +92,11 @@ class PrometheusScraper(object):
         # overloaded/hardcoded in the final check not to be counted as custom metric.
         self.metrics_mapper = {}
 
-        # `_metrics_wildcards` holds the potential wildcards to match for metrics
+        # `_metric_handlers` caches how each family name is handled by `process_metric`, it is
+        # invalidated when `metrics_mapper` or `ignore_metrics` change (see `_get_metric_handler`)
+        self._metric_handlers = {}
+        self._metric_handlers_fingerprint = None
+        # `_metrics_wildcards` holds the wildcards of the mapper compiled as a single regex
         self._metrics_wildcards = None
 
         # `label_joins` holds the configuration for extracting 1:1 labels from
@@ -66,28 +110,23 @@ class PrometheusScraper(object):
         self.label_joins = {}
 
         # `_label_mapping` holds the additionals label info to add for a specific
-        # label value, example:
+        # label value, along with the generation (scrape number) it was last seen in.
+        # Values are ordered from the least recently seen, example:
         # self._label_mapping = {
-        #     'pod': {
-        #         'dd-agent-9s1l1': [("node","yolo"),("host_ip","yey")]
-        #     }
+        #     'pod': OrderedDict({
+        #         'dd-agent-9s1l1': (3, (("node","yolo"),("host_ip","yey")))
+        #     })
         # }
         self._label_mapping = {}
-
-        # `_active_label_mapping` holds a dictionary of label values found during the run
-        # to cleanup the label_mapping of unused values, example:
-        # self._active_label_mapping = {
-        #     'pod': {
-        #         'dd-agent-9s1l1': True
-        #     }
-        # }
-        self._active_label_mapping = {}
+        self._label_generation = 0
+        # `_refreshed_labels` holds the labels whose mapping was refreshed during the scrape
+        self._refreshed_labels = set()
+        # `_absent_label_join_sources` holds the label join sources missing from the last scrape
+        self._absent_label_join_sources = set()
 
         # `_watched_labels` holds the list of label to watch for enrichment
         self._watched_labels = set()
 
-        self._dry_run = True
-
         # Some metrics are ignored because they are duplicates or introduce a
         # very high cardinality. Metrics included in this list will be silently
         # skipped without a 'Unable to handle metric' debug line in the logs
@@ -132,6 +171,46 @@ class PrometheusScraper(object):
         # Extra http headers to be sent when polling endpoint
         self.extra_headers = {}
 
+        # Timeout of the requests polling the endpoint, in seconds. Can also be
+        # a (connect timeout, read timeout) tuple, see the requests documentation.
+        self.prometheus_timeout = 1
+
+        # `_http_session` is kept across runs so that the connections to the endpoint (and their TLS
+        # handshake) are reused, it is rebuilt when the ssl settings or extra headers change
+        # (see `_get_http_session`)
+        self._http_session = None
+        self._http_session_settings = None
+
+        # If set to True, protobuf payloads are decoded incrementally from the raw response
+        # stream instead of loading the whole `response.content` in memory: peak memory is
+        # then bounded by the size of the largest MetricFamily instead of the whole payload.
+        self.protobuf_streaming = False
+
+        # If set to True, endpoints are polled with conditional requests (ETag/Last-Modified) and
+        # when the payload did not change, the gauges submitted for the previous one are submitted
+        # again without parsing it. Only scrapes whose submissions depend on the payload alone are
+        # cached: not the ones calling a metric method of the check.
+        # The whole payload is read to be hashed, `protobuf_streaming` is ignored.
+        self.cache_unchanged_payloads = False
+
+        # Submit `<NAMESPACE>.prometheus.*` metrics about the scrapes, to help tuning the check
+        self.send_debug_metrics = False
+
+        # `_tags_cache` holds the tags rendered from the labels of the metrics, it is invalidated
+        # when `labels_mapper` or `exclude_labels` change (see `_check_tags_cache`)
+        self._tags_cache = LRUCache(self.TAGS_CACHE_SIZE)
+        self._tags_cache_fingerprint = None
+        # `_suffix_tags` interns the `upper_bound:` and `quantile:` tags of histograms and summaries
+        self._suffix_tags = {}
+
+        # `_skipped` counts the families, and their bytes, skipped without being decoded during the current scrape
+        self._skipped = {'families': 0, 'bytes': 0}
+
+        # `_payload_cache` holds the gauges submitted for the last payload of each endpoint,
+        # recorded in `_batch` during the scrape (see `cache_unchanged_payloads`)
+        self._payload_cache = PayloadCache()
+        self._batch = None
+
     def parse_metric_family(self, response):
         """
         Parse the MetricFamily from a valid requests.Response object to provide a MetricFamily object (see [0])
@@ -140,6 +219,7 @@ class PrometheusScraper(object):
 
         The protobuf format directly parse the response.content property searching for Prometheus messages of type
         MetricFamily [0] delimited by a varint32 [1] when the content-type is a `application/vnd.google.protobuf`.
+        If `protobuf_streaming` is set, the messages are decoded incrementally from response.raw instead.
 
         [0] https://github.com/prometheus/client_model/blob/086fe7ca28bde6cec2acd5223423c1475a362858/metrics.proto#L76-%20%20L81
         [1] https://developers.google.com/protocol-buffers/docs/reference/java/com/google/protobuf/AbstractMessageLite#writeDelimitedTo(java.io.OutputStream)
@@ -147,18 +227,15 @@ class PrometheusScraper(object):
         :param response: requests.Response
         :return: metrics_pb2.MetricFamily()
         """
-        if 'application/vnd.google.protobuf' in response.headers['Content-Type']:
-            n = 0
-            buf = response.content
-            while n < len(buf):
-                msg_len, new_pos = _DecodeVarint32(buf, n)
-                n = new_pos
-                msg_buf = buf[n:n+msg_len]
-                n += msg_len
+        keep_family = self._is_metric_handled if self.SKIP_UNHANDLED_FAMILIES else None
 
-                message = metrics_pb2.MetricFamily()
-                message.ParseFromString(msg_buf)
+        if 'application/vnd.google.protobuf' in response.headers['Content-Type']:
+            if self.protobuf_streaming and not self.cache_unchanged_payloads:
+                messages = self._parse_delimited_stream(response.raw, keep_family)
+            else:
+                messages = self._parse_delimited_buffer(response.content, keep_family)
 
+            for message in messages:
                 # Lookup type overrides:
                 if self.type_overrides and message.name in self.type_overrides:
                     new_type = self.type_overrides[message.name]
@@ -168,13 +245,26 @@ class PrometheusScraper(object):
                         self.log.debug("type override %s for %s is not a valid type name" % (new_type, message.name))
                 yield message
 
+        elif 'text/plain' in response.headers['Content-Type'] and self.FAST_TEXT_PARSER:
+            # labels the scraper itself relies on are never dropped
+            exclude_labels = set(self.exclude_labels or []) - self._watched_labels - set([self.label_to_hostname])
+            for message in parse_text_metric_families(response.iter_lines(chunk_size=self.REQUESTS_CHUNK_SIZE),
+                                                      type_overrides=self.type_overrides,
+                                                      keep_family=self._is_metric_handled,
+                                                      exclude_labels=exclude_labels,
+                                                      skipped=self._skipped):
+                yield message
+
         elif 'text/plain' in response.headers['Content-Type']:
             messages = defaultdict(list)  # map with the name of the element (before the labels)
             # and the list of occurrences with labels and values
 
             obj_map = {}  # map of the types of each metrics
             obj_help = {}  # help for the metrics
-            for metric in text_fd_to_metric_families(response.iter_lines(chunk_size=self.REQUESTS_CHUNK_SIZE)):
+            lines = response.iter_lines(chunk_size=self.REQUESTS_CHUNK_SIZE)
+            if keep_family is not None:
+                lines = filter_metric_families(lines, keep_family, skipped=self._skipped)
+            for metric in prometheus_parser.text_fd_to_metric_families(lines):
                 metric_name = "%s_bucket" % metric.name if metric.type == "histogram" else metric.name
                 metric_type = self.type_overrides.get(metric_name, metric.type)
                 if metric_type == "untyped" or metric_type not in self.METRIC_TYPES:
@@ -197,6 +287,132 @@ class PrometheusScraper(object):
             raise UnknownFormatError('Unsupported content-type provided: {}'.format(
                 response.headers['Content-Type']))
 
+    @staticmethod
+    def _peek_family_name(buf, start, end):
+        """
+        Return the name of the serialized MetricFamily starting at `start` without decoding it, None if
+        the name is not the first field or not entirely in `buf[start:end]`
+        """
+        # field number 1 (name) with the wire type 2 (length-delimited)
+        if start >= end or ord(buf[start]) != 0x0A:
+            return None
+        try:
+            name_len, name_start = protobuf_decoder._DecodeVarint32(buf, start + 1)
+        except IndexError:
+            return None
+        if name_start + name_len > end:
+            return None
+        return buf[name_start:name_start + name_len]
+
+    def _parse_delimited_buffer(self, buf, keep_family=None):
+        """
+        Parse the varint32 delimited MetricFamily messages of a fully loaded payload,
+        skipping without decoding them the families `keep_family` rejects
+        """
+        n = 0
+        while n < len(buf):
+            msg_len, new_pos = protobuf_decoder._DecodeVarint32(buf, n)
+            msg_start = new_pos
+            n = msg_start + msg_len
+
+            if keep_family is not None:
+                name = self._peek_family_name(buf, msg_start, n)
+                if name is not None and not keep_family(name):
+                    self._skipped['families'] += 1
+                    self._skipped['bytes'] += n - msg_start
+                    continue
+
+            message = metrics_pb2.MetricFamily()
+            message.ParseFromString(buf[msg_start:n])
+            yield message
+
+    def _parse_delimited_stream(self, stream, keep_family=None):
+        """
+        Parse the varint32 delimited MetricFamily messages incrementally from a file-like `stream`
+        (usually the urllib3 response behind `requests.Response.raw`).
+
+        Data is read by chunks of REQUESTS_CHUNK_SIZE in a single reusable bytearray that only
+        holds the message being decoded and the beginning of the next one. Messages are parsed
+        from zero-copy `buffer` views of it, so no per-message slice is allocated.
+        The families `keep_family` rejects are discarded as they are read, without being decoded nor buffered.
+        """
+        buf = bytearray()
+        pos = 0
+        to_discard = 0  # remaining bytes of a skipped family, not read yet
+        eof = False
+        while True:
+            msg_len = None
+            try:
+                msg_len, msg_start = protobuf_decoder._DecodeVarint32(buffer(buf), pos)
+            except IndexError:
+                # The varint header is not fully available yet
+                pass
+
+            if msg_len is not None:
+                msg_end = msg_start + msg_len
+                if keep_family is not None:
+                    name = self._peek_family_name(buffer(buf), msg_start, min(msg_end, len(buf)))
+                    if name is not None and not keep_family(name):
+                        self._skipped['families'] += 1
+                        self._skipped['bytes'] += msg_len
+                        if msg_end <= len(buf):
+                            pos = msg_end
+                        else:
+                            to_discard = msg_end - len(buf)
+                            pos = len(buf)
+                        continue
+
+                if msg_end <= len(buf):
+                    message = metrics_pb2.MetricFamily()
+                    message.ParseFromString(buffer(buf, msg_start, msg_len))
+                    pos = msg_end
+                    yield message
+                    continue
+
+            if eof:
+                if pos < len(buf) or to_discard:
+                    raise protobuf_message.DecodeError("Truncated protobuf payload: {} trailing bytes could not be decoded".format(
+                        len(buf) - pos + to_discard))
+                return
+
+            # Drop the consumed messages before reading more data, to keep the buffer bounded
+            if pos:
+                del buf[:pos]
+                pos = 0
+            chunk = stream.read(self.REQUESTS_CHUNK_SIZE, decode_content=True)
+            if not chunk:
+                eof = True
+            elif to_discard >= len(chunk):
+                to_discard -= len(chunk)
+            else:
+                buf.extend(chunk[to_discard:] if to_discard else chunk)
+                to_discard = 0
+
+    @staticmethod
+    def _get_labels_key(labels):
+        """
+        Hashable key identifying a series by its labels, ignoring the prometheus specific ones (`le`, `quantile`)
+        """
+        return tuple(sorted((k, v) for k, v in labels.iteritems() if k not in PrometheusScraper.UNWANTED_LABELS))
+
+    @staticmethod
+    def _index_metric_values_by_labels(messages, metric_name):
+        """
+        Index the values of `metric_name` by labels key, the first occurrence of a series wins
+
+        :param messages: dictionary as metric_name: [{labels: {}, value: 10}]
+        :param metric_name: str as metric name
+        :return: dictionary as labels key: value, None if the metric is absent from `messages`
+        """
+        if metric_name not in messages:
+            return None
+        index = {}
+        for elt in messages[metric_name]:
+            key = PrometheusScraper._get_labels_key(elt["labels"])
+            if key not in index:
+                index[key] = elt["value"]
+        return index
+
     @staticmethod
     def get_metric_value_by_labels(messages, _metric, _m, metric_suffix):
         """
@@ -207,13 +423,9 @@ class PrometheusScraper(object):
         :return: value of the metric_name matched by the labels
         """
         metric_name = '{}_{}'.format(_m, metric_suffix)
-        expected_labels = set([(k, v) for k, v in _metric["labels"].iteritems()
-                               if k not in PrometheusScraper.UNWANTED_LABELS])
+        expected_labels = PrometheusScraper._get_labels_key(_metric["labels"])
         for elt in messages[metric_name]:
-            current_labels = set([(k, v) for k, v in elt["labels"].iteritems()
-                                  if k not in PrometheusScraper.UNWANTED_LABELS])
-            # As we have two hashable objects we can compare them without any side effects
-            if current_labels == expected_labels:
+            if PrometheusScraper._get_labels_key(elt["labels"]) == expected_labels:
                 return float(elt["value"])
 
         raise AttributeError("cannot find expected labels for metric %s with suffix %s" % (metric_name, metric_suffix))
@@ -222,75 +434,75 @@ class PrometheusScraper(object):
         """
         Extracts MetricFamily objects from the maps generated by parsing the
         strings in _extract_metrics_from_string
+
+        Buckets and quantiles are grouped by series, and matched to their `_count` and `_sum`
+        samples, through hash indexes keyed by labels so the reassembly stays linear.
         """
         _obj = metrics_pb2.MetricFamily()
         _obj.name = _m
-        _obj.type = self.METRIC_TYPES.index(obj_map[_m])
+        _type = obj_map[_m]
+        _obj.type = self.METRIC_TYPES.index(_type)
         if _m in obj_help:
             _obj.help = obj_help[_m]
         # trick for histograms
         _newlbl = _m
-        if obj_map[_m] == 'histogram':
+        if _type == 'histogram':
             _newlbl = '{}_bucket'.format(_m)
+
+        grouped = _type in ['summary', 'histogram']
+        counts, sums, series = None, None, None
+        if grouped:
+            counts = self._index_metric_values_by_labels(messages, '{}_count'.format(_m))
+            sums = self._index_metric_values_by_labels(messages, '{}_sum'.format(_m))
+            series = {}
+
         # Loop through the array of metrics ({labels, value}) built earlier
         for _metric in messages[_newlbl]:
+            _labels = _metric['labels']
+            is_new_series = True
             # in the case of quantiles and buckets, they need to be grouped by labels
-            if obj_map[_m] in ['summary', 'histogram'] and len(_obj.metric) > 0:
-                _label_exists = False
-                _metric_minus = {k:v for k,v in _metric['labels'].items() if k not in ['quantile', 'le']}
-                _metric_idx = 0
-                for mls in _obj.metric:
-                    _tmp_lbl = {idx.name:idx.value for idx in mls.label}
-                    if _metric_minus == _tmp_lbl:
-                        _label_exists = True
-                        break
-                    _metric_idx = _metric_idx + 1
-                if _label_exists:
-                    _g = _obj.metric[_metric_idx]
+            if grouped:
+                key = self._get_labels_key(_labels)
+                _g = series.get(key)
+                if _g is None:
+                    _g = series[key] = _obj.metric.add()
+                    # fill the count and sum of the series once
+                    _values = _g.summary if _type == 'summary' else _g.histogram
+                    if counts is not None:
+                        if key not in counts:
+                            raise AttributeError("cannot find expected labels for metric %s_count with suffix count"
+                                                 % _m)
+                        _values.sample_count = long(float(counts[key]))
+                    if sums is not None:
+                        if key not in sums:
+                            raise AttributeError("cannot find expected labels for metric %s_sum with suffix sum" % _m)
+                        _values.sample_sum = float(sums[key])
                 else:
-                    _g = _obj.metric.add()
+                    is_new_series = False
             else:
                 _g = _obj.metric.add()
-            if obj_map[_m] == 'counter':
-                _g.counter.value = float(_metric['value'])
-            elif obj_map[_m] == 'gauge':
-                _g.gauge.value = float(_metric['value'])
-            elif obj_map[_m] == 'summary':
-                if '{}_count'.format(_m) in messages:
-                    _g.summary.sample_count = long(self.get_metric_value_by_labels(messages, _metric, _m, 'count'))
-                if '{}_sum'.format(_m) in messages:
-                    _g.summary.sample_sum = self.get_metric_value_by_labels(messages, _metric, _m, 'sum')
+                if _type == 'counter':
+                    _g.counter.value = float(_metric['value'])
+                elif _type == 'gauge':
+                    _g.gauge.value = float(_metric['value'])
             # TODO: see what can be done with the untyped metrics
-            elif obj_map[_m] == 'histogram':
-                if '{}_count'.format(_m) in messages:
-                    _g.histogram.sample_count = long(self.get_metric_value_by_labels(messages, _metric, _m, 'count'))
-                if '{}_sum'.format(_m) in messages:
-                    _g.histogram.sample_sum = self.get_metric_value_by_labels(messages, _metric, _m, 'sum')
-            # last_metric = len(_obj.metric) - 1
-            # if last_metric >= 0:
-            for lbl in _metric['labels']:
+
+            for lbl, lbl_value in _labels.iteritems():
                 # In the string format, the quantiles are in the labels
                 if lbl == 'quantile':
-                    # _q = _obj.metric[last_metric].summary.quantile.add()
                     _q = _g.summary.quantile.add()
-                    _q.quantile = float(_metric['labels'][lbl])
+                    _q.quantile = float(lbl_value)
                     _q.value = float(_metric['value'])
                 # The upper_bounds are stored as "le" labels on string format
-                elif obj_map[_m] == 'histogram' and lbl == 'le':
-                    # _q = _obj.metric[last_metric].histogram.bucket.add()
+                elif _type == 'histogram' and lbl == 'le':
                     _q = _g.histogram.bucket.add()
-                    _q.upper_bound = float(_metric['labels'][lbl])
+                    _q.upper_bound = float(lbl_value)
                     _q.cumulative_count = long(float(_metric['value']))
-                else:
-                    # labels deduplication
-                    is_in_labels = False
-                    for _existing_lbl in _g.label:
-                        if lbl == _existing_lbl.name:
-                            is_in_labels = True
-                    if not is_in_labels:
-                        _l = _g.label.add()
-                        _l.name = lbl
-                        _l.value = _metric['labels'][lbl]
+                elif is_new_series:
+                    # the other samples of a series share the same labels
+                    _l = _g.label.add()
+                    _l.name = lbl
+                    _l.value = lbl_value
         return _obj
 
     def scrape_metrics(self, endpoint):
@@ -298,29 +510,97 @@ class PrometheusScraper(object):
         Poll the data from prometheus and return the metrics as a generator.
         """
         response = self.poll(endpoint)
+        return self._scrape_response(endpoint, response)
+
+    def _scrape_response(self, endpoint, response):
+        """
+        Parse the `response` polled from `endpoint` and return the metrics as a generator.
+        """
         try:
-            # no dry run if no label joins
-            if not self.label_joins:
-                self._dry_run = False
-            elif not self._watched_labels:
-                # build the _watched_labels set
-                for metric, val in self.label_joins.iteritems():
-                    self._watched_labels.add(val['label_to_match'])
-
-            for metric in self.parse_metric_family(response):
+            self._watched_labels = set(val['label_to_match'] for val in self.label_joins.itervalues())
+            self._label_generation += 1
+            self._refreshed_labels = set()
+
+            self._check_metric_handlers()
+            self._check_tags_cache()
+            self._skipped = {'families': 0, 'bytes': 0}
+            for metric in self._label_join_sources_first(self.parse_metric_family(response)):
                 yield metric
 
-            # Set dry run off
-            self._dry_run = False
-            # Garbage collect unused mapping and reset active labels
-            for metric, mapping in self._label_mapping.items():
-                for key, val in mapping.items():
-                    if key not in self._active_label_mapping[metric]:
-                        del self._label_mapping[metric][key]
-            self._active_label_mapping = {}
+            if self.send_debug_metrics:
+                self._submit_debug_metrics(endpoint)
+
+            self._collect_label_mapping()
         finally:
             response.close()
 
+    def _label_join_sources_first(self, messages):
+        """
+        Yield the `messages` so that the families which may join labels come after the label join sources,
+        their labels being joined in the same scrape: the families read before the last source are buffered.
+        The sources missing from the last scrape aren't waited for, and the buffer is flushed once it holds
+        `LABEL_JOIN_BUFFER_SIZE` metrics: the families read afterwards get the labels of the last scrape.
+        """
+        sources_left = set(self.label_joins) - self._absent_label_join_sources
+        sources_seen = set()
+        pending = []
+        pending_metrics = 0
+        for message in messages:
+            if message.name in self.label_joins:
+                sources_seen.add(message.name)
+                sources_left.discard(message.name)
+                yield message
+            elif not sources_left or self._get_metric_handler(message.name).ignored:
+                yield message
+            else:
+                pending.append(message)
+                pending_metrics += len(message.metric)
+                if pending_metrics >= self.LABEL_JOIN_BUFFER_SIZE:
+                    self.log.debug("Stopped waiting for the label join sources %s, too many metrics were buffered",
+                                   ", ".join(sorted(sources_left)))
+                    sources_left.clear()
+
+            if not sources_left and pending:
+                for pending_message in pending:
+                    yield pending_message
+                pending = []
+
+        for pending_message in pending:
+            yield pending_message
+
+        self._absent_label_join_sources = set(self.label_joins) - sources_seen
+
+    def _collect_label_mapping(self):
+        """
+        Remove the values of the refreshed labels that were not seen during the scrape. They are
+        the first ones of their mapping, so only the removed values are looked at.
+        The mapping of the labels whose sources were all missing from the scrape is removed.
+        """
+        for label_name in self._label_mapping.keys():
+            if label_name not in self._refreshed_labels:
+                del self._label_mapping[label_name]
+                continue
+            mapping = self._label_mapping[label_name]
+            while mapping:
+                value = next(iter(mapping))
+                if mapping[value][0] == self._label_generation:
+                    break
+                del mapping[value]
+
+    def _submit_debug_metrics(self, endpoint, cached=False):
+        """
+        Submit the statistics of the last scrape of `endpoint`, `cached` tells whether its payload was unchanged
+        """
+        tags = ["endpoint:" + endpoint]
+        prefix = "{}.prometheus.".format(self.NAMESPACE)
+        self._submit_debug_gauge(prefix + "skipped_families", self._skipped['families'], tags=tags)
+        if self.cache_unchanged_payloads:
+            self._submit_debug_gauge(prefix + "cached_scrapes", 1 if cached else 0, tags=tags)
+        self._submit_debug_gauge(prefix + "skipped_bytes", self._skipped['bytes'], tags=tags)
+        self._submit_debug_gauge(prefix + "tags_cache.hits", self._tags_cache.hits, tags=tags)
+        self._submit_debug_gauge(prefix + "tags_cache.misses", self._tags_cache.misses, tags=tags)
+        self._submit_debug_gauge(prefix + "tags_cache.size", len(self._tags_cache), tags=tags)
+
     def process(self, endpoint, **kwargs):
         """
         Polls the data from prometheus and pushes them as gauges
@@ -333,44 +613,168 @@ class PrometheusScraper(object):
         if instance:
             kwargs['custom_tags'] = instance.get('tags', [])
 
+        if self.cache_unchanged_payloads:
+            self._process_with_cache(endpoint, **kwargs)
+            return
+
         for metric in self.scrape_metrics(endpoint):
             self.process_metric(metric, **kwargs)
 
+    def _process_with_cache(self, endpoint, **kwargs):
+        """
+        Same as `process`, submitting the gauges of the previous payload again if it did not change
+        """
+        self._check_metric_handlers()
+        self._check_tags_cache()
+        fingerprint = (
+            self.NAMESPACE, self._metric_handlers_fingerprint, self._tags_cache_fingerprint,
+            repr(sorted(self.label_joins.items())), repr(sorted(kwargs.items()))
+        )
+
+        response = self.poll(endpoint, headers=self._payload_cache.request_headers(endpoint, fingerprint))
+        try:
+            batch = self._payload_cache.get(endpoint, response, fingerprint)
+            if batch is not None:
+                for name, val, tags, hostname in batch:
+                    self._submit_cached_gauge(name, val, tags, hostname=hostname)
+                if self.send_debug_metrics:
+                    self._skipped = {'families': 0, 'bytes': 0}
+                    self._submit_debug_metrics(endpoint, cached=True)
+                return
+
+            self._batch = []
+            for metric in self._scrape_response(endpoint, response):
+                self.process_metric(metric, **kwargs)
+            if self._batch is not None:
+                self._payload_cache.set(endpoint, response, self._batch, fingerprint)
+            else:
+                self._payload_cache.discard(endpoint)
+        finally:
+            self._batch = None
+            response.close()
+
+    @property
+    def metrics_mapper(self):
+        return self._metrics_mapper
+
+    @metrics_mapper.setter
+    def metrics_mapper(self, value):
+        self._metrics_mapper = value
+        self._reset_metric_handlers()
+
+    @property
+    def ignore_metrics(self):
+        return self._ignore_metrics
+
+    @ignore_metrics.setter
+    def ignore_metrics(self, value):
+        self._ignore_metrics = value
+        self._reset_metric_handlers()
+
+    def _reset_metric_handlers(self):
+        self._metric_handlers = {}
+        self._metrics_wildcards = None
+
+    def _check_metric_handlers(self):
+        """
+        Reset the handlers cache if `metrics_mapper` or `ignore_metrics` were modified in place,
+        reassigning them resets it directly
+        """
+        fingerprint = (frozenset(self.metrics_mapper.iteritems()), frozenset(self.ignore_metrics))
+        if fingerprint != self._metric_handlers_fingerprint:
+            self._reset_metric_handlers()
+            self._metric_handlers_fingerprint = fingerprint
+
+    def _get_metric_handler(self, name):
+        """
+        Return the MetricHandler of the family `name`, computed once per name:
+            - ignored: the family is in `ignore_metrics`
+            - mapped_name: the datadog name from `metrics_mapper`, if any
+            - method: the magic method named after the family, if any
+            - wildcard: whether the name matches a wildcard of `metrics_mapper`
+        """
+        try:
+            return self._metric_handlers[name]
+        except KeyError:
+            pass
+
+        if self._metrics_wildcards is None:
+            wildcards = [x for x in self.metrics_mapper.keys() if '*' in x]
+            if wildcards:
+                self._metrics_wildcards = re.compile('|'.join('(?:{})'.format(translate(x)) for x in wildcards))
+            else:
+                self._metrics_wildcards = False
+
+        method = getattr(self, name, None)
+        handler = MetricHandler(
+            ignored=name in self.ignore_metrics,
+            mapped_name=self.metrics_mapper.get(name),
+            method=method if callable(method) else None,
+            wildcard=bool(self._metrics_wildcards and self._metrics_wildcards.match(name)),
+        )
+        self._metric_handlers[name] = handler
+        return handler
+
+    def _is_metric_handled(self, name):
+        """
+        Whether a family named `name` can have an effect in `process_metric`: label join source,
+        mapped, matching a wildcard of the mapper, or handled by a magic method, and not ignored.
+        """
+        if name in self.label_joins:
+            return True
+        handler = self._get_metric_handler(name)
+        if handler.ignored:
+            return False
+        return handler.mapped_name is not None or handler.method is not None or handler.wildcard
+
     def store_labels(self, message):
         # If targeted metric, store labels
         if message.name in self.label_joins:
             matching_label = self.label_joins[message.name]['label_to_match']
+            labels_to_get = self.label_joins[message.name]['labels_to_get']
+            mapping = self._label_mapping.get(matching_label)
+            if mapping is None:
+                mapping = self._label_mapping[matching_label] = OrderedDict()
             for metric in message.metric:
                 labels_list = []
                 matching_value = None
                 for label in metric.label:
                     if label.name == matching_label:
                         matching_value = label.value
-                    elif label.name in self.label_joins[message.name]['labels_to_get']:
+                    elif label.name in labels_to_get:
                         labels_list.append((label.name, label.value))
-                try:
-                    self._label_mapping[matching_label][matching_value] = labels_list
-                except KeyError:
-                    if matching_value is not None:
-                        self._label_mapping[matching_label] = {matching_value: labels_list}
+                if matching_value is None:
+                    continue
+                # move the value to the end, the values not seen during the scrape stay first
+                previous = mapping.pop(matching_value, None)
+                if previous is not None and previous[0] == self._label_generation:
+                    # several sources for the same label
+                    labels_list = list(previous[1]) + labels_list
+                mapping[matching_value] = (self._label_generation, tuple(labels_list))
+            self._refreshed_labels.add(matching_label)
+
+    def _get_joined_labels(self, metric):
+        """
+        Return the labels to join to `metric`, as a tuple of (name, value)
+        """
+        joined = ()
+        for label in metric.label:
+            if label.name in self._watched_labels:
+                entry = self._label_mapping.get(label.name, {}).get(label.value)
+                if entry is not None:
+                    joined += entry[1]
+        return joined
 
     def join_labels(self, message):
-        # Filter metric to see if we can enrich with joined labels
-        if self.label_joins:
+        """
+        Add the joined labels to the metrics of `message`. The families submitted by `_submit` get them
+        when their tags are rendered instead, this is only needed for the metric methods of the checks.
+        """
+        if self._watched_labels:
             for metric in message.metric:
-                for label in metric.label:
-                    if label.name in self._watched_labels:
-                        # Set this label value as active
-                        if label.name not in self._active_label_mapping:
-                            self._active_label_mapping[label.name] = {}
-                        self._active_label_mapping[label.name][label.value] = True
-                        # If mapping found add corresponding labels
-                        try:
-                            for label_tuple in self._label_mapping[label.name][label.value]:
-                                extra_label = metric.label.add()
-                                extra_label.name, extra_label.value = label_tuple
-                        except KeyError:
-                            pass
+                for label_tuple in self._get_joined_labels(metric):
+                    extra_label = metric.label.add()
+                    extra_label.name, extra_label.value = label_tuple
 
     def process_metric(self, message, **kwargs):
         """
@@ -384,42 +788,65 @@ class PrometheusScraper(object):
         # If targeted metric, store labels
         self.store_labels(message)
 
-        if message.name in self.ignore_metrics:
+        handler = self._get_metric_handler(message.name)
+        if handler.ignored:
             return  # Ignore the metric
 
-        # Filter metric to see if we can enrich with joined labels
-        self.join_labels(message)
-
         send_histograms_buckets = kwargs.get('send_histograms_buckets', True)
         custom_tags = kwargs.get('custom_tags')
         ignore_unmapped = kwargs.get('ignore_unmapped', False)
 
         try:
-            if not self._dry_run:
-                try:
-                    self._submit(self.metrics_mapper[message.name], message, send_histograms_buckets, custom_tags)
-                except KeyError:
-                    if not ignore_unmapped:
-                        # call magic method (non-generic check)
-                        getattr(self, message.name)(message, **kwargs)
-                    else:
-                        # build the wildcard list if first pass
-                        if self._metrics_wildcards is None:
-                            self._metrics_wildcards = [x for x in self.metrics_mapper.keys() if '*' in x]
-                        # try matching wildcard (generic check)
-                        for wildcard in self._metrics_wildcards:
-                            if fnmatchcase(message.name, wildcard):
-                                self._submit(message.name, message, send_histograms_buckets, custom_tags)
+            if handler.mapped_name is not None:
+                self._submit(handler.mapped_name, message, send_histograms_buckets, custom_tags)
+            elif not ignore_unmapped:
+                # call magic method (non-generic check)
+                if handler.method is None:
+                    getattr(self, message.name)  # raises the AttributeError logged below
+                # the submissions of the method can't be replayed from the payload cache
+                self._batch = None
+                # Filter metric to see if we can enrich with joined labels
+                self.join_labels(message)
+                handler.method(message, **kwargs)
+            elif handler.wildcard:
+                # matching wildcard (generic check)
+                self._submit(message.name, message, send_histograms_buckets, custom_tags)
 
         except AttributeError as err:
             self.log.debug("Unable to handle metric: {} - error: {}".format(message.name, err))
 
+    def _get_http_session(self):
+        """
+        Return the requests.Session used to poll the endpoints, building a new one
+        if the ssl settings or the extra headers changed since the last call:
+        pooled connections were established with the previous ones.
+        """
+        cert = None
+        if isinstance(self.ssl_cert, basestring):
+            cert = self.ssl_cert
+            if isinstance(self.ssl_private_key, basestring):
+                cert = (self.ssl_cert, self.ssl_private_key)
+        verify = True
+        if isinstance(self.ssl_ca_cert, basestring):
+            verify = self.ssl_ca_cert
+
+        settings = (cert, verify, frozenset((self.extra_headers or {}).iteritems()))
+        if self._http_session is None or settings != self._http_session_settings:
+            if self._http_session is not None:
+                self._http_session.close()
+            self._http_session = requests.Session()
+            self._http_session.cert = cert
+            self._http_session.verify = verify
+            self._http_session_settings = settings
+        return self._http_session
+
     def poll(self, endpoint, pFormat=PrometheusFormat.PROTOBUF, headers=None):
         """
         Polls the metrics from the prometheus metrics endpoint provided.
         Defaults to the protobuf format, but can use the formats specified by
         the PrometheusFormat class.
         Custom headers can be added to the default headers.
+        Connections are kept alive and reused across calls, see `_get_http_session`.
 
         Returns a valid requests.Response, raise requests.HTTPError if the status code of the requests.Response
         isn't valid - see response.raise_for_status()
@@ -440,16 +867,9 @@ class PrometheusScraper(object):
                                 'proto=io.prometheus.client.MetricFamily; ' \
                                 'encoding=delimited'
         headers.update(self.extra_headers)
-        cert = None
-        if isinstance(self.ssl_cert, basestring):
-            cert = self.ssl_cert
-            if isinstance(self.ssl_private_key, basestring):
-                cert = (self.ssl_cert, self.ssl_private_key)
-        verify = True
-        if isinstance(self.ssl_ca_cert, basestring):
-            verify = self.ssl_ca_cert
+        session = self._get_http_session()
         try:
-            response = requests.get(endpoint, headers=headers, stream=True, timeout=1, cert=cert, verify=verify)
+            response = session.get(endpoint, headers=headers, stream=True, timeout=self.prometheus_timeout)
         except (requests.exceptions.SSLError):
             self.log.error("Invalid SSL settings for requesting {} endpoint".format(endpoint))
             raise
@@ -515,6 +935,10 @@ class PrometheusScraper(object):
             for label in metric.label:
                 if label.name == self.label_to_hostname:
                     return label.value
+            if self._watched_labels:
+                for name, value in self._get_joined_labels(metric):
+                    if name == self.label_to_hostname:
+                        return value
 
         return hostname
 
@@ -525,21 +949,90 @@ class PrometheusScraper(object):
         """
         return _tags
 
+    def _check_tags_cache(self):
+        """
+        Clear the tags cache if `labels_mapper` or `exclude_labels` changed, and reset its statistics
+        """
+        fingerprint = (frozenset((self.labels_mapper or {}).iteritems()), frozenset(self.exclude_labels or []))
+        if fingerprint != self._tags_cache_fingerprint:
+            self._tags_cache.clear()
+            self._tags_cache_fingerprint = fingerprint
+        self._tags_cache.reset_stats()
+
+    def _get_metric_tags(self, metric, custom_tags=None):
+        """
+        Return the tags of `metric` as a `MetricTags` list: the custom tags followed by its labels
+        and the labels joined to them, renamed with `labels_mapper` and without `exclude_labels`.
+        The rendered tags are cached by custom tags and raw labels, the list is shared and immutable.
+        """
+        label_list = metric.label
+        # the metrics of the fast text parser come with the key of their labels
+        labels = label_list.key if type(label_list) is LabelList else None
+        if labels is None:
+            labels = tuple([(label.name, label.value) for label in label_list])
+        joined = self._get_joined_labels(metric) if self._watched_labels else ()
+        key = (tuple(custom_tags) if custom_tags else (), labels, joined)
+        tags = self._tags_cache.get(key)
+        if tags is None:
+            _tags = list(key[0])
+            for name, value in chain(((label.name, label.value) for label in label_list), joined):
+                if self.exclude_labels is None or name not in self.exclude_labels:
+                    tag_name = name
+                    if self.labels_mapper is not None and name in self.labels_mapper:
+                        tag_name = self.labels_mapper[name]
+                    _tags.append('{}:{}'.format(tag_name, value))
+            tags = MetricTags(_tags)
+            self._tags_cache.set(key, tags)
+        return tags
+
+    def _get_suffixed_tags(self, tags, name, value):
+        """
+        Return the `MetricTags` of a bucket upper bound or a quantile: `tags` followed by the `name:value` tag.
+        They're cached with `tags`.
+        """
+        by_value = tags.suffixed.setdefault(name, {})
+        try:
+            return by_value[value]
+        except KeyError:
+            suffixed = by_value[value] = MetricTags(tags + [self._get_suffix_tag(name, value)])
+            return suffixed
+
+    def _get_suffix_tag(self, name, value):
+        """
+        Return the interned `name:value` tag of a bucket upper bound or a quantile
+        """
+        try:
+            return self._suffix_tags[(name, value)]
+        except KeyError:
+            tag = self._suffix_tags[(name, value)] = '{}:{}'.format(name, value)
+            return tag
+
+    def _record_gauge(self, name, val, tags, hostname=None):
+        """
+        Record a gauge submitted during the current scrape, to submit it again if the payload doesn't change
+        """
+        if self._batch is not None:
+            self._batch.append((name, val, tags, hostname))
+
     def _submit_gauges_from_summary(self, name, metric, custom_tags=None, hostname=None):
         """
         Extracts metrics from a prometheus summary metric and sends them as gauges
         """
         if custom_tags is None:
             custom_tags = []
+        # the tags are rendered once for all the values of the summary
+        tags = self._get_metric_tags(metric, custom_tags)
         # summaries do not have a value attribute
         val = getattr(metric, self.METRIC_TYPES[2]).sample_count
-        self._submit_gauge("{}.count".format(name), val, metric, custom_tags)
+        self._submit_gauge("{}.count".format(name), val, metric, custom_tags, tags=tags)
         val = getattr(metric, self.METRIC_TYPES[2]).sample_sum
-        self._submit_gauge("{}.sum".format(name), val, metric, custom_tags)
+        self._submit_gauge("{}.sum".format(name), val, metric, custom_tags, tags=tags)
+        quantile_name = "{}.quantile".format(name)
         for quantile in getattr(metric, self.METRIC_TYPES[2]).quantile:
             val = quantile.value
             limit = quantile.quantile
-            self._submit_gauge("{}.quantile".format(name), val, metric, custom_tags=custom_tags+["quantile:{}".format(limit)], hostname=hostname)
+            self._submit_gauge(quantile_name, val, metric, custom_tags=custom_tags, hostname=hostname,
+                               tags=self._get_suffixed_tags(tags, "quantile", limit))
 
     def _submit_gauges_from_histogram(self, name, metric, send_histograms_buckets=True, custom_tags=None, hostname=None):
         """
@@ -547,13 +1040,17 @@ class PrometheusScraper(object):
         """
         if custom_tags is None:
             custom_tags = []
+        # the tags are rendered once for all the values of the histogram
+        tags = self._get_metric_tags(metric, custom_tags)
+        count_name = "{}.count".format(name)
         # histograms do not have a value attribute
         val = getattr(metric, self.METRIC_TYPES[4]).sample_count
-        self._submit_gauge("{}.count".format(name), val, metric, custom_tags)
+        self._submit_gauge(count_name, val, metric, custom_tags, tags=tags)
         val = getattr(metric, self.METRIC_TYPES[4]).sample_sum
-        self._submit_gauge("{}.sum".format(name), val, metric, custom_tags)
+        self._submit_gauge("{}.sum".format(name), val, metric, custom_tags, tags=tags)
         if send_histograms_buckets:
             for bucket in getattr(metric, self.METRIC_TYPES[4]).bucket:
                 val = bucket.cumulative_count
                 limit = bucket.upper_bound
-                self._submit_gauge("{}.count".format(name), val, metric, custom_tags=custom_tags+["upper_bound:{}".format(limit)], hostname=hostname)
+                self._submit_gauge(count_name, val, metric, custom_tags=custom_tags, hostname=hostname,
+                                   tags=self._get_suffixed_tags(tags, "upper_bound", limit))
@@ -0,0 +1,301 @@
+# (C) Datadog, Inc. 2018
+# All rights reserved
+# Licensed under a 3-clause BSD style license (see LICENSE)
+"""
+Fast parser for the prometheus text exposition format [0].
+
+Each line is tokenized once, families the caller is not interested in are skipped
+before any object is built, and samples are assembled into lightweight objects
+exposing the subset of the `metrics_pb2.MetricFamily` interface used by the
+prometheus mixin (`name`, `type`, `help`, `metric[].label`, `.gauge.value`,
+`.histogram.bucket`, ...), so no protobuf is constructed.
+
+[0] https://prometheus.io/docs/instrumenting/exposition_formats/#text-format-details
+"""
+import re
+
+# message.type is the index in this array, same as `PrometheusScraper.METRIC_TYPES`
+METRIC_TYPES = ['counter', 'gauge', 'summary', 'untyped', 'histogram']
+
+NAME_RE = re.compile(r'[a-zA-Z_:][a-zA-Z0-9_:]*')
+SAMPLE_RE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)\s*(?:\{(.*)\})?\s*(\S+)(?:\s+\S+)?\s*$')
+LABEL_RE = re.compile(r'\s*([a-zA-Z_][a-zA-Z0-9_]*)\s*=\s*"((?:[^"\\]|\\.)*)"\s*,?')
+ESCAPE_RE = re.compile(r'\\(.)')
+ESCAPES = {'n': '\n', '"': '"', '\\': '\\'}
+
+
+def _unescape(value):
+    if '\\' not in value:
+        return value
+    return ESCAPE_RE.sub(lambda m: ESCAPES.get(m.group(1), '\\' + m.group(1)), value)
+
+
+class Label(object):
+    __slots__ = ('name', 'value')
+
+    def __init__(self, name='', value=''):
+        self.name = name
+        self.value = value
+
+
+class LabelList(list):
+    """
+    List of labels, supporting `add()` like a protobuf repeated field.
+    `key` is a hashable identifying the raw labels of the series, set by the parser
+    and reset by `add()`. The prometheus mixin caches the tags rendered from them by it.
+    """
+    key = None
+
+    def add(self):
+        self.key = None
+        label = Label()
+        self.append(label)
+        return label
+
+
+class Value(object):
+    __slots__ = ('value', )
+
+    def __init__(self, value=0.0):
+        self.value = value
+
+
+class Quantile(object):
+    __slots__ = ('quantile', 'value')
+
+    def __init__(self, quantile, value):
+        self.quantile = quantile
+        self.value = value
+
+
+class Bucket(object):
+    __slots__ = ('upper_bound', 'cumulative_count')
+
+    def __init__(self, upper_bound, cumulative_count):
+        self.upper_bound = upper_bound
+        self.cumulative_count = cumulative_count
+
+
+class Summary(object):
+    __slots__ = ('sample_count', 'sample_sum', 'quantile')
+
+    def __init__(self):
+        self.sample_count = 0
+        self.sample_sum = 0.0
+        self.quantile = []
+
+
+class Histogram(object):
+    __slots__ = ('sample_count', 'sample_sum', 'bucket')
+
+    def __init__(self):
+        self.sample_count = 0
+        self.sample_sum = 0.0
+        self.bucket = []
+
+
+class Metric(object):
+    """
+    One series of a family. Like unset protobuf fields, the value holders not
+    matching the family type read as empty defaults.
+    """
+    counter = gauge = untyped = Value()
+    summary = Summary()
+    histogram = Histogram()
+
+    def __init__(self, labels):
+        self.label = labels
+
+
+class MetricFamily(object):
+    def __init__(self, name, metric_type, help=''):
+        self.name = name
+        self.type = metric_type
+        self.help = help
+        self.metric = []
+
+
+def parse_text_metric_families(lines, type_overrides=None, keep_family=None, exclude_labels=None, skipped=None):
+    """
+    Parse prometheus text format `lines` and yield a MetricFamily-like object per family,
+    untyped families are skipped unless a known type is given by `type_overrides`.
+
+    :param lines: iterable of lines of the payload
+    :param type_overrides: dict as metric name: type name, histograms are looked up as `<name>_bucket`
+    :param keep_family: callable receiving a family name, families it rejects are not parsed
+    :param exclude_labels: collection of label names dropped while parsing
+    :param skipped: optional dict counting the `families` and `bytes` skipped by `keep_family`
+    """
+    type_overrides = type_overrides or {}
+    exclude_labels = exclude_labels or ()
+
+    family = None  # family being parsed, None if the current one is skipped
+    family_name = None
+    declared_type = None  # type announced in the payload, used to attach samples to their family
+    family_type = None
+    series = None  # summary and histogram series of the family, by labels
+    pending_types = {}  # types announced by `# TYPE` lines
+    pending_help = {}
+
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+
+        if line[0] == '#':
+            parts = line.split(None, 3)
+            if len(parts) > 2 and parts[1] == 'TYPE':
+                pending_types[parts[2]] = parts[3] if len(parts) > 3 else 'untyped'
+            elif len(parts) > 2 and parts[1] == 'HELP':
+                pending_help[parts[2]] = _unescape(parts[3]) if len(parts) > 3 else ''
+            continue
+
+        match = SAMPLE_RE.match(line)
+        if match is None:
+            raise ValueError("Invalid line in prometheus text payload: {}".format(line))
+        sample_name, raw_labels, raw_value = match.groups()
+
+        # Find the family of the sample, starting a new one if needed
+        if family_name is None or not _belongs_to(sample_name, family_name, declared_type):
+            if family is not None and family.metric:
+                yield family
+            family, series = None, None
+            family_name, declared_type = _family_of(sample_name, pending_types)
+            pending_types.pop(family_name, None)
+            doc = pending_help.pop(family_name, '')
+
+            override_name = '{}_bucket'.format(family_name) if declared_type == 'histogram' else family_name
+            family_type = type_overrides.get(override_name, declared_type)
+            if family_type != 'untyped' and family_type in METRIC_TYPES:
+                if keep_family is None or keep_family(family_name):
+                    family = MetricFamily(family_name, METRIC_TYPES.index(family_type), doc)
+                    if family_type in ('summary', 'histogram'):
+                        series = {}
+                elif skipped is not None:
+                    skipped['families'] += 1
+
+        if family is None:
+            # skipped family, don't go further than the name
+            if skipped is not None and family_type != 'untyped':
+                skipped['bytes'] += len(line) + 1
+            continue
+
+        labels = LabelList()
+        key = []
+        upper_bound = quantile = None
+        if raw_labels:
+            for label_match in LABEL_RE.finditer(raw_labels):
+                name, value = label_match.groups()
+                if name == 'le' and family_type == 'histogram':
+                    upper_bound = float(value)
+                elif name == 'quantile' and family_type == 'summary':
+                    quantile = float(value)
+                else:
+                    # series are still told apart by their excluded labels
+                    key.append((name, value))
+                    if name not in exclude_labels:
+                        labels.append(Label(name, _unescape(value)))
+        value = float(raw_value)
+
+        if series is None:
+            labels.key = raw_labels or ''
+            metric = Metric(labels)
+            setattr(metric, family_type, Value(value))
+            family.metric.append(metric)
+            continue
+
+        key = tuple(key)
+        metric = series.get(key)
+        if metric is None:
+            # a string too, so that it can't be mistaken for the labels of a protobuf
+            labels.key = repr(key)
+            metric = series[key] = Metric(labels)
+            setattr(metric, family_type, Summary() if family_type == 'summary' else Histogram())
+            family.metric.append(metric)
+        values = getattr(metric, family_type)
+
+        if sample_name.endswith('_count') and sample_name != family_name:
+            values.sample_count = long(value)
+        elif sample_name.endswith('_sum') and sample_name != family_name:
+            values.sample_sum = value
+        elif upper_bound is not None:
+            values.bucket.append(Bucket(upper_bound, long(value)))
+        elif quantile is not None:
+            values.quantile.append(Quantile(quantile, value))
+
+    if family is not None and family.metric:
+        yield family
+
+
+def _belongs_to(sample_name, family_name, family_type):
+    if sample_name == family_name:
+        return True
+    if family_type in ('summary', 'histogram') and sample_name.startswith(family_name):
+        suffix = sample_name[len(family_name):]
+        return suffix in ('_count', '_sum') or (suffix == '_bucket' and family_type == 'histogram')
+    return False
+
+
+def _family_of(sample_name, types):
+    """
+    Return the family name and type of a sample starting a new family
+    """
+    if sample_name in types:
+        return sample_name, types[sample_name]
+    for suffix in ('_bucket', '_count', '_sum'):
+        if sample_name.endswith(suffix):
+            name = sample_name[:-len(suffix)]
+            if types.get(name) == 'histogram' or (types.get(name) == 'summary' and suffix != '_bucket'):
+                return name, types[name]
+    return sample_name, 'untyped'
+
+
+def filter_metric_families(lines, keep_family, skipped=None):
+    """
+    Filter text format `lines`, dropping the families `keep_family` rejects before they reach a parser.
+    Families are delimited by their `# HELP`/`# TYPE` lines, or by the name of the samples without metadata.
+
+    :param lines: iterable of lines of the payload
+    :param keep_family: callable receiving a family name
+    :param skipped: optional dict counting the `families` and `bytes` dropped
+    """
+    family = None
+    keep = True
+    for line in lines:
+        if line.startswith('#'):
+            parts = line.split(None, 3)
+            if len(parts) > 2 and parts[1] in ('HELP', 'TYPE') and parts[2] != family:
+                family = parts[2]
+                keep = _keep(family, keep_family, skipped)
+        elif line and (family is None or not _is_sample_of(line, family)):
+            match = NAME_RE.match(line)
+            if match is not None:
+                family = match.group()
+                keep = _keep(family, keep_family, skipped)
+
+        if keep:
+            yield line
+        elif skipped is not None:
+            skipped['bytes'] += len(line) + 1
+
+
+def _keep(family, keep_family, skipped):
+    keep = keep_family(family)
+    if not keep and skipped is not None:
+        skipped['families'] += 1
+    return keep
+
+
+def _is_sample_of(line, family):
+    """
+    Whether the sample `line` belongs to `family`, histograms and summaries included
+    """
+    if not line.startswith(family):
+        return False
+    n = len(family)
+    if line[n:n + 1] in ('{', ' ', '\t'):
+        return True
+    for suffix in ('_bucket', '_count', '_sum'):
+        if line.startswith(suffix, n) and line[n + len(suffix):n + len(suffix) + 1] in ('{', ' ', '\t'):
+            return True
+    return False
@@ -4,6 +4,7 @@
 from collections import defaultdict, namedtuple
 
 MetricStub = namedtuple('MetricStub', 'name type value tags hostname')
+ServiceCheckStub = namedtuple('ServiceCheckStub', 'name status tags hostname message')
 
 
 class AggregatorStub(object):
@@ -18,13 +19,29 @@ class AggregatorStub(object):
         self.reset()
 
     def submit_metric(self, check, check_id, mtype, name, value, tags, hostname):
-        self._metrics[name].append(MetricStub(name, mtype, value, tags, hostname))
+        self._add_metric(MetricStub(name, mtype, value, tags, hostname))
 
-    def submit_service_check(self, *args, **kwargs):
-        pass
+    def submit_metrics(self, check, check_id, rows):
+        """
+        Bulk version of `submit_metric`, `rows` being a list of `(mtype, name, value, tags, hostname)`
+        """
+        for mtype, name, value, tags, hostname in rows:
+            self._add_metric(MetricStub(name, mtype, value, tags, hostname))
+
+    def _add_metric(self, metric):
+        # like the Agent, only accept a list of tags
+        if metric.tags is not None and not isinstance(metric.tags, list):
+            raise TypeError("The tags of `{}` must be a list, not {}".format(metric.name, type(metric.tags).__name__))
+        self._metrics[metric.name].append(metric)
+        # index the samples by name and tags, then by hostname and type
+        by_context = self._index[(metric.name, frozenset(metric.tags or ()))]
+        by_context[(metric.hostname, metric.type)].append(metric)
+
+    def submit_service_check(self, check, check_id, name, status, tags, hostname, message):
+        self._service_checks[name].append(ServiceCheckStub(name, status, tags, hostname, message))
 
-    def submit_event(self, *args, **kwargs):
-        pass
+    def submit_event(self, check, check_id, event):
+        self._events.append(event)
 
     def metrics(self, name):
         """
@@ -32,6 +49,53 @@ class AggregatorStub(object):
         """
         return self._metrics.get(name, [])
 
+    def service_checks(self, name):
+        """
+        Return the service checks received under the given name
+        """
+        return self._service_checks.get(name, [])
+
+    @property
+    def events(self):
+        """
+        Return all the events received
+        """
+        return self._events
+
+    def _candidates(self, name, tags, hostname, metric_type):
+        if not tags:
+            for metric in self._metrics.get(name, []):
+                if hostname and hostname != metric.hostname:
+                    continue
+                if metric_type is not None and metric_type != metric.type:
+                    continue
+                yield metric
+            return
+
+        tag_set = frozenset(tags)
+        by_context = self._index.get((name, tag_set))
+        if not by_context:
+            return
+        if hostname and metric_type is not None:
+            metric_lists = [by_context.get((hostname, metric_type), [])]
+        else:
+            metric_lists = [
+                metrics for (metric_hostname, mtype), metrics in by_context.iteritems()
+                if (not hostname or hostname == metric_hostname) and (metric_type is None or metric_type == mtype)
+            ]
+
+        # the index ignores duplicated tags, compare them when there are some
+        unique_tags = len(tag_set) == len(tags)
+        sorted_tags = None
+        for metrics in metric_lists:
+            for metric in metrics:
+                if not unique_tags or len(metric.tags) != len(tags):
+                    if sorted_tags is None:
+                        sorted_tags = sorted(tags)
+                    if sorted(metric.tags) != sorted_tags:
+                        continue
+                yield metric
+
     def assert_metric(self, name, value=None, tags=None, count=None, at_least=1,
                       hostname=None, metric_type=None):
         """
@@ -40,20 +104,38 @@ class AggregatorStub(object):
         self._asserted.add(name)
 
         candidates = []
-        for metric in self._metrics.get(name, []):
+        for metric in self._candidates(name, tags, hostname, metric_type):
             if value is not None and value != metric.value:
                 continue
 
-            if tags and sorted(tags) != sorted(metric.tags):
+            candidates.append(metric)
+
+        if count is not None:
+            msg = "Needed exactly {} candidates for '{}', got {}".format(count, name, len(candidates))
+            assert len(candidates) == count, msg
+        else:
+            msg = "Needed at least {} candidates for '{}', got {}".format(at_least, name, len(candidates))
+            assert len(candidates) >= at_least, msg
+
+    def assert_service_check(self, name, status=None, tags=None, count=None, at_least=1, hostname=None, message=None):
+        """
+        Assert a service check was processed by this stub
+        """
+        candidates = []
+        for service_check in self._service_checks.get(name, []):
+            if status is not None and status != service_check.status:
                 continue
 
-            if hostname and hostname != metric.hostname:
+            if tags and sorted(tags) != sorted(service_check.tags or ()):
                 continue
 
-            if metric_type is not None and metric_type != metric.type:
+            if hostname and hostname != service_check.hostname:
                 continue
 
-            candidates.append(metric)
+            if message is not None and message != service_check.message:
+                continue
+
+            candidates.append(service_check)
 
         if count is not None:
             msg = "Needed exactly {} candidates for '{}', got {}".format(count, name, len(candidates))
@@ -67,6 +149,9 @@ class AggregatorStub(object):
         Set the stub to its initial state
         """
         self._metrics = defaultdict(list)
+        self._index = defaultdict(lambda: defaultdict(list))
+        self._service_checks = defaultdict(list)
+        self._events = []
         self._asserted = set()
 
     @property
@@ -17,3 +17,113 @@ def freeze(o):
 
 def hash_mutable(m):
     return hash(freeze(m))
+
+
+def _immutable_error(self, *args, **kwargs):
+    raise TypeError("'{}' object is immutable".format(type(self).__name__))
+
+
+class ImmutableDict(dict):
+    """
+    Dictionary raising a TypeError on any modification, hashable with `hash_mutable`
+    """
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _immutable_error
+
+    def __hash__(self):
+        try:
+            return self._hash
+        except AttributeError:
+            self._hash = hash_mutable(self)
+            return self._hash
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return ImmutableDict, (dict(self), )
+
+
+class ImmutableList(list):
+    """
+    List raising a TypeError on any modification, hashable with `hash_mutable`
+    """
+    __setitem__ = __delitem__ = __setslice__ = __delslice__ = __iadd__ = __imul__ = _immutable_error
+    append = extend = insert = pop = remove = reverse = sort = _immutable_error
+
+    def __hash__(self):
+        try:
+            return self._hash
+        except AttributeError:
+            self._hash = hash_mutable(self)
+            return self._hash
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return ImmutableList, (list(self), )
+
+
+def immutable(o):
+    """
+    Return a copy of `o` where the nested dictionaries and lists are replaced
+    by `ImmutableDict` and `ImmutableList`, so it can be shared without copying it.
+    """
+    if isinstance(o, dict):
+        return ImmutableDict((k, immutable(v)) for k, v in o.iteritems())
+
+    if isinstance(o, list):
+        return ImmutableList(immutable(v) for v in o)
+
+    return o
+
+
+class LRUCache(object):
+    """
+    Bounded mapping keeping about the `size` most recently used entries, with hit/miss statistics.
+
+    To keep lookups as cheap as a dict access, recency is approximated with two generations:
+    new entries go to the young generation, and when it is full the old generation is dropped
+    and the young one takes its place. Entries found in the old generation are promoted back.
+    """
+    def __init__(self, size):
+        self.size = size
+        self._generation_size = max(size // 2, 1)
+        self.clear()
+
+    def get(self, key, default=None):
+        try:
+            value = self._young[key]
+        except KeyError:
+            try:
+                value = self._old[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self.set(key, value)
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        if len(self._young) >= self._generation_size:
+            self._old = self._young
+            self._young = {}
+        self._young[key] = value
+
+    def clear(self):
+        self._young = {}
+        self._old = {}
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._young) + len(self._old)
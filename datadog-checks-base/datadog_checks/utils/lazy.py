@@ -0,0 +1,38 @@
+# (C) Datadog, Inc. 2018
+# All rights reserved
+# Licensed under a 3-clause BSD style license (see LICENSE)
+from types import ModuleType
+import importlib
+import sys
+
+
+class LazyModule(ModuleType):
+    """
+    Stand-in for a module, only imported when one of its attributes is first accessed.
+    Attributes are looked up on the module each time, so it can still be patched.
+    """
+    def __init__(self, name):
+        ModuleType.__init__(self, name)
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            self._module = importlib.import_module(self.__name__)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        state = 'loaded' if self._module is not None else 'not loaded'
+        return "<lazy module '{}' ({})>".format(self.__name__, state)
+
+
+def lazy_import(name):
+    """
+    Return the module `name` if it's already imported, a `LazyModule` importing it on first use otherwise
+    """
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    return LazyModule(name)
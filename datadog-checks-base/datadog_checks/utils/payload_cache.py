@@ -0,0 +1,109 @@
+# (C) Datadog, Inc. 2018
+# All rights reserved
+# Licensed under a 3-clause BSD style license (see LICENSE)
+from collections import namedtuple
+from hashlib import md5
+
+from .containers import immutable
+
+PayloadCacheEntry = namedtuple('PayloadCacheEntry', 'etag last_modified digest fingerprint value')
+
+_MISSING = object()
+
+
+class PayloadCache(object):
+    """
+    Keeps, for each key (usually the url polled), the value computed from the last payload
+    along with its validators and digest, so that an unchanged payload is not processed again.
+
+    A payload is unchanged when the server answers a conditional request with 304 Not Modified,
+    or when its body has the same digest as the previous one. The `fingerprint` of an entry
+    describes how its value was computed: the entry is only reused for the same fingerprint.
+
+    Cached values are shared between the runs, callers must not modify them: `load_json` returns
+    `ImmutableDict` and `ImmutableList` objects.
+    """
+    def __init__(self):
+        self._entries = {}
+        # number of payloads served from the cache, or processed
+        self.hits = 0
+        self.misses = 0
+        # `hits` at the last `submit_stats`
+        self._submitted_hits = 0
+
+    def request_headers(self, key, fingerprint=None):
+        """
+        Return the headers making the next request for `key` conditional
+        """
+        entry = self._entries.get(key)
+        if entry is None or entry.fingerprint != fingerprint:
+            return {}
+        headers = {}
+        if entry.etag:
+            headers['If-None-Match'] = entry.etag
+        if entry.last_modified:
+            headers['If-Modified-Since'] = entry.last_modified
+        return headers
+
+    def get(self, key, response, fingerprint=None, default=None):
+        """
+        Return the value stored for `key` if `response` carries the same payload, `default` otherwise
+        """
+        entry = self._entries.get(key)
+        if entry is not None and entry.fingerprint == fingerprint:
+            if response.status_code == 304:
+                self.hits += 1
+                return entry.value
+            digest = md5(response.content).digest()
+            if digest == entry.digest:
+                # the server may not support conditional requests for this payload, refresh the validators anyway
+                self._entries[key] = entry._replace(
+                    etag=response.headers.get('ETag'),
+                    last_modified=response.headers.get('Last-Modified'),
+                )
+                self.hits += 1
+                return entry.value
+        self.misses += 1
+        return default
+
+    def set(self, key, response, value, fingerprint=None):
+        """
+        Store the `value` computed from the payload of `response`
+        """
+        self._entries[key] = PayloadCacheEntry(
+            response.headers.get('ETag'),
+            response.headers.get('Last-Modified'),
+            md5(response.content).digest(),
+            fingerprint,
+            value,
+        )
+
+    def discard(self, key):
+        self._entries.pop(key, None)
+
+    def load_json(self, key, response, refetch):
+        """
+        Return the decoded json payload of `response`, only decoding it if it changed.
+        The payload is shared with the next calls, so its dictionaries and lists are immutable.
+
+        `refetch` is called without arguments when the server answers 304 Not Modified while nothing
+        is cached for `key`: it must request the payload again without the conditional headers,
+        and return the response.
+        """
+        value = self.get(key, response, default=_MISSING)
+        if value is _MISSING:
+            if response.status_code == 304:
+                response = refetch()
+            value = immutable(response.json())
+            self.set(key, response, value)
+        return value
+
+    def submit_stats(self, gauge, prefix, tags=None):
+        """
+        Submit the number of payloads served from the cache since the last call as `<prefix>.cached_scrapes`
+        """
+        gauge('{}.cached_scrapes'.format(prefix), self.hits - self._submitted_hits, tags=tags)
+        self._submitted_hits = self.hits
+
+    def __len__(self):
+        return len(self._entries)
@@ -1,7 +1,13 @@
 # (C) Datadog, Inc. 2018
 # All rights reserved
 # Licensed under a 3-clause BSD style license (see LICENSE)
+from collections import namedtuple
+from subprocess import PIPE, Popen
+from threading import Thread
 import logging
+import os
+import signal
+import time
 
 try:
     # Agent5
@@ -16,13 +22,15 @@ except ImportError:
 
 log = logging.getLogger(__name__)
 
+SubprocessResult = namedtuple('SubprocessResult', 'output err returncode timed_out error')
 
-def get_subprocess_output(command, log, raise_on_empty_output=True):
-    """
-    Run the given subprocess command and return its output. Raise an Exception
-    if an error occurs.
-    """
+# seconds after which the commands of `get_subprocesses_output` are killed by default
+DEFAULT_TIMEOUT = 60
+# seconds given to a timed out command to exit on SIGTERM before it's killed
+KILL_GRACE_PERIOD = 1
 
+
+def _command_args(command):
     cmd_args = []
     if isinstance(command, basestring):
         for arg in command.split():
@@ -32,6 +40,15 @@ def get_subprocess_output(command, log, raise_on_empty_output=True):
             cmd_args.append(arg)
     else:
         raise TypeError("command must be a sequence or string")
+    return cmd_args
+
+
+def get_subprocess_output(command, log, raise_on_empty_output=True):
+    """
+    Run the given subprocess command and return its output. Raise an Exception
+    if an error occurs.
+    """
+    cmd_args = _command_args(command)
 
     log.debug("Running get_subprocess_output with cmd: %s", cmd_args)
     out, err, returncode = subprocess_output(cmd_args, raise_on_empty_output)
@@ -39,3 +56,132 @@ def get_subprocess_output(command, log, raise_on_empty_output=True):
               len(out), len(err), returncode)
 
     return (out, err, returncode)
+
+
+class _Subprocess(object):
+    """
+    A command run by `get_subprocesses_output`, its output being read by background threads
+    """
+    def __init__(self, name, cmd_args, parser=None):
+        self.name = name
+        self.cmd_args = cmd_args
+        self.parser = parser
+        self.process = None
+        self.out = []
+        self.err = []
+        self.error = None
+        self._readers = []
+
+    def start(self):
+        if os.name == 'nt':
+            self.process = Popen(self.cmd_args, stdout=PIPE, stderr=PIPE)
+        else:
+            # in its own session, so that the children of the command (e.g. the one run by sudo) can be killed with it
+            self.process = Popen(self.cmd_args, stdout=PIPE, stderr=PIPE, close_fds=True, preexec_fn=os.setsid)
+        for target, stream in ((self._read_stdout, self.process.stdout), (self._read_stderr, self.process.stderr)):
+            reader = Thread(target=target, args=(stream, ))
+            reader.setDaemon(True)
+            reader.start()
+            self._readers.append(reader)
+
+    def _read_stdout(self, stream):
+        for line in iter(stream.readline, b''):
+            if self.parser is None:
+                self.out.append(line)
+            elif self.error is None:
+                try:
+                    self.parser(line)
+                except Exception as e:
+                    # keep reading so that the command isn't blocked on a full pipe
+                    self.error = e
+        stream.close()
+
+    def _read_stderr(self, stream):
+        for line in iter(stream.readline, b''):
+            self.err.append(line)
+        stream.close()
+
+    def kill(self):
+        """
+        Kill the process group of the command.
+
+        It's first sent SIGTERM: the commands run with sudo can't be sent SIGKILL by an unprivileged user,
+        but sudo relays SIGTERM to them. The ones still running after `KILL_GRACE_PERIOD` are sent SIGKILL.
+        """
+        if os.name == 'nt':
+            try:
+                self.process.kill()
+            except OSError:
+                pass
+            return
+
+        for sig in (signal.SIGTERM, signal.SIGKILL):
+            try:
+                os.killpg(self.process.pid, sig)
+            except OSError:
+                # the group is gone, or none of its processes can be signaled
+                return
+            deadline = time.time() + KILL_GRACE_PERIOD
+            while sig == signal.SIGTERM and time.time() < deadline:
+                if not any(reader.is_alive() for reader in self._readers):
+                    return
+                time.sleep(0.05)
+
+    def wait(self, deadline):
+        """
+        Wait for the command to exit until `deadline`, kill it with its children afterwards
+        """
+        for reader in self._readers:
+            reader.join(max(deadline - time.time(), 0))
+        timed_out = any(reader.is_alive() for reader in self._readers)
+        if timed_out:
+            self.kill()
+        returncode = self.process.wait()
+        for reader in self._readers:
+            reader.join(1)
+
+        return SubprocessResult(
+            None if self.parser is not None else b''.join(self.out),
+            b''.join(self.err),
+            None if timed_out else returncode,
+            timed_out,
+            self.error,
+        )
+
+
+def get_subprocesses_output(commands, log, timeout=None, parsers=None):
+    """
+    Run the given commands concurrently, and return a dict of their `SubprocessResult` by name.
+
+    `commands` maps names to commands, `timeout` is the number of seconds after which a command
+    is killed with its children (`timed_out` is then set in its result), either the same for all
+    the commands or a dict by name. It defaults to `DEFAULT_TIMEOUT`.
+
+    The output of the commands having a callback in `parsers` (also by name) is not buffered:
+    each line of it is passed to the callback as soon as it's read, and `output` is None in their result.
+    A command which can't be started, or whose parser raised, has the exception in `error`.
+    """
+    parsers = parsers or {}
+    if not isinstance(timeout, dict):
+        timeout = dict.fromkeys(commands, timeout)
+    timeouts = dict((name, DEFAULT_TIMEOUT if timeout.get(name) is None else timeout[name]) for name in commands)
+
+    start = time.time()
+    subprocesses = []
+    results = {}
+    for name, command in commands.iteritems():
+        proc = _Subprocess(name, _command_args(command), parsers.get(name))
+        log.debug("Running get_subprocesses_output with cmd: %s", proc.cmd_args)
+        try:
+            proc.start()
+        except Exception as e:
+            results[name] = SubprocessResult(None, b'', None, False, e)
+            continue
+        subprocesses.append(proc)
+
+    for proc in subprocesses:
+        results[proc.name] = result = proc.wait(start + timeouts[proc.name])
+        log.debug("get_subprocesses_output with cmd %s returned (returncode: %s ; timed_out: %s)",
+                  proc.cmd_args, result.returncode, result.timed_out)
+
+    return results
@@ -1,10 +1,15 @@
 # (C) Datadog, Inc. 2018
 # All rights reserved
 # Licensed under a 3-clause BSD style license (see LICENSE)
-from threading import Thread
+from Queue import Queue
+from threading import Event, Lock, Thread
 import functools
 
-_thread_by_func = {}
+# Number of idle workers kept to run the next calls
+MAX_IDLE_WORKERS = 4
+# Number of workers stuck in a call of a decorated function which timed out after which the new calls
+# of this function time out right away, instead of starting more threads that could hang as well
+MAX_ABANDONED_WORKERS = 32
 
 
 class TimeoutException(Exception):
@@ -14,57 +19,156 @@ class TimeoutException(Exception):
     pass
 
 
-class ThreadMethod(Thread):
+class _Call(object):
     """
-    Descendant of `Thread` class.
-    Run the specified target method with the specified arguments.
-    Store result and exceptions.
-    From: https://code.activestate.com/recipes/440569/
+    A call of a decorated function, with its outcome once `done` is set
     """
-    def __init__(self, target, args, kwargs):
-        Thread.__init__(self)
-        self.setDaemon(True)
-        self.target, self.args, self.kwargs = target, args, kwargs
-        self.start()
+    __slots__ = ('key', 'func', 'args', 'kwargs', 'done', 'result', 'exception')
+
+    def __init__(self, key, func, args, kwargs):
+        self.key = key
+        self.func, self.args, self.kwargs = func, args, kwargs
+        self.done = Event()
+        self.result = None
+        self.exception = None
 
     def run(self):
         try:
-            self.result = self.target(*self.args, **self.kwargs)
-        except Exception as e:
+            self.result = self.func(*self.args, **self.kwargs)
+        except BaseException as e:
             self.exception = e
-        else:
-            self.exception = None
+
+
+class _Worker(Thread):
+    """
+    Thread running calls until the pool doesn't need it anymore
+    """
+    def __init__(self, pool):
+        Thread.__init__(self)
+        self.setDaemon(True)
+        self.pool = pool
+        self.calls = Queue()
+
+    def run(self):
+        while True:
+            call = self.calls.get()
+            call.run()
+            # release the worker before notifying the callers so that it can run their next call
+            reuse = self.pool._release(self, call)
+            call.done.set()
+            if not reuse:
+                break
+
+
+class _WorkerPool(object):
+    """
+    Runs the calls of the decorated functions in reusable worker threads.
+    A call still running for the same function and arguments is joined instead of starting a new one.
+    """
+    def __init__(self, max_idle=MAX_IDLE_WORKERS, max_abandoned=MAX_ABANDONED_WORKERS):
+        self.max_idle = max_idle
+        self.max_abandoned = max_abandoned
+        self.timeouts = 0
+        self._lock = Lock()
+        self._idle = []
+        self._calls = {}  # calls running, by key
+        self._abandoned = {}  # keys of the calls which timed out and are still running, by function
+
+    def call(self, key, func, args, kwargs, timeout):
+        worker = None
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                if len(self._abandoned.get(func, ())) >= self.max_abandoned:
+                    self.timeouts += 1
+                    raise TimeoutException("Too many calls of {} timed out and still running".format(func.__name__))
+                call = self._calls[key] = _Call(key, func, args, kwargs)
+                worker = self._idle.pop() if self._idle else _Worker(self)
+
+        if worker is not None:
+            worker.calls.put(call)
+            if not worker.is_alive():
+                worker.start()
+
+        if not call.done.wait(timeout):
+            with self._lock:
+                self.timeouts += 1
+                if self._calls.get(key) is call:
+                    self._abandoned.setdefault(call.func, set()).add(key)
+            raise TimeoutException()
+
+        if call.exception:
+            raise call.exception
+        return call.result
+
+    def _release(self, worker, call):
+        """
+        Called by `worker` once `call` is done, return whether the worker should wait for another call
+        """
+        with self._lock:
+            if self._calls.get(call.key) is call:
+                del self._calls[call.key]
+            abandoned = self._abandoned.get(call.func)
+            if abandoned is not None:
+                abandoned.discard(call.key)
+                if not abandoned:
+                    del self._abandoned[call.func]
+            if len(self._idle) < self.max_idle:
+                self._idle.append(worker)
+                return True
+            return False
+
+    def stats(self):
+        with self._lock:
+            return {
+                'timeouts': self.timeouts,
+                'abandoned_workers': sum(len(keys) for keys in self._abandoned.itervalues()),
+                'idle_workers': len(self._idle),
+            }
+
+
+_pool = _WorkerPool()
+
+
+def timeout_stats():
+    """
+    Return the number of calls which timed out since the start, and the number
+    of workers still stuck in one of them (`abandoned_workers`)
+    """
+    return _pool.stats()
+
+
+def submit_timeout_stats(check, tags=None):
+    """
+    Submit the stats of `timeout_stats` with `check`: the number of timeouts since the start
+    of the process as a monotonic count, the numbers of workers as gauges
+    """
+    for key, value in timeout_stats().iteritems():
+        submit = check.monotonic_count if key == 'timeouts' else check.gauge
+        submit('datadog.check.timeout.{}'.format(key), value, tags=tags)
+
+
+def _call_key(func, args, kwargs):
+    key = (func, args, tuple(sorted(kwargs.iteritems())) if kwargs else ())
+    try:
+        hash(key)
+    except TypeError:
+        # unhashable arguments
+        key = "{0}:{1}:{2}:{3}".format(id(func), func.__name__, args, kwargs)
+    return key
 
 
 def timeout(timeout):
     """
-    A decorator to timeout a function. Decorated method calls are executed in a separate new thread
-    with a specified timeout.
-    Also check if a thread for the same function already exists before creating a new one.
+    A decorator to timeout a function. Decorated method calls are executed in a separate thread
+    with a specified timeout, the threads are reused between the calls.
+    Also check if a call of the same function with the same arguments is still running before starting a new one.
     Note: Compatible with Windows (thread based).
     """
     def decorator(func):
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
-            key = "{0}:{1}:{2}:{3}".format(id(func), func.__name__, args, kwargs)
-
-            if key in _thread_by_func:
-                # A thread for the same function already exists.
-                worker = _thread_by_func[key]
-            else:
-                worker = ThreadMethod(func, args, kwargs)
-                _thread_by_func[key] = worker
-
-            worker.join(timeout)
-            if worker.is_alive():
-                raise TimeoutException()
-
-            del _thread_by_func[key]
-
-            if worker.exception:
-                raise worker.exception
-            else:
-                return worker.result
+            return _pool.call(_call_key(func, args, kwargs), func, args, kwargs, timeout)
 
         return wrapper
     return decorator
@@ -1,7 +1,10 @@
 # (C) Datadog, Inc. 2018
 # All rights reserved
 # Licensed under a 3-clause BSD style license (see LICENSE)
+import pytest
+
 from datadog_checks.checks import AgentCheck
+from datadog_checks.stubs import aggregator
 
 
 def test_instance():
@@ -9,3 +12,157 @@ def test_instance():
     Simply assert the class can be insantiated
     """
     AgentCheck()
+
+
+def test_submit_metrics():
+    aggregator.reset()
+    check = AgentCheck()
+    tags = ('foo:bar', u'baz:qux')
+    check.submit_metrics([
+        (aggregator.GAUGE, 'metric.a', 1, tags, None),
+        (aggregator.RATE, 'metric.b', '2.5', tags, 'host'),
+        (aggregator.GAUGE, 'metric.c', None, tags, None),
+        (aggregator.COUNT, 'metric.d', 4, None, None),
+    ])
+
+    aggregator.assert_metric('metric.a', value=1.0, tags=['foo:bar', 'baz:qux'], count=1, metric_type=aggregator.GAUGE)
+    aggregator.assert_metric('metric.b', value=2.5, tags=['foo:bar', 'baz:qux'], hostname='host', count=1,
+                             metric_type=aggregator.RATE)
+    aggregator.assert_metric('metric.c', count=0)
+    aggregator.assert_metric('metric.d', value=4.0, tags=[], count=1)
+    # the tags are only normalized once for the rows sharing them
+    assert aggregator.metrics('metric.a')[0].tags is aggregator.metrics('metric.b')[0].tags
+    assert type(aggregator.metrics('metric.a')[0].tags) is list
+    assert tags == ('foo:bar', u'baz:qux')
+
+
+def test_submit_metric_columns():
+    aggregator.reset()
+    check = AgentCheck()
+    check.submit_metric_columns(aggregator.GAUGE, ['metric.a', 'metric.b', 'metric.c'], [1, None, 3], tags=('foo:bar',))
+
+    aggregator.assert_metric('metric.a', value=1.0, tags=['foo:bar'], hostname='', count=1)
+    aggregator.assert_metric('metric.b', count=0)
+    aggregator.assert_metric('metric.c', value=3.0, tags=['foo:bar'], count=1)
+    assert type(aggregator.metrics('metric.a')[0].tags) is list
+
+
+def test_aggregator_stub_tags_type():
+    aggregator.reset()
+    # the Agent expects a list of tags
+    with pytest.raises(TypeError):
+        aggregator.submit_metric(None, None, aggregator.GAUGE, 'metric.a', 1.0, ('foo:bar',), '')
+    with pytest.raises(TypeError):
+        aggregator.submit_metrics(None, None, [(aggregator.GAUGE, 'metric.a', 1.0, ('foo:bar',), '')])
+
+
+def test_normalize_tags():
+    check = AgentCheck()
+    tags = ['foo:bar', u'baz:qux', 1]
+    normalized = check._normalize_tags(tags, None)
+    assert normalized == ['foo:bar', 'baz:qux', '1']
+    assert type(normalized[1]) is str
+    assert tags == ['foo:bar', u'baz:qux', 1]
+
+    # the conversion is cached, each call gets its own list
+    assert check._normalized_tags.misses == 1
+    normalized.append('appended:tag')
+    assert check._normalize_tags(list(tags), None) == ['foo:bar', 'baz:qux', '1']
+    assert check._normalized_tags.hits == 1
+    tags.append('new:tag')
+    assert check._normalize_tags(tags, None) == ['foo:bar', 'baz:qux', '1', 'new:tag']
+
+    # lists of str tags are only copied
+    str_tags = ['foo:bar']
+    assert check._normalize_tags(str_tags, None) == str_tags
+    assert check._normalize_tags(str_tags, None) is not str_tags
+    assert check._normalized_tags.misses == 2
+
+    assert check._normalize_tags(None, None) == []
+    assert check._normalize_tags(['foo:bar'], 'sda') == ['foo:bar', 'device:sda']
+    assert check._normalize_tags([['unhashable']], None) == ["['unhashable']"]
+
+    # equal tags of different types aren't mixed up
+    assert check._normalize_tags([1], None) == ['1']
+    assert check._normalize_tags([True], None) == ['True']
+    assert check._normalize_tags([1.0], None) == ['1.0']
+
+
+def test_normalize():
+    check = AgentCheck()
+    assert check.normalize("PauseTotalNs", "prefix", fix_case=True) == "prefix.pause_total_ns"
+    assert check.normalize("Metric Name (total)/sec", "prefix") == "prefix.Metric_Name_total_sec"
+    assert check.normalize(u"_m\xe9tric._name_") == "metric.name"
+    assert check.convert_to_underscore_separated("HTTPRequests.TotalCount") == "http_requests.total_count"
+
+    # names are only normalized once
+    assert check._normalized_names.misses == 3
+    assert check.normalize("PauseTotalNs", "prefix", fix_case=True) == "prefix.pause_total_ns"
+    assert check.normalize("PauseTotalNs", "prefix") == "prefix.PauseTotalNs"
+    assert check._normalized_names.hits == 1
+    assert check._normalized_names.misses == 4
+
+
+@pytest.mark.parametrize('name, normalized', [
+    ('a__b', 'a_b'),
+    ('--a-b--', 'a_b'),
+    ('a_-_.b', 'a.b'),
+    ('a.(b)', 'a.b'),
+    ('a_._.b', 'a..b'),
+    ('_', ''),
+    ('a.[', 'a.'),
+    ('a\tb c', 'a_b_c'),
+])
+def test_normalize_separators(name, normalized):
+    assert AgentCheck()._normalize(name, None, False) == normalized
+
+
+def test_frozen_instances():
+    class MutatingCheck(AgentCheck):
+        FROZEN_INSTANCES = True
+
+        def check(self, instance):
+            self.received.append(instance)
+            instance['tags'].append('new:tag')
+
+    check = MutatingCheck('test', {}, [{'tags': ['a:b']}])
+    check.received = []
+    assert 'is immutable' in check.run()
+    check.run()
+    assert check.received[0] is check.received[1]
+    assert check.instances[0] == {'tags': ['a:b']}
+
+    with pytest.raises(TypeError):
+        check.received[0]['tags'] = []
+
+
+def test_profiling(tmpdir):
+    class ProfiledCheck(AgentCheck):
+        def check(self, instance):
+            self.gauge('metric.a', 1, tags=['foo:bar'])
+            self.gauge('metric.a', 2, tags=['foo:bar'])
+            self.gauge('metric.a', 3, tags=['foo:baz'])
+            self.submit_metrics([(aggregator.GAUGE, 'metric.b', 4, None, None)])
+            self.service_check('check.ok', AgentCheck.OK)
+
+    aggregator.reset()
+    dump = str(tmpdir.join('check.prof'))
+    check = ProfiledCheck('test', {'profiling': True, 'profiling_cprofile_runs': 1, 'profiling_cprofile_path': dump},
+                          [{}])
+    assert check.run() == ''
+
+    tags = ['check:test']
+    aggregator.assert_metric('metric.a', count=3)
+    aggregator.assert_metric('datadog.check.samples', value=4, tags=tags, count=1)
+    aggregator.assert_metric('datadog.check.contexts', value=3, tags=tags, count=1)
+    aggregator.assert_metric('datadog.check.run_time', tags=tags, count=1)
+    aggregator.assert_metric('datadog.check.cpu_time', tags=tags, count=1)
+    for method in ('metric', 'service_check', 'event'):
+        aggregator.assert_metric('datadog.check.submission_time', tags=tags + ['method:' + method], count=1)
+    assert tmpdir.join('check.prof').check()
+
+
+def test_profiling_disabled():
+    check = AgentCheck('test', {}, [{}])
+    assert check._profiler is None
+    assert '_submit_metric' not in check.__dict__
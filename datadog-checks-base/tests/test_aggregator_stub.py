@@ -0,0 +1,46 @@
+# (C) Datadog, Inc. 2018
+# All rights reserved
+# Licensed under a 3-clause BSD style license (see LICENSE)
+import pytest
+
+from datadog_checks.checks import AgentCheck
+from datadog_checks.stubs.aggregator import AggregatorStub
+
+
+@pytest.fixture
+def stub():
+    return AggregatorStub()
+
+
+def test_assert_metric(stub):
+    stub.submit_metric(None, 'id', stub.GAUGE, 'metric', 1, ['a', 'b'], 'host1')
+    stub.submit_metric(None, 'id', stub.GAUGE, 'metric', 2, ['b', 'a'], 'host2')
+    stub.submit_metric(None, 'id', stub.RATE, 'metric', 1, ['a', 'b', 'b'], 'host1')
+    stub.submit_metric(None, 'id', stub.GAUGE, 'metric', 3, None, None)
+
+    stub.assert_metric('metric', count=4)
+    stub.assert_metric('metric', tags=['b', 'a'], count=2)
+    stub.assert_metric('metric', tags=['a', 'b'], hostname='host1', metric_type=stub.GAUGE, count=1)
+    stub.assert_metric('metric', tags=['a', 'b'], metric_type=stub.GAUGE, value=2, count=1)
+    stub.assert_metric('metric', tags=['a', 'b', 'b'], count=1)
+    stub.assert_metric('metric', tags=['a', 'a', 'b'], count=0)
+    stub.assert_metric('metric', hostname='host1', count=2)
+    stub.assert_metric('metric', tags=['c'], count=0)
+    stub.assert_metric('other', count=0)
+
+    stub.reset()
+    stub.assert_metric('metric', tags=['a', 'b'], count=0)
+
+
+def test_service_checks_and_events(stub):
+    check = AgentCheck()
+    stub.submit_service_check(check, 'id', 'check.up', AgentCheck.OK, ['a'], None, '')
+    stub.submit_service_check(check, 'id', 'check.up', AgentCheck.CRITICAL, ['b'], 'host', 'down')
+    stub.submit_event(check, 'id', {'msg_title': 'title'})
+
+    stub.assert_service_check('check.up', count=2)
+    stub.assert_service_check('check.up', status=AgentCheck.CRITICAL, tags=['b'], hostname='host', message='down',
+                              count=1)
+    stub.assert_service_check('check.up', status=AgentCheck.WARNING, count=0)
+    assert stub.service_checks('check.up')[0].tags == ['a']
+    assert stub.events == [{'msg_title': 'title'}]
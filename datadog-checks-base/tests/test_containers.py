@@ -0,0 +1,67 @@
+# (C) Datadog, Inc. 2018
+# All rights reserved
+# Licensed under a 3-clause BSD style license (see LICENSE)
+import copy
+import pickle
+
+import pytest
+
+from datadog_checks.utils.containers import ImmutableDict, ImmutableList, LRUCache, freeze, immutable
+
+
+def test_freeze():
+    assert freeze({'a': [1, {'b': 2}]}) == freeze({'a': [1, {'b': 2}]})
+    assert hash(freeze({'a': [1, {'b': 2}]})) == hash(freeze({'a': [1, {'b': 2}]}))
+
+
+def test_lru_cache():
+    cache = LRUCache(4)
+    assert cache.get('a') is None
+    cache.set('a', 1)
+    assert cache.get('a') == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    cache.reset_stats()
+    assert (cache.hits, cache.misses) == (0, 0)
+
+
+def test_lru_cache_bounded():
+    cache = LRUCache(4)
+    for i in range(100):
+        cache.set(i, i)
+        assert len(cache) <= 4
+    # the most recent entries are kept
+    assert cache.get(99) == 99
+    assert cache.get(98) == 98
+    assert cache.get(0) is None
+
+
+def test_lru_cache_promotes_used_entries():
+    cache = LRUCache(4)
+    cache.set('a', 1)
+    for i in range(3):
+        cache.set(i, i)
+        assert cache.get('a') == 1
+    cache.set('b', 2)
+    cache.set('c', 3)
+    assert cache.get('a') == 1
+
+
+def test_immutable():
+    instance = immutable({'tags': ['a:b'], 'nested': {'queries': [{'query': 'SELECT 1'}]}})
+    assert isinstance(instance, ImmutableDict)
+    assert isinstance(instance['tags'], ImmutableList)
+    assert instance == {'tags': ['a:b'], 'nested': {'queries': [{'query': 'SELECT 1'}]}}
+    assert instance['tags'] + ['c:d'] == ['a:b', 'c:d']
+    assert hash(instance) == hash(immutable({'tags': ['a:b'], 'nested': {'queries': [{'query': 'SELECT 1'}]}}))
+    assert copy.deepcopy(instance) is instance
+    assert pickle.loads(pickle.dumps(instance)) == instance
+
+    with pytest.raises(TypeError):
+        instance['url'] = 'http://localhost'
+    with pytest.raises(TypeError):
+        instance.setdefault('url', 'http://localhost')
+    with pytest.raises(TypeError):
+        instance['tags'].append('c:d')
+    with pytest.raises(TypeError):
+        instance['nested']['queries'][0]['query'] = 'SELECT 2'
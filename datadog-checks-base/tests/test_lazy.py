@@ -0,0 +1,19 @@
+# (C) Datadog, Inc. 2018
+# All rights reserved
+# Licensed under a 3-clause BSD style license (see LICENSE)
+import sys
+
+from datadog_checks.utils.lazy import LazyModule, lazy_import
+
+
+def test_lazy_import():
+    sys.modules.pop('colorsys', None)
+    colorsys = lazy_import('colorsys')
+    assert isinstance(colorsys, LazyModule)
+    assert 'colorsys' not in sys.modules
+
+    assert colorsys.rgb_to_hsv(1.0, 0.0, 0.0) == (0.0, 1.0, 1.0)
+    assert colorsys._load() is sys.modules['colorsys']
+
+    # already imported modules are returned as is
+    assert lazy_import('colorsys') is sys.modules['colorsys']
@@ -0,0 +1,86 @@
+# (C) Datadog, Inc. 2018
+# All rights reserved
+# Licensed under a 3-clause BSD style license (see LICENSE)
+import json
+
+import mock
+import pytest
+
+from datadog_checks.utils.payload_cache import PayloadCache
+
+
+def _response(payload, status_code=200, headers=None):
+    response = mock.MagicMock(status_code=status_code, content=payload, headers=headers or {})
+    response.json.side_effect = lambda: json.loads(payload)
+    return response
+
+
+def test_request_headers():
+    cache = PayloadCache()
+    assert cache.request_headers('url') == {}
+    cache.set('url', _response('{}', headers={'ETag': '"a"', 'Last-Modified': 'Mon, 19 Mar 2018 10:00:00 GMT'}), {})
+    assert cache.request_headers('url') == {
+        'If-None-Match': '"a"',
+        'If-Modified-Since': 'Mon, 19 Mar 2018 10:00:00 GMT',
+    }
+    assert cache.request_headers('url', fingerprint='other') == {}
+
+
+def test_load_json():
+    cache = PayloadCache()
+    refetch = mock.MagicMock()
+    first = cache.load_json('url', _response('{"a": 1}'), refetch)
+    assert first == {'a': 1}
+
+    response = _response('{"a": 1}')
+    assert cache.load_json('url', response, refetch) is first
+    response.json.assert_not_called()
+
+    response = _response('', status_code=304)
+    assert cache.load_json('url', response, refetch) is first
+    response.json.assert_not_called()
+
+    assert cache.load_json('url', _response('{"a": 2}'), refetch) == {'a': 2}
+    assert (cache.hits, cache.misses) == (2, 2)
+    refetch.assert_not_called()
+
+
+def test_load_json_not_modified_without_entry():
+    cache = PayloadCache()
+    refetch = mock.MagicMock(return_value=_response('{"a": 1}', headers={'ETag': '"a"'}))
+    assert cache.load_json('url', _response('', status_code=304), refetch) == {'a': 1}
+    refetch.assert_called_once_with()
+    assert cache.request_headers('url') == {'If-None-Match': '"a"'}
+
+
+def test_submit_stats():
+    cache = PayloadCache()
+    gauge = mock.MagicMock()
+    cache.load_json('url', _response('{}'), None)
+    cache.load_json('url', _response('{}'), None)
+    cache.submit_stats(gauge, 'foo', tags=['bar:baz'])
+    gauge.assert_called_once_with('foo.cached_scrapes', 1, tags=['bar:baz'])
+    cache.submit_stats(gauge, 'foo')
+    gauge.assert_called_with('foo.cached_scrapes', 0, tags=None)
+
+
+def test_load_json_immutable():
+    cache = PayloadCache()
+    refetch = mock.MagicMock()
+    payload = cache.load_json('url', _response('{"a": [1, {"b": 2}]}'), refetch)
+    with pytest.raises(TypeError):
+        payload['c'] = 3
+    with pytest.raises(TypeError):
+        payload['a'].append(3)
+    with pytest.raises(TypeError):
+        payload['a'][1].pop('b')
+    assert cache.load_json('url', _response('{"a": [1, {"b": 2}]}'), refetch) == {'a': [1, {'b': 2}]}
+
+
+def test_fingerprint():
+    cache = PayloadCache()
+    cache.set('url', _response('payload'), 'value', fingerprint=1)
+    assert cache.get('url', _response('payload'), fingerprint=1) == 'value'
+    assert cache.get('url', _response('payload'), fingerprint=2) is None
+    cache.discard('url')
+    assert len(cache) == 0
@@ -7,8 +7,10 @@ import os
 import pytest
 import mock
 import requests
+from google.protobuf.message import DecodeError
 
 from datadog_checks.checks.prometheus import PrometheusCheck, UnknownFormatError
+from datadog_checks.checks.prometheus.text_parser import parse_text_metric_families
 from datadog_checks.utils.prometheus import parse_metric_family, metrics_pb2
 
 
@@ -30,6 +32,38 @@ class MockResponse:
     def close(self):
         pass
 
+
+class MockRawStream:
+    """
+    MockRawStream is used to simulate the urllib3 response exposed as requests.Response.raw
+    """
+    def __init__(self, content, max_read=None):
+        self.content = content
+        self.max_read = max_read
+        self.pos = 0
+
+    def read(self, amt=None, decode_content=None):
+        if self.max_read is not None:
+            amt = min(amt, self.max_read)
+        data = self.content[self.pos:self.pos + amt]
+        self.pos += len(data)
+        return data
+
+
+class MockStreamedResponse(MockResponse):
+    def __init__(self, content, content_type, max_read=None):
+        MockResponse.__init__(self, content, content_type)
+        self.raw = MockRawStream(content, max_read)
+
+    @property
+    def content(self):
+        raise AssertionError("the content should not be loaded when streaming")
+
+    @content.setter
+    def content(self, value):
+        pass
+
+
 class SortedTagsPrometheusCheck(PrometheusCheck):
     """
     Tags are not sorted in a deterministic manner. There is no need to sort them normally.
@@ -141,6 +175,31 @@ def test_parse_metric_family_protobuf(bin_data, mocked_prometheus_check):
     assert messages[1].type == 2  # summary
 
 
+@pytest.mark.parametrize('max_read', [None, 1, 7, 4096])
+def test_parse_metric_family_protobuf_streaming(bin_data, mocked_prometheus_check, max_read):
+    check = mocked_prometheus_check
+    expected = list(check.parse_metric_family(MockResponse(bin_data, protobuf_content_type)))
+
+    check.protobuf_streaming = True
+    check.type_overrides = {"go_goroutines": "summary"}
+    response = MockStreamedResponse(bin_data, protobuf_content_type, max_read=max_read)
+    messages = list(check.parse_metric_family(response))
+
+    assert len(messages) == 61
+    assert messages[0] == expected[0]
+    assert messages[-1] == expected[-1]
+    assert messages[1].name == 'go_goroutines'
+    assert messages[1].type == 2  # summary
+
+
+def test_parse_metric_family_protobuf_streaming_truncated(bin_data, mocked_prometheus_check):
+    check = mocked_prometheus_check
+    check.protobuf_streaming = True
+    response = MockStreamedResponse(bin_data[:-10], protobuf_content_type)
+    with pytest.raises(DecodeError):
+        list(check.parse_metric_family(response))
+
+
 def test_parse_metric_family_text(text_data, mocked_prometheus_check):
     """ Test the high level method for loading metrics from text format """
     check = mocked_prometheus_check
@@ -294,6 +353,44 @@ def test_process_metric_filtered(mocked_prometheus_check):
     check.gauge.assert_not_called()
 
 
+def test_process_metric_handlers_cache(mocked_prometheus_check, ref_gauge):
+    """ The handler of a family is computed once and reset when the mapper or the ignore list change """
+    check = mocked_prometheus_check
+    check._dry_run = False
+    check.process_metric(ref_gauge)
+    check.gauge.assert_called_with('prometheus.process.vm.bytes', 39211008.0, [], hostname=None)
+    assert check._metric_handlers['process_virtual_memory_bytes'].mapped_name == 'process.vm.bytes'
+
+    check.metrics_mapper = {'process_virtual_memory_bytes': 'process.virtual_memory'}
+    check.process_metric(ref_gauge)
+    check.gauge.assert_called_with('prometheus.process.virtual_memory', 39211008.0, [], hostname=None)
+
+    check.gauge.reset_mock()
+    check.ignore_metrics = ['process_virtual_memory_bytes']
+    check.process_metric(ref_gauge)
+    check.gauge.assert_not_called()
+
+    # in place modifications are detected at the beginning of each scrape
+    check.ignore_metrics.remove('process_virtual_memory_bytes')
+    check._check_metric_handlers()
+    check.process_metric(ref_gauge)
+    check.gauge.assert_called_with('prometheus.process.virtual_memory', 39211008.0, [], hostname=None)
+
+
+def test_process_metric_wildcards(mocked_prometheus_check, ref_gauge):
+    check = mocked_prometheus_check
+    check._dry_run = False
+    check.metrics_mapper = {'go_*': 'go', 'process_*_bytes': 'process', 'process_virtual_*': 'process'}
+    check.process_metric(ref_gauge, ignore_unmapped=True)
+    # submitted once even if it matches several wildcards
+    check.gauge.assert_called_once_with('prometheus.process_virtual_memory_bytes', 39211008.0, [], hostname=None)
+
+    check.gauge.reset_mock()
+    ref_gauge.name = 'Process_virtual_memory_bytes'
+    check.process_metric(ref_gauge, ignore_unmapped=True)
+    check.gauge.assert_not_called()
+
+
 def test_poll_protobuf(mocked_prometheus_check, bin_data):
     """ Tests poll using the protobuf format """
     check = mocked_prometheus_check
@@ -301,7 +398,7 @@ def test_poll_protobuf(mocked_prometheus_check, bin_data):
         status_code=200,
         content=bin_data,
         headers={'Content-Type': protobuf_content_type})
-    p = mock.patch('requests.get', return_value=mock_response, __name__="get")
+    p = mock.patch('requests.Session.get', return_value=mock_response, __name__="get")
     p.start()
     response = check.poll("http://fake.endpoint:10055/metrics")
     messages = list(check.parse_metric_family(response))
@@ -317,7 +414,7 @@ def test_poll_text_plain(mocked_prometheus_check, text_data):
         status_code=200,
         iter_lines=lambda **kwargs: text_data.split("\n"),
         headers={'Content-Type': "text/plain"})
-    p = mock.patch('requests.get', return_value=mock_response, __name__="get")
+    p = mock.patch('requests.Session.get', return_value=mock_response, __name__="get")
     p.start()
     response = check.poll("http://fake.endpoint:10055/metrics")
     messages = list(check.parse_metric_family(response))
@@ -423,6 +520,27 @@ def test_submit_gauge_with_labels_mapper(mocked_prometheus_check, ref_gauge):
                                     'my_2nd_label:my_2nd_label_value'], hostname=None)
 
 
+def test_submit_gauge_tags_cache(mocked_prometheus_check, ref_gauge):
+    """ Tags are rendered once per label set, and rendered again when the labels mapper changes """
+    _l1 = ref_gauge.metric[0].label.add()
+    _l1.name = 'my_1st_label'
+    _l1.value = 'my_1st_label_value'
+    check = mocked_prometheus_check
+    check._check_tags_cache()
+    for _ in range(3):
+        check._submit(check.metrics_mapper[ref_gauge.name], ref_gauge, custom_tags=['env:dev'])
+    check.gauge.assert_called_with('prometheus.process.vm.bytes', 39211008.0,
+                                   ['env:dev', 'my_1st_label:my_1st_label_value'], hostname=None)
+    assert (check._tags_cache.hits, check._tags_cache.misses) == (2, 1)
+
+    check.labels_mapper['my_1st_label'] = 'transformed_1st'
+    check._check_tags_cache()
+    check._submit(check.metrics_mapper[ref_gauge.name], ref_gauge, custom_tags=['env:dev'])
+    check.gauge.assert_called_with('prometheus.process.vm.bytes', 39211008.0,
+                                   ['env:dev', 'transformed_1st:my_1st_label_value'], hostname=None)
+    assert (check._tags_cache.hits, check._tags_cache.misses) == (0, 1)
+
+
 def test_submit_gauge_with_exclude_labels(mocked_prometheus_check, ref_gauge):
     """
     Submitting metrics when filtering with exclude_labels should end up with
@@ -505,6 +623,50 @@ def test_submit_histogram(mocked_prometheus_check):
     ])
 
 
+def test_submit_histogram_tags_cache(mocked_prometheus_check):
+    """ The tags of a histogram are rendered once per series, its bucket tags are reused across runs """
+    _histo = metrics_pb2.MetricFamily()
+    _histo.name = 'my_histogram'
+    _histo.type = 4  # HISTOGRAM
+    _met = _histo.metric.add()
+    _label = _met.label.add()
+    _label.name, _label.value = 'code', '200'
+    for upper_bound in (12.7, 18.2):
+        _met.histogram.bucket.add().upper_bound = upper_bound
+    check = mocked_prometheus_check
+    check._check_tags_cache()
+
+    check._submit('custom.histogram', _histo, custom_tags=['env:dev'])
+    first = [c[0][2] for c in check.gauge.call_args_list]
+    check.gauge.reset_mock()
+    check._submit('custom.histogram', _histo, custom_tags=['env:dev'])
+    second = [c[0][2] for c in check.gauge.call_args_list]
+
+    assert first[2] == ['env:dev', 'code:200', 'upper_bound:12.7']
+    assert all(tags is cached for tags, cached in zip(second, first))
+    assert (check._tags_cache.hits, check._tags_cache.misses) == (1, 1)
+    with pytest.raises(TypeError):
+        first[2].append('foo:bar')
+
+
+def test_fast_text_parser_label_key():
+    text_data = (
+        '# TYPE http_requests gauge\n'
+        'http_requests{code="200"} 3\n'
+        '# TYPE http_duration histogram\n'
+        'http_duration_bucket{code="200",le="1"} 3\n'
+        'http_duration_bucket{code="200",le="+Inf"} 4\n'
+        'http_duration_count{code="200"} 4\n'
+    )
+    gauge, histogram = parse_text_metric_families(text_data.splitlines())
+    labels = gauge.metric[0].label
+    assert labels.key == 'code="200"'
+    assert isinstance(histogram.metric[0].label.key, str)
+
+    labels.add()
+    assert labels.key is None
+
+
 def test_parse_one_gauge(p_check):
     """
     name: "etcd_server_has_leader"
@@ -1148,7 +1310,7 @@ def test_label_joins(sorted_tags_check):
         status_code=200,
         iter_lines=lambda **kwargs: text_data.split("\n"),
         headers={'Content-Type': "text/plain"})
-    p = mock.patch('requests.get', return_value=mock_response, __name__="get")
+    p = mock.patch('requests.Session.get', return_value=mock_response, __name__="get")
     p.start()
     check = sorted_tags_check
     check.NAMESPACE = 'ksm'
@@ -1321,7 +1483,7 @@ def test_label_joins_gc(sorted_tags_check):
         status_code=200,
         iter_lines=lambda **kwargs: text_data.split("\n"),
         headers={'Content-Type': "text/plain"})
-    p = mock.patch('requests.get', return_value=mock_response, __name__="get")
+    p = mock.patch('requests.Session.get', return_value=mock_response, __name__="get")
     p.start()
     check = sorted_tags_check
     check.NAMESPACE = 'ksm'
@@ -1359,7 +1521,7 @@ def test_label_joins_gc(sorted_tags_check):
         status_code=200,
         iter_lines=lambda **kwargs: text_data.split("\n"),
         headers={'Content-Type': "text/plain"})
-    p = mock.patch('requests.get', return_value=mock_response, __name__="get")
+    p = mock.patch('requests.Session.get', return_value=mock_response, __name__="get")
     p.start()
     check.process("http://fake.endpoint:10055/metrics")
     assert 'dd-agent-1337' in check._label_mapping['pod']
@@ -1368,6 +1530,98 @@ def test_label_joins_gc(sorted_tags_check):
     p.stop()
 
 
+def test_label_joins_first_scrape(sorted_tags_check):
+    """ Tests labels are joined from the first scrape, the sources coming after the families joining them """
+    f_name = os.path.join(os.path.dirname(__file__), 'fixtures', 'prometheus', 'ksm.txt')
+    with open(f_name, 'r') as f:
+        text_data = f.read()
+    check = sorted_tags_check
+    check.NAMESPACE = 'ksm'
+    check.label_joins = {
+        'kube_pod_info': {
+            'label_to_match': 'pod',
+            'labels_to_get': ['node']
+        }
+    }
+    check.label_to_hostname = 'node'
+    check.metrics_mapper = {'kube_pod_status_ready': 'pod.ready', 'kube_pod_container_status_ready': 'container.ready'}
+    check.gauge = mock.MagicMock()
+    response = MockResponse(text_data, 'text/plain')
+    messages = list(check._scrape_response('http://fake.endpoint:10055/metrics', response))
+    names = [message.name for message in messages]
+    assert names.index('kube_pod_info') < names.index('kube_pod_container_status_ready')
+
+    for message in messages:
+        check.process_metric(message)
+    check.gauge.assert_any_call(
+        'ksm.pod.ready', 1.0,
+        sorted(['pod:fluentd-gcp-v2.0.9-6dj58', 'namespace:kube-system', 'condition:true',
+                'node:gke-foobar-test-kube-default-pool-9b4ff111-0kch']),
+        hostname='gke-foobar-test-kube-default-pool-9b4ff111-0kch')
+    # the joined labels are only added to the tags
+    for message in messages:
+        if message.name == 'kube_pod_status_ready':
+            for metric in message.metric:
+                assert 'node' not in [label.name for label in metric.label]
+
+
+def test_label_joins_collect(p_check):
+    """ Tests the values not seen in the last scrape are removed from the mapping """
+    check = p_check
+    check.label_joins = {
+        'pod_info': {'label_to_match': 'pod', 'labels_to_get': ['node']},
+        'pod_labels': {'label_to_match': 'pod', 'labels_to_get': ['app']},
+    }
+    check.metrics_mapper = {'pod_ready': 'pod.ready'}
+
+    def scrape(pods):
+        lines = ['# TYPE pod_info gauge']
+        lines += ['pod_info{{pod="{0}",node="node-{0}"}} 1'.format(pod) for pod in pods]
+        lines += ['# TYPE pod_labels gauge']
+        lines += ['pod_labels{{pod="{0}",app="app-{0}"}} 1'.format(pod) for pod in pods]
+        response = MockResponse('\n'.join(lines), 'text/plain')
+        for message in check._scrape_response('http://fake.endpoint:10055/metrics', response):
+            check.store_labels(message)
+
+    scrape(['a', 'b', 'c'])
+    assert check._label_mapping['pod'] == {
+        'a': (1, (('node', 'node-a'), ('app', 'app-a'))),
+        'b': (1, (('node', 'node-b'), ('app', 'app-b'))),
+        'c': (1, (('node', 'node-c'), ('app', 'app-c'))),
+    }
+    scrape(['c', 'd'])
+    assert check._label_mapping['pod'].keys() == ['c', 'd']
+    assert check._label_mapping['pod']['d'] == (2, (('node', 'node-d'), ('app', 'app-d')))
+    # the mapping of a label whose sources are gone is removed
+    scrape([])
+    assert 'pod' not in check._label_mapping
+
+
+def test_label_joins_buffer(p_check):
+    """ Tests the families read before the label join sources are only buffered up to a limit """
+    check = p_check
+    check.label_joins = {'pod_info': {'label_to_match': 'pod', 'labels_to_get': ['node']}}
+    check.metrics_mapper = {'pod_ready': 'pod.ready', 'pod_restarts': 'pod.restarts'}
+
+    def scrape(families):
+        lines = []
+        for family in families:
+            lines.append('# TYPE {} gauge'.format(family))
+            lines.append('{}{{pod="a",node="node-a"}} 1'.format(family))
+        response = MockResponse('\n'.join(lines), 'text/plain')
+        return [message.name for message in check._scrape_response('http://fake.endpoint:10055/metrics', response)]
+
+    assert scrape(['pod_ready', 'pod_restarts', 'pod_info']) == ['pod_info', 'pod_ready', 'pod_restarts']
+
+    # the sources missing from the last scrape aren't waited for
+    assert scrape(['pod_ready', 'pod_restarts']) == ['pod_ready', 'pod_restarts']
+    assert check._absent_label_join_sources == set(['pod_info'])
+    assert scrape(['pod_ready', 'pod_restarts', 'pod_info']) == ['pod_ready', 'pod_restarts', 'pod_info']
+    assert check._absent_label_join_sources == set()
+
+    check.LABEL_JOIN_BUFFER_SIZE = 1
+    assert scrape(['pod_ready', 'pod_restarts', 'pod_info']) == ['pod_ready', 'pod_restarts', 'pod_info']
+
 def test_label_joins_missconfigured(sorted_tags_check):
     """ Tests label join missconfigured label is ignored """
     text_data = None
@@ -1378,7 +1632,7 @@ def test_label_joins_missconfigured(sorted_tags_check):
         status_code=200,
         iter_lines=lambda **kwargs: text_data.split("\n"),
         headers={'Content-Type': "text/plain"})
-    p = mock.patch('requests.get', return_value=mock_response, __name__="get")
+    p = mock.patch('requests.Session.get', return_value=mock_response, __name__="get")
     p.start()
     check = sorted_tags_check
     check.NAMESPACE = 'ksm'
@@ -1420,7 +1674,7 @@ def test_label_join_not_existing(sorted_tags_check):
         status_code=200,
         iter_lines=lambda **kwargs: text_data.split("\n"),
         headers={'Content-Type': "text/plain"})
-    p = mock.patch('requests.get', return_value=mock_response, __name__="get")
+    p = mock.patch('requests.Session.get', return_value=mock_response, __name__="get")
     p.start()
     check = sorted_tags_check
     check.NAMESPACE = 'ksm'
@@ -1460,7 +1714,7 @@ def test_label_join_metric_not_existing(sorted_tags_check):
         status_code=200,
         iter_lines=lambda **kwargs: text_data.split("\n"),
         headers={'Content-Type': "text/plain"})
-    p = mock.patch('requests.get', return_value=mock_response, __name__="get")
+    p = mock.patch('requests.Session.get', return_value=mock_response, __name__="get")
     p.start()
     check = sorted_tags_check
     check.NAMESPACE = 'ksm'
@@ -1500,7 +1754,7 @@ def test_label_join_with_hostname(sorted_tags_check):
         status_code=200,
         iter_lines=lambda **kwargs: text_data.split("\n"),
         headers={'Content-Type': "text/plain"})
-    p = mock.patch('requests.get', return_value=mock_response, __name__="get")
+    p = mock.patch('requests.Session.get', return_value=mock_response, __name__="get")
     p.start()
     check = sorted_tags_check
     check.NAMESPACE = 'ksm'
@@ -1532,6 +1786,110 @@ def test_label_join_with_hostname(sorted_tags_check):
     ], any_order=True)
     p.stop()
 
+@pytest.mark.parametrize('fixture_name', ['ksm.txt', 'metrics.txt'])
+def test_fast_text_parser_submissions(fixture_name):
+    """ The fast text parser submits the same metrics as the prometheus_client based one """
+    f_name = os.path.join(os.path.dirname(__file__), 'fixtures', 'prometheus', fixture_name)
+    with open(f_name, 'r') as f:
+        text_data = f.read()
+
+    calls = []
+    for fast_text_parser in (False, True):
+        check = SortedTagsPrometheusCheck('prometheus_check', {}, {}, {})
+        check.FAST_TEXT_PARSER = fast_text_parser
+        check.NAMESPACE = 'prom'
+        check.metrics_mapper = {
+            'kube_pod_status_ready': 'pod.ready',
+            'kube_pod_container_resource_requests_cpu_cores': 'container.cpu_requested',
+            'go_gc_duration_seconds': 'go.gc.duration',
+            'go_goroutines': 'go.goroutines',
+            'skydns_skydns_dns_cachemiss_count_total': 'cachemiss',
+            'skydns_skydns_dns_response_size_bytes': 'response_size.bytes',
+            'http_response_size_bytes': 'http.response_size',
+        }
+        check.type_overrides = {'go_goroutines': 'gauge'}
+        check.exclude_labels = ['namespace', 'system']
+        check.label_joins = {
+            'kube_pod_info': {
+                'label_to_match': 'pod',
+                'labels_to_get': ['node']
+            }
+        }
+        check.label_to_hostname = 'node'
+        check.gauge = mock.MagicMock()
+        check.poll = mock.MagicMock(return_value=MockResponse(text_data, 'text/plain; version=0.0.4'))
+        check.process("http://fake.endpoint:10055/metrics")
+        check.process("http://fake.endpoint:10055/metrics")
+        calls.append(sorted(check.gauge.call_args_list))
+
+    assert len(calls[0]) > 0
+    assert calls[0] == calls[1]
+
+
+def test_fast_text_parser_skips_unhandled_families(text_data, mocked_prometheus_check):
+    check = mocked_prometheus_check
+    check.FAST_TEXT_PARSER = True
+    check.metrics_mapper = {'go_memstats_*': 'go.memstats', 'process_virtual_memory_bytes': 'process.vm.bytes'}
+    check.ignore_metrics = ['go_memstats_frees_total']
+    check.skydns_skydns_dns_cachemiss_count_total = mock.MagicMock()
+
+    response = MockResponse(text_data, 'text/plain; version=0.0.4')
+    names = [message.name for message in check.parse_metric_family(response)]
+
+    assert 'process_virtual_memory_bytes' in names
+    assert 'go_memstats_alloc_bytes' in names
+    assert 'skydns_skydns_dns_cachemiss_count_total' in names
+    assert 'go_memstats_frees_total' not in names
+    assert 'go_gc_duration_seconds' not in names
+
+
+@pytest.mark.parametrize('streaming,max_read', [(False, None), (True, None), (True, 7), (True, 100)])
+def test_skip_unhandled_families_protobuf(bin_data, mocked_prometheus_check, streaming, max_read):
+    check = mocked_prometheus_check
+    check.SKIP_UNHANDLED_FAMILIES = True
+    check.protobuf_streaming = streaming
+    check.metrics_mapper = {'go_memstats_*': 'go.memstats', 'process_virtual_memory_bytes': 'process.vm.bytes'}
+    check.ignore_metrics = ['go_memstats_frees_total']
+
+    all_messages = list(check._parse_delimited_buffer(bin_data))
+    response = MockStreamedResponse(bin_data, protobuf_content_type, max_read=max_read)
+    if not streaming:
+        response = MockResponse(bin_data, protobuf_content_type)
+    messages = list(check.parse_metric_family(response))
+
+    expected = [m for m in all_messages if m.name == 'process_virtual_memory_bytes' or
+                (m.name.startswith('go_memstats_') and m.name != 'go_memstats_frees_total')]
+    assert messages == expected
+    assert check._skipped['families'] == len(all_messages) - len(expected)
+    assert check._skipped['bytes'] == sum(m.ByteSize() for m in all_messages) - sum(m.ByteSize() for m in expected)
+
+
+def test_skip_unhandled_families_text(text_data, mocked_prometheus_check):
+    check = mocked_prometheus_check
+    check.SKIP_UNHANDLED_FAMILIES = True
+    check.metrics_mapper = {'skydns_skydns_dns_response_size_bytes': 'response_size.bytes'}
+    check.process_virtual_memory_bytes = mock.MagicMock()
+
+    response = MockResponse(text_data, 'text/plain; version=0.0.4')
+    messages = list(check.parse_metric_family(response))
+
+    assert sorted(m.name for m in messages) == ['process_virtual_memory_bytes', 'skydns_skydns_dns_response_size_bytes']
+    assert check._skipped['families'] == 39
+    assert check._skipped['bytes'] > 0
+
+
+def test_skip_unhandled_families_debug_metrics(text_data, mocked_prometheus_check):
+    check = mocked_prometheus_check
+    check.SKIP_UNHANDLED_FAMILIES = True
+    check.send_debug_metrics = True
+    check.poll = mock.MagicMock(return_value=MockResponse(text_data, 'text/plain; version=0.0.4'))
+    check.process("http://fake.endpoint:10055/metrics")
+
+    tags = ['endpoint:http://fake.endpoint:10055/metrics']
+    check.gauge.assert_any_call('prometheus.prometheus.skipped_families', 40, tags=tags)
+    check.gauge.assert_any_call('prometheus.prometheus.skipped_bytes', mock.ANY, tags=tags)
+
+
 @pytest.fixture()
 def mock_get():
     text_data = None
@@ -1539,7 +1897,7 @@ def mock_get():
     with open(f_name, 'r') as f:
         text_data = f.read()
     mock_get = mock.patch(
-        'requests.get',
+        'requests.Session.get',
         return_value=mock.MagicMock(
             status_code=200,
             iter_lines=lambda **kwargs: text_data.split("\n"),
@@ -1578,3 +1936,111 @@ def test_health_service_check_failing():
         PrometheusCheck.CRITICAL,
         tags=["endpoint:http://fake.endpoint:10055/metrics"]
     )
+
+
+def test_poll_reuses_session(mock_get):
+    """ The session, and its pooled connections, is kept across polls """
+    check = PrometheusCheck('prometheus_check', {}, {}, {})
+    check.prometheus_timeout = (2, 5)
+    check.poll("http://fake.endpoint:10055/metrics").close()
+    session = check._http_session
+    check.poll("http://fake.endpoint:10055/metrics").close()
+    assert check._http_session is session
+    assert session.verify is True
+    assert session.cert is None
+    assert mock_get.call_count == 2
+    assert mock_get.call_args[1]['timeout'] == (2, 5)
+
+
+def test_poll_rebuilds_session(mock_get):
+    """ The session is rebuilt when the ssl settings or the extra headers change """
+    check = PrometheusCheck('prometheus_check', {}, {}, {})
+    check.poll("http://fake.endpoint:10055/metrics").close()
+    session = check._http_session
+
+    check.ssl_cert = '/path/to/cert'
+    check.ssl_private_key = '/path/to/key'
+    check.ssl_ca_cert = '/path/to/ca'
+    check.poll("http://fake.endpoint:10055/metrics").close()
+    assert check._http_session is not session
+    session = check._http_session
+    assert session.cert == ('/path/to/cert', '/path/to/key')
+    assert session.verify == '/path/to/ca'
+
+    check.extra_headers = {'Authorization': 'Bearer token'}
+    check.poll("http://fake.endpoint:10055/metrics").close()
+    assert check._http_session is not session
+    assert mock_get.call_args[1]['headers']['Authorization'] == 'Bearer token'
+
+
+def _cacheable_response(content, status_code=200, etag='"v1"'):
+    response = MockResponse(content, 'application/vnd.google.protobuf')
+    response.status_code = status_code
+    response.headers['ETag'] = etag
+    response.raise_for_status = lambda: None
+    return response
+
+
+def test_process_replays_unchanged_payload(mocked_prometheus_check, bin_data):
+    """ The gauges of an unchanged payload are submitted again without parsing it """
+    check = mocked_prometheus_check
+    check.cache_unchanged_payloads = True
+    check.send_debug_metrics = True
+    endpoint = "http://fake.endpoint:10055/metrics"
+    with mock.patch('requests.Session.get', return_value=_cacheable_response(bin_data)) as get:
+        check.process(endpoint)
+        assert 'If-None-Match' not in get.call_args[1]['headers']
+        submitted = [c for c in check.gauge.call_args_list if c[0][0] == 'prometheus.process.vm.bytes']
+        assert len(submitted) == 1
+        check.gauge.assert_any_call('prometheus.prometheus.cached_scrapes', 0, tags=["endpoint:" + endpoint])
+
+        check.gauge.reset_mock()
+        check.parse_metric_family = mock.MagicMock()
+        check.process(endpoint)
+        assert get.call_args[1]['headers']['If-None-Match'] == '"v1"'
+        check.parse_metric_family.assert_not_called()
+        assert [c for c in check.gauge.call_args_list if c[0][0] == 'prometheus.process.vm.bytes'] == submitted
+        check.gauge.assert_any_call('prometheus.prometheus.cached_scrapes', 1, tags=["endpoint:" + endpoint])
+
+    # the server tells the payload did not change
+    check.gauge.reset_mock()
+    with mock.patch('requests.Session.get', return_value=_cacheable_response('', status_code=304)):
+        check.process(endpoint)
+    check.parse_metric_family.assert_not_called()
+    assert [c for c in check.gauge.call_args_list if c[0][0] == 'prometheus.process.vm.bytes'] == submitted
+    # the gauge tells whether the last scrape of the endpoint was cached, it's not a running total
+    check.gauge.assert_any_call('prometheus.prometheus.cached_scrapes', 1, tags=["endpoint:" + endpoint])
+
+
+def test_process_parses_changed_payload(mocked_prometheus_check, bin_data):
+    """ A changed payload, or a change of the configuration, is parsed again """
+    check = mocked_prometheus_check
+    check.cache_unchanged_payloads = True
+    endpoint = "http://fake.endpoint:10055/metrics"
+    with mock.patch('requests.Session.get', return_value=_cacheable_response(bin_data)):
+        check.process(endpoint)
+    check.gauge.reset_mock()
+
+    with mock.patch('requests.Session.get', return_value=_cacheable_response(bin_data * 2, etag='"v2"')):
+        check.process(endpoint)
+    assert check.gauge.call_count > 0
+    check.gauge.reset_mock()
+
+    check.metrics_mapper = {'process_virtual_memory_bytes': 'process.virtual_memory'}
+    with mock.patch('requests.Session.get', return_value=_cacheable_response(bin_data * 2, etag='"v2"')) as get:
+        check.process(endpoint)
+    assert 'If-None-Match' not in get.call_args[1]['headers']
+    check.gauge.assert_called_with('prometheus.process.virtual_memory', 39211008.0, [], hostname=None)
+
+
+def test_process_does_not_cache_metric_methods(mocked_prometheus_check, bin_data):
+    """ The submissions of the metric methods of a check are not cached """
+    check = mocked_prometheus_check
+    check.cache_unchanged_payloads = True
+    check.go_goroutines = mock.MagicMock()
+    endpoint = "http://fake.endpoint:10055/metrics"
+    for _ in range(2):
+        with mock.patch('requests.Session.get', return_value=_cacheable_response(bin_data)) as get:
+            check.process(endpoint)
+        assert 'If-None-Match' not in get.call_args[1]['headers']
+    assert check.go_goroutines.call_count == 2
@@ -0,0 +1,90 @@
+# (C) Datadog, Inc. 2018
+# All rights reserved
+# Licensed under a 3-clause BSD style license (see LICENSE)
+import logging
+import os
+import time
+
+from datadog_checks.utils import subprocess_output
+from datadog_checks.utils.subprocess_output import get_subprocesses_output
+
+log = logging.getLogger(__name__)
+
+
+def test_get_subprocesses_output():
+    commands = {
+        'echo': ['sh', '-c', 'echo foo; echo bar >&2'],
+        'fail': 'false',
+        'missing': ['/nonexistent/command'],
+    }
+    results = get_subprocesses_output(commands, log)
+
+    assert results['echo'].output == 'foo\n'
+    assert results['echo'].err == 'bar\n'
+    assert results['echo'].returncode == 0
+    assert results['fail'].returncode == 1
+    assert not results['fail'].timed_out
+    assert isinstance(results['missing'].error, OSError)
+
+
+def test_get_subprocesses_output_concurrent_timeouts():
+    commands = {
+        'fast': ['sh', '-c', 'sleep 0.5; echo done'],
+        'slow': ['sh', '-c', 'sleep 0.5; echo done'],
+        'hung': ['sleep', '30'],
+    }
+    start = time.time()
+    results = get_subprocesses_output(commands, log, timeout={'fast': 5, 'slow': 5, 'hung': 1})
+
+    assert time.time() - start < 5
+    assert results['fast'].output == results['slow'].output == 'done\n'
+    assert results['hung'].timed_out
+    assert results['hung'].returncode is None
+
+
+def _is_running(pid):
+    try:
+        with open('/proc/{}/stat'.format(pid)) as f:
+            # zombies are left to init
+            return f.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except IOError:
+        return False
+
+
+def test_get_subprocesses_output_default_timeout(monkeypatch):
+    monkeypatch.setattr(subprocess_output, 'DEFAULT_TIMEOUT', 1)
+    start = time.time()
+    results = get_subprocesses_output({'hung': ['sleep', '30'], 'fast': 'true'}, log, timeout={'fast': 5})
+
+    assert time.time() - start < 5
+    assert results['hung'].timed_out
+    assert results['fast'].returncode == 0
+
+
+def test_get_subprocesses_output_kill_children():
+    pids = []
+    # the children of the command hold its output open, and ignore SIGTERM
+    command = ['sh', '-c', 'trap "" TERM; sleep 30 & echo $!; wait']
+    start = time.time()
+    results = get_subprocesses_output({'wrapper': command}, log, timeout=1, parsers={'wrapper': pids.append})
+
+    assert time.time() - start < 5
+    assert results['wrapper'].timed_out
+    assert len(pids) == 1
+    assert not _is_running(int(pids[0]))
+
+
+def test_get_subprocesses_output_parsers():
+    lines = []
+
+    def parse(line):
+        lines.append(line)
+        if len(lines) == 2:
+            raise ValueError("unexpected line")
+
+    results = get_subprocesses_output({'seq': ['seq', '1000']}, log, parsers={'seq': parse})
+
+    assert results['seq'].output is None
+    assert results['seq'].returncode == 0
+    assert isinstance(results['seq'].error, ValueError)
+    assert lines == ['1\n', '2\n']
@@ -0,0 +1,105 @@
+# (C) Datadog, Inc. 2018
+# All rights reserved
+# Licensed under a 3-clause BSD style license (see LICENSE)
+import threading
+
+import pytest
+
+from datadog_checks.checks.libs import thread_pool
+from datadog_checks.checks.libs.thread_pool import CancelledError, SharedPool, TimeoutError
+
+
+@pytest.fixture
+def pool():
+    pool = SharedPool(2, name="test")
+    yield pool
+    pool.terminate()
+
+
+def test_apply_async(pool):
+    client = pool.client('check', quota=2)
+    results = [client.apply_async(lambda x: x * x, args=(i, )) for i in range(10)]
+    assert [r.get(5) for r in results] == [i * i for i in range(10)]
+
+    def fail():
+        raise ValueError("failed")
+    with pytest.raises(ValueError):
+        client.apply_async(fail).get(5)
+
+    stats = client.stats()
+    assert stats['running'] == 0
+    assert stats['backlog'] == 0
+
+
+def test_quota(pool):
+    release = threading.Event()
+    client = pool.client('slow', quota=1)
+    results = [client.apply_async(release.wait) for _ in range(3)]
+    # the jobs of the other clients aren't blocked by the slow one
+    assert pool.client('fast', quota=1).apply_async(lambda: 42).get(5) == 42
+
+    assert client.qsize() == 2
+    assert client.stats()['backlog'] == 2
+    release.set()
+    for r in results:
+        r.get(5)
+
+
+def test_cancel_expired(pool):
+    release = threading.Event()
+    client = pool.client('stuck', quota=1, timeout=0)
+    stuck = client.apply_async(release.wait)
+    waiting = client.apply_async(lambda: 'done', timeout=10)
+    while not pool.stats()['busy_workers']:
+        pass
+
+    assert client.cancel_expired() == 1
+    with pytest.raises(TimeoutError):
+        stuck.get(0)
+    # the pool keeps its capacity
+    assert pool.stats()['workers'] == 2
+    assert pool.stats()['retired_workers'] == 1
+    assert client.stats()['timeouts'] == 1
+    # the workers retired by the other pools aren't counted
+    other = SharedPool(1, name="other")
+    assert other.stats()['retired_workers'] == 0
+    other.terminate()
+
+    # the stuck job keeps its slot until it returns, the quota is never exceeded
+    with pytest.raises(TimeoutError):
+        waiting.get(0.1)
+    assert client.stats()['running'] == 1
+    assert client.stats()['backlog'] == 1
+
+    release.set()
+    assert waiting.get(5) == 'done'
+    stuck._job.worker.join(5)
+    assert pool.stats()['retired_workers'] == 0
+    assert client.stats()['running'] == 0
+
+
+def test_get_shared_pool(monkeypatch):
+    monkeypatch.setattr(thread_pool, '_shared_pool', None)
+    monkeypatch.setattr(thread_pool.datadog_agent, 'get_config', lambda key: {'shared_pool_size': '3'}.get(key))
+    pool = thread_pool.get_shared_pool()
+    try:
+        assert pool.stats()['workers'] == 3
+        assert thread_pool.get_shared_pool() is pool
+    finally:
+        pool.terminate()
+
+
+def test_cancel_pending(pool):
+    release = threading.Event()
+    client = pool.client('check', quota=1)
+    running = client.apply_async(release.wait)
+    pending = [client.apply_async(lambda: 'never') for _ in range(2)]
+    while not pool.stats()['busy_workers']:
+        pass
+    client.cancel_pending()
+    for r in pending:
+        with pytest.raises(CancelledError):
+            r.get(0)
+    assert not pending[0].cancel()
+    release.set()
+    assert running.get(5) is True
@@ -0,0 +1,94 @@
+# (C) Datadog, Inc. 2018
+# All rights reserved
+# Licensed under a 3-clause BSD style license (see LICENSE)
+import threading
+import time
+
+import mock
+import pytest
+
+from datadog_checks.utils import timeout as timeout_module
+from datadog_checks.utils.timeout import TimeoutException, submit_timeout_stats, timeout, timeout_stats
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    pool = timeout_module._WorkerPool(max_idle=2, max_abandoned=2)
+    monkeypatch.setattr(timeout_module, '_pool', pool)
+    return pool
+
+
+def test_timeout_reuses_workers(pool):
+    threads = set()
+
+    @timeout(5)
+    def square(x):
+        threads.add(threading.current_thread())
+        return x * x
+
+    assert [square(i) for i in range(10)] == [i * i for i in range(10)]
+    assert len(threads) == 1
+    assert timeout_stats() == {'timeouts': 0, 'abandoned_workers': 0, 'idle_workers': 1}
+
+    @timeout(5)
+    def fail():
+        raise ValueError("failed")
+    with pytest.raises(ValueError):
+        fail()
+
+    @timeout(5)
+    def stop():
+        raise SystemExit(1)
+    with pytest.raises(SystemExit):
+        stop()
+
+
+def test_timeout_joins_running_call(pool):
+    release = threading.Event()
+    calls = []
+
+    @timeout(0.05)
+    def hang(x, unhashable=None):
+        calls.append(x)
+        release.wait()
+        return x
+
+    with pytest.raises(TimeoutException):
+        hang(1, unhashable=[])
+    # same call still running: no new call
+    with pytest.raises(TimeoutException):
+        hang(1, unhashable=[])
+    assert calls == [1]
+    assert timeout_stats()['timeouts'] == 2
+    assert timeout_stats()['abandoned_workers'] == 1
+
+    with pytest.raises(TimeoutException):
+        hang(2)
+    # too many workers stuck, time out right away
+    with pytest.raises(TimeoutException):
+        hang(3)
+    assert calls == [1, 2]
+    assert timeout_stats()['abandoned_workers'] == 2
+
+    # the limit is per decorated function
+    @timeout(5)
+    def other(x):
+        return x
+    assert other(4) == 4
+
+    release.set()
+    assert hang(1, unhashable=[]) == 1
+    deadline = time.time() + 5
+    while timeout_stats()['abandoned_workers'] and time.time() < deadline:
+        time.sleep(0.01)
+    assert timeout_stats()['abandoned_workers'] == 0
+    assert timeout_stats()['timeouts'] == 4
+
+
+def test_submit_timeout_stats(pool):
+    check = mock.MagicMock()
+    submit_timeout_stats(check, tags=['foo:bar'])
+    check.monotonic_count.assert_called_once_with('datadog.check.timeout.timeouts', 0, tags=['foo:bar'])
+    check.gauge.assert_any_call('datadog.check.timeout.abandoned_workers', 0, tags=['foo:bar'])
+    check.gauge.assert_any_call('datadog.check.timeout.idle_workers', 0, tags=['foo:bar'])
+    assert check.gauge.call_count == 2
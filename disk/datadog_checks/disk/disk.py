@@ -14,7 +14,7 @@ from datadog_checks.checks import AgentCheck
 from datadog_checks.config import _is_affirmative
 from datadog_checks.utils.platform import Platform
 from datadog_checks.utils.subprocess_output import get_subprocess_output
-from datadog_checks.utils.timeout import timeout, TimeoutException
+from datadog_checks.utils.timeout import timeout, submit_timeout_stats, TimeoutException
 
 IGNORE_CASE = re.I if platform.system() == 'Windows' else 0
 
@@ -128,6 +128,8 @@ class Disk(AgentCheck):
                            tags=tags, device_name=device_name)
 
         self.collect_latency_metrics()
+        # the disk usage and inodes calls time out on hanging mountpoints
+        submit_timeout_stats(self, tags=self._custom_tags)
 
     def _exclude_disk_psutil(self, part):
         # skip cd-rom drives with no disk in it; they may raise
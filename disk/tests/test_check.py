@@ -26,6 +26,11 @@ DISK_RATES = [
     'system.disk.write_time_pct',
     'system.disk.read_time_pct',
 ]
+TIMEOUT_METRICS = [
+    'datadog.check.timeout.timeouts',
+    'datadog.check.timeout.abandoned_workers',
+    'datadog.check.timeout.idle_workers',
+]
 INODE_GAUGES = [
     'system.fs.inodes.total',
     'system.fs.inodes.used',
@@ -128,7 +133,7 @@ def test_disk_check(aggregator):
     """
     c = Disk('disk', None, {}, [{'use_mount': 'no'}])
     c.check({'use_mount': 'no'})
-    for name in DISK_GAUGES + INODE_GAUGES + DISK_RATES:
+    for name in DISK_GAUGES + INODE_GAUGES + DISK_RATES + TIMEOUT_METRICS:
         aggregator.assert_metric(name, tags=[])
 
     assert aggregator.metrics_asserted_pct == 100.0
@@ -206,6 +211,9 @@ def test_psutil(aggregator, psutil_mocks):
         for name, value in RATES_VALUES.iteritems():
             aggregator.assert_metric(name, value=value, tags=['device:{}'.format(DEFAULT_DEVICE_NAME)])
 
+        for name in TIMEOUT_METRICS:
+            aggregator.assert_metric(name, tags=[])
+
     assert aggregator.metrics_asserted_pct == 100.0
 
 def test_use_mount(aggregator, psutil_mocks):
@@ -222,6 +230,9 @@ def test_use_mount(aggregator, psutil_mocks):
     for name, value in RATES_VALUES.iteritems():
         aggregator.assert_metric(name, value=value, tags=['device:{}'.format(DEFAULT_DEVICE_NAME)])
 
+    for name in TIMEOUT_METRICS:
+        aggregator.assert_metric(name, tags=[])
+
     assert aggregator.metrics_asserted_pct == 100.0
 
 def mock_df_output(fname):
@@ -314,4 +325,7 @@ def test_device_tagging(aggregator, psutil_mocks):
     for name, value in RATES_VALUES.iteritems():
         aggregator.assert_metric(name, value=value, tags=['device:{}'.format(DEFAULT_DEVICE_NAME), "optional:tags1"])
 
+    for name in TIMEOUT_METRICS:
+        aggregator.assert_metric(name, tags=["optional:tags1"])
+
     assert aggregator.metrics_asserted_pct == 100.0
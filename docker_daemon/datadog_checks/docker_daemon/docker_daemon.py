@@ -6,6 +6,7 @@
 import os
 import re
 import socket
+import time
 import urllib2
 from collections import defaultdict, Counter, deque
 from math import ceil
@@ -24,6 +25,8 @@ from utils.kubernetes import KubeUtil
 from utils.platform import Platform
 from utils.service_discovery.sd_backend import get_sd_backend
 from utils.orchestrator import MetadataCollector
+from datadog_checks.checks.libs.thread_pool import get_shared_pool, TimeoutError
+from datadog_checks.checks.libs.timer import Timer
 
 
 EVENT_TYPE = 'docker'
@@ -31,6 +34,7 @@ SERVICE_CHECK_NAME = 'docker.service_up'
 HEALTHCHECK_SERVICE_CHECK_NAME = 'docker.container_health'
 EXIT_SERVICE_CHECK_NAME = 'docker.exit'
 SIZE_REFRESH_RATE = 5  # Collect container sizes every 5 iterations of the check
+DEFAULT_CGROUP_COLLECTION_TIMEOUT = 10  # Time after which the containers whose cgroup files aren't read are skipped
 CONTAINER_ID_RE = re.compile('[0-9a-f]{64}')
 
 DISK_STATS_RE = re.compile('([0-9.]+)\s?([a-zA-Z]+)')
@@ -107,6 +111,20 @@ CGROUP_METRICS = [
     },
 ]
 
+
+def _cgroup_file_keys(cgroup_metrics):
+    keys = defaultdict(set)
+    for cgroup in cgroup_metrics:
+        keys[cgroup['file']].update(cgroup['metrics'])
+        for key_list, _, _ in cgroup.get('to_compute', {}).itervalues():
+            keys[cgroup['file']].update(key_list)
+    return dict((filename, frozenset(file_keys)) for filename, file_keys in keys.iteritems())
+
+
+# The keys of the cgroup files which are reported or used to compute metrics, the other lines aren't parsed
+CGROUP_FILE_KEYS = _cgroup_file_keys(CGROUP_METRICS)
+
+
 DEFAULT_CONTAINER_TAGS = [
     "docker_image",
     "short_image",
@@ -270,6 +288,20 @@ class DockerDaemon(AgentCheck):
 
             self.capped_metrics = instance.get('capped_metrics')
 
+            # Paths of the cgroup files of the running containers: container id -> (pid, {file name: path})
+            self._cgroup_files = {}
+            # The cgroup files are read in the shared thread pool when there are more than one thread
+            self.cgroup_threads = int(instance.get('cgroup_collection_threads', 1))
+            self.cgroup_timeout = float(instance.get('cgroup_collection_timeout', DEFAULT_CGROUP_COLLECTION_TIMEOUT))
+            self._cgroup_pool = None
+            if self.cgroup_threads > 1:
+                self._cgroup_pool = get_shared_pool().client(self.name, quota=self.cgroup_threads)
+
+            # Container id of the processes by pid, with the ctime of their /proc directory: pid -> (ctime, id)
+            # The id is None for the processes which aren't in a container
+            self._pid_containers = {}
+            self._rescan_unassigned_pids = False
+
         except Exception as e:
             self.log.critical(e)
             self.warning("Initialization failed. Will retry at next iteration")
@@ -650,23 +682,48 @@ class DockerDaemon(AgentCheck):
     # Performance metrics
 
     def _report_performance_metrics(self, containers_by_id):
-
-        containers_without_proc_root = []
+        """
+        Report the cgroup and network metrics of the running containers, in three phases:
+        the paths of their cgroup files are resolved (or taken from the cache), then the files are read,
+        possibly in the thread pool, and the metrics are reported.
+        """
+        t = Timer()
+        cgroup_files = {}
         for container_id, container in containers_by_id.iteritems():
             if self._is_container_excluded(container) or not self._is_container_running(container):
                 continue
 
-            tags = self._get_tags(container, PERFORMANCE)
-
             try:
-                self._report_cgroup_metrics(container, tags)
-                if "_proc_root" not in container:
-                    containers_without_proc_root.append(DockerUtil.container_name_extractor(container)[0])
-                    continue
-                self._report_net_metrics(container, tags)
+                cgroup_files[container_id] = self._get_cgroup_files(container)
             except BogusPIDException as e:
                 self.log.warning('Unable to report cgroup metrics for container %s: %s', container_id[:12], e)
 
+        # forget the containers which stopped
+        for container_id in set(self._cgroup_files).difference(cgroup_files):
+            del self._cgroup_files[container_id]
+        resolve_time = t.step()
+
+        cgroup_stats = self._read_cgroup_stats(cgroup_files)
+        read_time = t.step()
+
+        containers_without_proc_root = []
+        for container_id, stats in cgroup_stats.iteritems():
+            container = containers_by_id[container_id]
+            tags = self._get_tags(container, PERFORMANCE)
+
+            self._report_cgroup_metrics(stats, tags)
+            if "_proc_root" not in container:
+                containers_without_proc_root.append(DockerUtil.container_name_extractor(container)[0])
+                continue
+            self._report_net_metrics(container, tags)
+        report_time = t.step()
+
+        self.histogram('datadog.agent.docker.cgroup_metrics.resolve.time', resolve_time, tags=self.custom_tags)
+        self.histogram('datadog.agent.docker.cgroup_metrics.read.time', read_time, tags=self.custom_tags)
+        self.histogram('datadog.agent.docker.cgroup_metrics.report.time', report_time, tags=self.custom_tags)
+        if self._cgroup_pool is not None:
+            self._cgroup_pool.submit_stats(self.gauge, tags=self.custom_tags)
+
         if containers_without_proc_root:
             message = "Couldn't find pid directory for containers: {0}. They'll be missing network metrics".format(
                 ", ".join(containers_without_proc_root))
@@ -676,14 +733,28 @@ class DockerDaemon(AgentCheck):
                 # On kubernetes, this is kind of expected. Network metrics will be collected by the kubernetes integration anyway
                 self.log.debug(message)
 
-    def _report_cgroup_metrics(self, container, tags):
-        cgroup_stat_file_failures = 0
-        if not container.get('_pid'):
+    def _get_cgroup_files(self, container):
+        """
+        Return the paths of the cgroup files of a container by file name.
+        They're resolved once for the pid of the container, the files which couldn't be found are tried again next run.
+        """
+        pid = container.get('_pid')
+        if not pid:
             raise BogusPIDException('Cannot report on bogus pid(0)')
 
+        cached_pid, paths = self._cgroup_files.get(container['Id'], (None, None))
+        if cached_pid != pid:
+            paths = {}
+            self._cgroup_files[container['Id']] = (pid, paths)
+        elif len(paths) == len(CGROUP_METRICS):
+            return paths
+
+        cgroup_stat_file_failures = 0
         for cgroup in CGROUP_METRICS:
+            if cgroup['file'] in paths:
+                continue
             try:
-                stat_file = self._get_cgroup_from_proc(cgroup["cgroup"], container['_pid'], cgroup['file'])
+                paths[cgroup['file']] = self._get_cgroup_from_proc(cgroup["cgroup"], pid, cgroup['file'])
             except MountException as e:
                 # We can't find a stat file
                 self.warning(str(e))
@@ -692,24 +763,64 @@ class DockerDaemon(AgentCheck):
                     self.warning("Couldn't find the cgroup files. Skipping the CGROUP_METRICS for now.")
             except IOError as e:
                 self.log.debug("Cannot read cgroup file, container likely raced to finish : %s", e)
-            else:
-                stats = self._parse_cgroup_file(stat_file)
-                if stats:
-                    for key, (dd_key, metric_func) in cgroup['metrics'].iteritems():
-                        metric_func = FUNC_MAP[metric_func][self.use_histogram]
-                        if key in stats:
-                            metric_func(self, dd_key, int(stats[key]), tags=tags)
-
-                    # Computed metrics
-                    for mname, (key_list, fct, metric_func) in cgroup.get('to_compute', {}).iteritems():
-                        values = [stats[key] for key in key_list if key in stats]
-                        if len(values) != len(key_list):
-                            self.log.debug("Couldn't compute {0}, some keys were missing.".format(mname))
-                            continue
-                        value = fct(*values)
-                        metric_func = FUNC_MAP[metric_func][self.use_histogram]
-                        if value is not None:
-                            metric_func(self, mname, value, tags=tags)
+        return paths
+
+    def _read_cgroup_stats(self, cgroup_files):
+        """
+        Parse the cgroup files of the containers, return their stats by container id and file name.
+        With a thread pool, the containers are split between `cgroup_threads` jobs, the containers
+        of the jobs not done within `cgroup_timeout` seconds are skipped for this run.
+        """
+        items = cgroup_files.items()
+        if self._cgroup_pool is None or len(items) < 2:
+            return self._parse_cgroup_files(items)
+
+        deadline = time.time() + self.cgroup_timeout
+        jobs = [self._cgroup_pool.apply_async(self._parse_cgroup_files, (items[i::self.cgroup_threads],))
+                for i in xrange(min(self.cgroup_threads, len(items)))]
+        cgroup_stats = {}
+        skipped = []
+        for i, job in enumerate(jobs):
+            try:
+                cgroup_stats.update(job.get(max(deadline - time.time(), 0)))
+            except TimeoutError:
+                # the worker stuck on the job is replaced, the job keeps its slot until it returns
+                job.cancel()
+                skipped.extend(container_id[:12] for container_id, _ in items[i::self.cgroup_threads])
+        if skipped:
+            self.warning("Reading the cgroup files took more than {0}s, skipping the cgroup metrics of "
+                         "containers: {1}".format(self.cgroup_timeout, ", ".join(skipped)))
+        return cgroup_stats
+
+    def _parse_cgroup_files(self, cgroup_files):
+        """Parse the cgroup files of a list of (container id, {file name: path})."""
+        cgroup_stats = {}
+        for container_id, paths in cgroup_files:
+            cgroup_stats[container_id] = dict(
+                (filename, self._parse_cgroup_file(path)) for filename, path in paths.iteritems()
+            )
+        return cgroup_stats
+
+    def _report_cgroup_metrics(self, cgroup_stats, tags):
+        """Report the metrics of the parsed cgroup files of a container."""
+        for cgroup in CGROUP_METRICS:
+            stats = cgroup_stats.get(cgroup['file'])
+            if stats:
+                for key, (dd_key, metric_func) in cgroup['metrics'].iteritems():
+                    metric_func = FUNC_MAP[metric_func][self.use_histogram]
+                    if key in stats:
+                        metric_func(self, dd_key, int(stats[key]), tags=tags)
+
+                # Computed metrics
+                for mname, (key_list, fct, metric_func) in cgroup.get('to_compute', {}).iteritems():
+                    values = [stats[key] for key in key_list if key in stats]
+                    if len(values) != len(key_list):
+                        self.log.debug("Couldn't compute {0}, some keys were missing.".format(mname))
+                        continue
+                    value = fct(*values)
+                    metric_func = FUNC_MAP[metric_func][self.use_histogram]
+                    if value is not None:
+                        metric_func(self, mname, value, tags=tags)
 
     def _report_net_metrics(self, container, tags):
         """Find container network metrics by looking at /proc/$PID/net/dev of the container process."""
@@ -766,6 +877,27 @@ class DockerDaemon(AgentCheck):
             except Exception:
                 self.log.warning('Malformed network event: %s' % str(ev))
 
+    def _invalidate_pid_mapping(self, api_events):
+        """
+        Forget the processes of the containers which died. When a container starts, the processes which
+        aren't in a container are inspected again at the next run: the processes of a container are moved
+        to its cgroup after they're created, they may have been inspected before that.
+        """
+        dead_container_ids = set()
+        for ev in api_events:
+            if ev.get('Type', 'container') != 'container':
+                continue
+            if ev.get('status') in ('start', 'restart'):
+                self._rescan_unassigned_pids = True
+            elif ev.get('status') in ('die', 'destroy'):
+                dead_container_ids.add(ev.get('id'))
+
+        if dead_container_ids:
+            self._pid_containers = dict(
+                (pid, entry) for pid, entry in self._pid_containers.iteritems()
+                if entry[1] not in dead_container_ids
+            )
+
     def _process_events(self, containers_by_id):
         api_events = self._get_events()
 
@@ -791,6 +923,7 @@ class DockerDaemon(AgentCheck):
     def _get_events(self):
         """Get the list of events."""
         events, changed_container_ids = self.docker_util.get_events()
+        self._invalidate_pid_mapping(events)
         if not self._disable_net_metrics:
             self._invalidate_network_mapping_cache(events)
         if changed_container_ids and self._service_discovery:
@@ -1010,27 +1143,37 @@ class DockerDaemon(AgentCheck):
         return DockerUtil.find_cgroup_from_proc(self._mountpoints, pid, cgroup, self.docker_util._docker_root) % (params)
 
     def _parse_cgroup_file(self, stat_file):
-        """Parse a cgroup pseudo file for key/values."""
+        """Parse a cgroup pseudo file for key/values, only the keys in CGROUP_FILE_KEYS are kept."""
         self.log.debug("Opening cgroup file: %s" % stat_file)
         try:
-            with open(stat_file, 'r') as fp:
-                if 'blkio' in stat_file:
-                    return self._parse_blkio_metrics(fp.read().splitlines())
-                elif 'cpuacct.usage' in stat_file:
-                    return dict({'usage': str(int(fp.read())/10000000)})
-                elif 'memory.soft_limit_in_bytes' in stat_file:
-                    value = int(fp.read())
-                    # do not report kernel max default value (uint64 * 4096)
-                    # see https://github.com/torvalds/linux/blob/5b36577109be007a6ecf4b65b54cbc9118463c2b/mm/memcontrol.c#L2844-L2845
-                    # 2 ** 60 is kept for consistency of other cgroups metrics
-                    if value < 2 ** 60:
-                        return dict({'softlimit': value})
-                else:
-                    return dict(map(lambda x: x.split(' ', 1), fp.read().splitlines()))
+            with open(stat_file, 'rb') as fp:
+                content = fp.read()
         except IOError:
             # It is possible that the container got stopped between the API call and now.
             # Some files can also be missing (like cpu.stat) and that's fine.
             self.log.debug("Can't open %s. Its metrics will be missing." % stat_file)
+            return
+
+        filename = os.path.basename(stat_file)
+        if 'blkio' in filename:
+            return self._parse_blkio_metrics(content.splitlines())
+        elif filename == 'cpuacct.usage':
+            return dict({'usage': str(int(content)/10000000)})
+        elif filename == 'memory.soft_limit_in_bytes':
+            value = int(content)
+            # do not report kernel max default value (uint64 * 4096)
+            # see https://github.com/torvalds/linux/blob/5b36577109be007a6ecf4b65b54cbc9118463c2b/mm/memcontrol.c#L2844-L2845
+            # 2 ** 60 is kept for consistency of other cgroups metrics
+            if value < 2 ** 60:
+                return dict({'softlimit': value})
+        else:
+            keys = CGROUP_FILE_KEYS.get(filename)
+            stats = {}
+            for line in content.splitlines():
+                key, _, value = line.partition(' ')
+                if keys is None or key in keys:
+                    stats[key] = value
+            return stats
 
     def _parse_blkio_metrics(self, stats):
         """Parse the blkio metrics."""
@@ -1060,7 +1203,10 @@ class DockerDaemon(AgentCheck):
 
     # proc files
     def _crawl_container_pids(self, container_dict, custom_cgroups=False):
-        """Crawl `/proc` to find container PIDs and add them to `containers_by_id`."""
+        """
+        Crawl `/proc` to find container PIDs and add them to `containers_by_id`.
+        Only the processes which appeared since the last run are inspected, see `_map_pids`.
+        """
         proc_path = os.path.join(self.docker_util._docker_root, 'proc')
         pid_dirs = [_dir for _dir in os.listdir(proc_path) if _dir.isdigit()]
 
@@ -1075,52 +1221,99 @@ class DockerDaemon(AgentCheck):
 
         self._disable_net_metrics = False
 
+        container_pids = self._map_pids(proc_path, pid_dirs, self._rescan_unassigned_pids)
+        self._rescan_unassigned_pids = False
+
+        # the processes of a running container without pid may have been inspected before they joined its cgroup
+        for container_id, container in container_dict.iteritems():
+            if container_id not in container_pids and not container.get('_pid') and \
+                    self._is_container_running(container):
+                container_pids = self._map_pids(proc_path, pid_dirs, True)
+                break
+
+        for container_id, pid in container_pids.iteritems():
+            if container_id not in container_dict:
+                self.log.debug("Container %s not in container_dict, it's likely excluded", container_id)
+                continue
+            container_dict[container_id]['_pid'] = pid
+            container_dict[container_id]['_proc_root'] = os.path.join(proc_path, pid)
+
+        if custom_cgroups:
+            # the pids of the containers come from the API
+            for container in container_dict.itervalues():
+                pid = str(container.get('_pid'))
+                if '_proc_root' not in container and pid in self._pid_containers:
+                    container['_proc_root'] = os.path.join(proc_path, pid)
+
+        return container_dict
+
+    def _map_pids(self, proc_path, pid_dirs, rescan_unassigned=False):
+        """
+        Update the container id of each process, and return the lowest pid of each container by id:
+        its init process is the most likely to stay, along with the cgroup files resolved from it.
+        A process is only inspected once: it's identified by its pid and the ctime of its /proc directory,
+        which changes when the pid is reused. With `rescan_unassigned`, the processes which weren't in
+        a container are inspected again.
+        """
+        pid_containers = {}
+        inspected = 0
         for folder in pid_dirs:
             try:
-                path = os.path.join(proc_path, folder, 'cgroup')
-                with open(path, 'r') as f:
-                    content = [line.strip().split(':') for line in f.readlines()]
-
-                selinux_policy = ''
-                path = os.path.join(proc_path, folder, 'attr', 'current')
-                if os.path.exists(path):
-                    with open(path, 'r') as f:
-                        selinux_policy = f.readlines()[0]
-            except IOError, e:
-                #  Issue #2074
-                self.log.debug("Cannot read %s, process likely raced to finish : %s", path, e)
-            except Exception as e:
-                self.warning("Cannot read %s : %s" % (path, str(e)))
+                ctime = os.stat(os.path.join(proc_path, folder)).st_ctime
+            except OSError:
+                # the process finished since /proc was listed
                 continue
 
-            try:
-                for line in content:
-                    if self._is_container_cgroup(line, selinux_policy):
-                        cpuacct = line[2]
-                        break
-                else:
+            entry = self._pid_containers.get(folder)
+            if entry is None or entry[0] != ctime or (entry[1] is None and rescan_unassigned):
+                inspected += 1
+                try:
+                    entry = (ctime, self._get_pid_container_id(proc_path, folder))
+                except IOError as e:
+                    #  Issue #2074
+                    self.log.debug("Cannot read the cgroup of pid %s, process likely raced to finish : %s", folder, e)
                     continue
+                except Exception as e:
+                    self.warning("Cannot parse the cgroup of pid %s: %s" % (folder, str(e)))
+                    continue
+            pid_containers[folder] = entry
 
-                matches = re.findall(CONTAINER_ID_RE, cpuacct)
-                if matches:
-                    container_id = matches[-1]
-                    if container_id not in container_dict:
-                        self.log.debug(
-                            "Container %s not in container_dict, it's likely excluded", container_id
-                        )
-                        continue
-                    container_dict[container_id]['_pid'] = folder
-                    container_dict[container_id]['_proc_root'] = os.path.join(proc_path, folder)
-                elif custom_cgroups:  # if we match by pid that should be enough (?) - O(n) ugh!
-                    for _, container in container_dict.iteritems():
-                        if container.get('_pid') == int(folder):
-                            container['_proc_root'] = os.path.join(proc_path, folder)
-                            break
-
-            except Exception, e:
-                self.warning("Cannot parse %s content: %s" % (path, str(e)))
+        # forget the processes which finished
+        self._pid_containers = pid_containers
+        self.log.debug("Inspected %d of the %d processes", inspected, len(pid_dirs))
+
+        container_pids = {}
+        for pid, (_, container_id) in pid_containers.iteritems():
+            if container_id is None:
                 continue
-        return container_dict
+            if container_id not in container_pids or int(pid) < int(container_pids[container_id]):
+                container_pids[container_id] = pid
+        return container_pids
+
+    def _get_pid_container_id(self, proc_path, pid):
+        """Return the id of the container of a process, None if it isn't in a container."""
+        with open(os.path.join(proc_path, pid, 'cgroup'), 'r') as f:
+            content = [line.strip().split(':') for line in f.readlines()]
+
+        for line in content:
+            if self._is_container_cgroup(line, ''):
+                break
+        else:
+            # the selinux policy is only read when the cgroups don't tell
+            path = os.path.join(proc_path, pid, 'attr', 'current')
+            if not os.path.exists(path):
+                return None
+            with open(path, 'r') as f:
+                selinux_policy = f.readlines()[0]
+            for line in content:
+                if self._is_container_cgroup(line, selinux_policy):
+                    break
+            else:
+                return None
+
+        matches = re.findall(CONTAINER_ID_RE, line[2])
+        if matches:
+            return matches[-1]
 
     def filter_capped_metrics(self):
         metrics = self.aggregator.metrics.values()
@@ -5,6 +5,10 @@
 # stdlib
 import logging
 import mock
+import os
+import shutil
+import tempfile
+import threading
 
 # 3p
 from docker import Client
@@ -12,6 +16,7 @@ from nose.plugins.attrib import attr
 
 # project
 from checks import AgentCheck
+from datadog_checks.checks.libs.thread_pool import get_shared_pool
 from tests.checks.common import AgentCheckTest
 from tests.checks.common import load_check
 from utils.dockerutil import DockerUtil
@@ -99,6 +104,109 @@ class TestCheckDockerDaemonNoSetUp(AgentCheckTest):
         self.assertIn("exitCode:1", filtered_events[0]["tags"])
         self.assertNotIn("name:test-exit-fail", filtered_events[0]["tags"])
 
+    def test_parse_cgroup_file(self):
+        self.run_check(MOCK_CONFIG, force_reload=True)
+        cgroup_dir = tempfile.mkdtemp()
+        try:
+            stat_file = os.path.join(cgroup_dir, 'memory.stat')
+            with open(stat_file, 'w') as f:
+                f.write("cache 4096\nrss 8192\nrss_huge 0\nmapped_file 0\nswap 0\n"
+                        "hierarchical_memory_limit 9223372036854771712\n" + "pgfault 1\n" * 2000)
+            # only the keys which are reported or used to compute metrics are kept
+            self.assertEqual(self.check._parse_cgroup_file(stat_file), {
+                'cache': '4096',
+                'rss': '8192',
+                'swap': '0',
+                'hierarchical_memory_limit': '9223372036854771712',
+            })
+
+            usage_file = os.path.join(cgroup_dir, 'cpuacct.usage')
+            with open(usage_file, 'w') as f:
+                f.write("123456789012\n")
+            self.assertEqual(self.check._parse_cgroup_file(usage_file), {'usage': '12345'})
+
+            self.assertIsNone(self.check._parse_cgroup_file(os.path.join(cgroup_dir, 'cpu.stat')))
+        finally:
+            shutil.rmtree(cgroup_dir)
+
+    def test_read_cgroup_stats_timeout(self):
+        self.run_check(MOCK_CONFIG, force_reload=True)
+        self.check.cgroup_threads = 2
+        self.check.cgroup_timeout = 0.1
+        self.check._cgroup_pool = get_shared_pool().client('docker_daemon_test', quota=2)
+
+        stuck = threading.Event()
+        def parse_cgroup_files(cgroup_files):
+            if cgroup_files[0][0] == 'stuck':
+                stuck.wait(5)
+            return dict((container_id, {}) for container_id, _ in cgroup_files)
+
+        try:
+            with mock.patch.object(self.check, '_parse_cgroup_files', side_effect=parse_cgroup_files):
+                # the container whose files couldn't be read in time is skipped
+                self.assertEqual(self.check._read_cgroup_stats({'running': {}, 'stuck': {}}), {'running': {}})
+        finally:
+            stuck.set()
+
+    def test_crawl_container_pids(self):
+        self.run_check(MOCK_CONFIG, force_reload=True)
+        nginx, redis = 'a' * 64, 'b' * 64
+        docker_root = tempfile.mkdtemp()
+
+        def write_cgroup(pid, cgroup):
+            pid_dir = os.path.join(docker_root, 'proc', str(pid))
+            if not os.path.isdir(pid_dir):
+                os.makedirs(pid_dir)
+            with open(os.path.join(pid_dir, 'cgroup'), 'w') as f:
+                f.write("4:cpu,cpuacct:{0}\n3:memory:{0}\n".format(cgroup))
+
+        def crawl():
+            containers = {
+                nginx: {'Id': nginx, 'Status': 'Up 2 minutes'},
+                redis: {'Id': redis, 'Status': 'Exited (0) 1 minute ago'},
+            }
+            return self.check._crawl_container_pids(containers)
+
+        try:
+            write_cgroup(1, '/')
+            write_cgroup(42, '/docker/' + nginx)
+            write_cgroup(43, '/docker/' + nginx)
+            write_cgroup(50, '/system.slice/containerd.service')
+            with mock.patch.object(self.check.docker_util, '_docker_root', docker_root), \
+                    mock.patch.object(self.check, '_get_pid_container_id',
+                                      wraps=self.check._get_pid_container_id) as inspect:
+                containers = crawl()
+                # the lowest pid of a container is kept
+                self.assertEqual(containers[nginx]['_pid'], '42')
+                self.assertEqual(containers[nginx]['_proc_root'], os.path.join(docker_root, 'proc', '42'))
+                self.assertNotIn('_pid', containers[redis])
+                self.assertEqual(inspect.call_count, 4)
+
+                # the processes are only inspected once
+                write_cgroup(50, '/docker/' + redis)
+                containers = crawl()
+                self.assertNotIn('_pid', containers[redis])
+                self.assertEqual(inspect.call_count, 4)
+
+                # until a container starts
+                self.check._invalidate_pid_mapping([{'Type': 'container', 'status': 'start', 'id': redis}])
+                containers = crawl()
+                self.assertEqual(containers[redis]['_pid'], '50')
+                self.assertEqual(inspect.call_count, 6)
+
+                # the processes of the containers which died are forgotten
+                self.check._invalidate_pid_mapping([{'Type': 'container', 'status': 'die', 'id': redis}])
+                self.assertEqual(sorted(self.check._pid_containers), ['1', '42', '43'])
+
+                # a reused pid is inspected again
+                shutil.rmtree(os.path.join(docker_root, 'proc', '42'))
+                write_cgroup(42, '/docker/' + redis)
+                containers = crawl()
+                self.assertEqual(containers[nginx]['_pid'], '43')
+                self.assertEqual(containers[redis]['_pid'], '42')
+        finally:
+            shutil.rmtree(docker_root)
+
 @attr(requires='docker_daemon')
 class TestCheckDockerDaemon(AgentCheckTest):
     """Basic Test for docker_daemon integration."""
@@ -686,6 +794,40 @@ class TestCheckDockerDaemon(AgentCheckTest):
             for suffix in metric_suffix:
                 self.assertMetric(mname + "." + suffix, tags=tags, at_least=1)
 
+    def test_cgroup_collection_threads(self):
+        expected_metrics = [
+            ('docker.mem.rss', ['container_name:test-new-nginx-latest', 'docker_image:nginx:latest', 'image_name:nginx', 'image_tag:latest']),
+            ('docker.mem.rss', ['container_name:test-new-redis-latest', 'docker_image:redis:latest', 'image_name:redis', 'image_tag:latest']),
+            ('docker.mem.limit', ['container_name:test-new-nginx-latest', 'docker_image:nginx:latest', 'image_name:nginx', 'image_tag:latest']),
+            ('docker.cpu.user', ['container_name:test-new-nginx-latest', 'docker_image:nginx:latest', 'image_name:nginx', 'image_tag:latest']),
+            ('docker.io.read_bytes', ['container_name:test-new-redis-latest', 'docker_image:redis:latest', 'image_name:redis', 'image_tag:latest']),
+            ('datadog.agent.docker.cgroup_metrics.resolve.time.max', None),
+            ('datadog.agent.docker.cgroup_metrics.read.time.max', None),
+            ('datadog.agent.docker.cgroup_metrics.report.time.max', None),
+            ('datadog.check.shared_pool.running', ['pool_client:docker_daemon']),
+        ]
+
+        config = {
+            "init_config": {},
+            "instances": [{
+                "url": "unix://var/run/docker.sock",
+                "cgroup_collection_threads": 4,
+            },
+            ],
+        }
+        DockerUtil._drop()
+        DockerUtil(init_config=config['init_config'], instance=config['instances'][0])
+
+        self.run_check_twice(config, force_reload=True)
+        for mname, tags in expected_metrics:
+            self.assertMetric(mname, tags=tags, at_least=1)
+
+        # the paths of the cgroup files are kept for the running containers
+        for container in self.containers:
+            pid, paths = self.check._cgroup_files[container['Id']]
+            self.assertIn('memory.stat', paths)
+            self.assertTrue(all(os.path.basename(path) == filename for filename, path in paths.iteritems()))
+
     def test_events(self):
         config = {
             "init_config": {},
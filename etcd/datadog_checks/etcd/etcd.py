@@ -9,6 +9,7 @@ import requests
 # project
 from checks import AgentCheck
 from config import _is_affirmative
+from datadog_checks.utils.payload_cache import PayloadCache
 from util import headers
 
 
@@ -69,6 +70,12 @@ class Etcd(AgentCheck):
         'standardDeviation': 'etcd.leader.latency.stddev',
     }
 
+    def __init__(self, name, init_config, agentConfig, instances=None):
+        AgentCheck.__init__(self, name, init_config, agentConfig, instances)
+        # decoded stats of the endpoints, only used with `cache_unchanged_payloads`
+        self._payload_cache = PayloadCache()
+        self._cache_unchanged_payloads = False
+
     def check(self, instance):
         if 'url' not in instance:
             raise Exception('etcd instance missing "url" value.')
@@ -76,6 +83,7 @@ class Etcd(AgentCheck):
         # Load values from the instance config
         url = instance['url']
         instance_tags = instance.get('tags', [])
+        self._cache_unchanged_payloads = _is_affirmative(instance.get('cache_unchanged_payloads', False))
 
         # Load the ssl configuration
         ssl_params = {
@@ -164,6 +172,9 @@ class Etcd(AgentCheck):
             self.service_check(self.SERVICE_CHECK_NAME, AgentCheck.OK,
                                tags=instance_tags)
 
+        if self._cache_unchanged_payloads:
+            self._payload_cache.submit_stats(self.gauge, 'etcd.payload_cache', tags=instance_tags)
+
     def _get_health_status(self, url, ssl_params, timeout, tags):
         """
         Don't send the "can connect" service check if we have troubles getting
@@ -186,16 +197,22 @@ class Etcd(AgentCheck):
     def _get_leader_metrics(self, url, ssl_params, timeout, tags):
         return self._get_json(url, "/v2/stats/leader", ssl_params, timeout, tags)
 
-    def _perform_request(self, url, path, ssl_params, timeout):
+    def _perform_request(self, url, path, ssl_params, timeout, extra_headers=None):
         certificate = None
         if 'ssl_certfile' in ssl_params and 'ssl_keyfile' in ssl_params:
             certificate = (ssl_params['ssl_certfile'], ssl_params['ssl_keyfile'])
         verify = ssl_params.get('ssl_ca_certs', True) if ssl_params['ssl_cert_validation'] else False
-        return requests.get(url + path, verify=verify, cert=certificate, timeout=timeout, headers=headers(self.agentConfig))
+        request_headers = headers(self.agentConfig)
+        if extra_headers:
+            request_headers.update(extra_headers)
+        return requests.get(url + path, verify=verify, cert=certificate, timeout=timeout, headers=request_headers)
 
     def _get_json(self, url, path, ssl_params, timeout, tags):
+        conditional_headers = None
+        if self._cache_unchanged_payloads:
+            conditional_headers = self._payload_cache.request_headers(url + path)
         try:
-            r = self._perform_request(url, path, ssl_params, timeout)
+            r = self._perform_request(url, path, ssl_params, timeout, conditional_headers)
         except requests.exceptions.Timeout:
             self.service_check(self.SERVICE_CHECK_NAME, AgentCheck.CRITICAL,
                                message="Timeout when hitting %s" % url,
@@ -207,12 +224,20 @@ class Etcd(AgentCheck):
                                tags=tags + ["url:{0}".format(url)])
             raise
 
-        if r.status_code != 200:
+        if r.status_code != 200 and not (r.status_code == 304 and self._cache_unchanged_payloads):
             self.service_check(self.SERVICE_CHECK_NAME, AgentCheck.CRITICAL,
                                message="Got %s when hitting %s" % (r.status_code, url),
                                tags=tags + ["url:{0}".format(url)])
             raise Exception("Http status code {0} on url {1}".format(r.status_code, url))
 
+        if self._cache_unchanged_payloads:
+            # the payload is requested again without the conditional headers if it's not cached anymore
+            def refetch():
+                response = self._perform_request(url, path, ssl_params, timeout)
+                response.raise_for_status()
+                return response
+
+            return self._payload_cache.load_json(url + path, r, refetch)
         return r.json()
 
     def _is_healthy(self, status):
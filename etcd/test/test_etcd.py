@@ -2,11 +2,49 @@
 # All rights reserved
 # Licensed under Simplified BSD License (see LICENSE)
 
+# stdlib
+import json
+
 # 3p
+import mock
 from nose.plugins.attrib import attr
 
 # project
-from tests.checks.common import AgentCheckTest
+from tests.checks.common import AgentCheckTest, load_check
+
+
+def _response(payload, status_code=200, headers=None):
+    response = mock.MagicMock(status_code=status_code, content=payload, headers=headers or {}, encoding='utf-8')
+    response.json.side_effect = lambda: json.loads(payload)
+    return response
+
+
+class TestEtcdPayloadCache(AgentCheckTest):
+    CHECK_NAME = "etcd"
+
+    SSL_PARAMS = {'ssl_cert_validation': True}
+
+    def test_cache_unchanged_payloads(self):
+        config = {"instances": [{"url": "http://localhost:2379", "cache_unchanged_payloads": True}]}
+        self.check = load_check(self.CHECK_NAME, config, {})
+        self.check._cache_unchanged_payloads = True
+        payload = '{"getsSuccess": 3}'
+
+        with mock.patch('requests.get', return_value=_response(payload, headers={'ETag': '"1"'})):
+            first = self.check._get_json("http://localhost:2379", "/v2/stats/store", self.SSL_PARAMS, 5, [])
+        with mock.patch('requests.get', return_value=_response('', status_code=304)) as get:
+            self.assertIs(self.check._get_json("http://localhost:2379", "/v2/stats/store", self.SSL_PARAMS, 5, []),
+                          first)
+        self.assertEquals(get.call_args[1]['headers']['If-None-Match'], '"1"')
+
+        # a 304 for a payload which isn't cached is requested again without conditional headers
+        self.check = load_check(self.CHECK_NAME, config, {})
+        self.check._cache_unchanged_payloads = True
+        with mock.patch('requests.get', side_effect=[_response('', status_code=304), _response(payload)]) as get:
+            self.assertEquals(self.check._get_json("http://localhost:2379", "/v2/stats/store", self.SSL_PARAMS, 5, []),
+                              json.loads(payload))
+        self.assertEquals(get.call_count, 2)
+        self.assertNotIn('If-None-Match', get.call_args[1]['headers'])
 
 
 @attr(requires='etcd')
@@ -25,6 +25,9 @@ class GitlabCheck(PrometheusCheck):
 
     PROMETHEUS_SERVICE_CHECK_NAME = 'gitlab.prometheus_endpoint_up'
 
+    # Gitlab only exposes the text format
+    FAST_TEXT_PARSER = True
+
     """
     Collect Gitlab metrics from Prometheus and validates that the connectivity with Gitlab
     """
@@ -31,7 +31,7 @@ def mock_iptables():
     with open(f_name, 'r') as f:
         text_data = f.read()
     mock_iptables = mock.patch(
-        'requests.get',
+        'requests.Session.get',
         return_value=mock.MagicMock(
             status_code=200,
             iter_lines=lambda **kwargs: text_data.split("\n"),
@@ -47,7 +47,7 @@ def mock_userspace():
     with open(f_name, 'r') as f:
         text_data = f.read()
     mock_userspace = mock.patch(
-        'requests.get',
+        'requests.Session.get',
         return_value=mock.MagicMock(
             status_code=200,
             iter_lines=lambda **kwargs: text_data.split("\n"),
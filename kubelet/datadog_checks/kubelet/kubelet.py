@@ -14,8 +14,10 @@ import requests
 from datadog_checks.checks import AgentCheck
 from datadog_checks.errors import CheckException
 from datadog_checks.checks.prometheus import PrometheusCheck
+from datadog_checks.utils.containers import LRUCache
 from kubeutil import get_connection_info
 from tagger import get_tags
+from .pod_list import read_pod_list
 
 METRIC_TYPES = ['counter', 'gauge', 'summary']
 # container-specific metrics should have all these labels
@@ -25,6 +27,8 @@ KUBELET_HEALTH_PATH = '/healthz'
 NODE_SPEC_PATH = '/spec'
 POD_LIST_PATH = '/pods/'
 CADVISOR_METRICS_PATH = '/metrics/cadvisor'
+# size of the chunks the pod list is read and decoded by
+POD_LIST_CHUNK_SIZE = 64 * 1024
 
 # Suffixes per
 # https://github.com/kubernetes/kubernetes/blob/8fd414537b5143ab039cb910590237cabf4af783/pkg/api/resource/suffix.go#L108
@@ -53,6 +57,11 @@ class KubeletCheck(PrometheusCheck):
     """
     Collect container metrics from Kubelet.
     """
+    # Most of the cAdvisor families are ignored, don't decode them
+    SKIP_UNHANDLED_FAMILIES = True
+    # Maximum number of cgroup paths whose container id and pod uid are cached
+    CGROUP_IDS_CACHE_SIZE = 10000
+
     def __init__(self, name, init_config, agentConfig, instances=None):
         super(KubeletCheck, self).__init__(name, init_config, agentConfig, instances)
         self.NAMESPACE = 'kubernetes'
@@ -96,6 +105,18 @@ class KubeletCheck(PrometheusCheck):
         self.fs_usage_bytes = {}
         self.mem_usage_bytes = {}
 
+        # the pods of the pod list by uid, the uids of the host networked ones, and the
+        # tags of the entities, rebuilt at each run by `_index_pods`
+        self.pod_list = None
+        self._pods_by_uid = {}
+        self._host_networked_pods = set()
+        self._entity_tags = {}
+        # resourceVersion and requests & limits of the containers of each pod by uid,
+        # so that they're only computed again when the pod spec changes
+        self._pod_spec_metrics = {}
+        # container id and pod uid parsed from the cgroup paths of the cAdvisor metrics
+        self._cgroup_ids = LRUCache(self.CGROUP_IDS_CACHE_SIZE)
+
     def check(self, instance):
         self.kubelet_conn_info = get_connection_info()
         endpoint = self.kubelet_conn_info.get('url')
@@ -119,6 +140,7 @@ class KubeletCheck(PrometheusCheck):
             self.pod_list = self.retrieve_pod_list()
         except Exception:
             self.pod_list = None
+        self._index_pods(self.pod_list)
 
         instance_tags = instance.get('tags', [])
         self._perform_kubelet_check(instance_tags)
@@ -127,7 +149,7 @@ class KubeletCheck(PrometheusCheck):
         self._report_container_spec_metrics(self.pod_list, instance_tags)
         self.process(self.metrics_url, send_histograms_buckets=send_buckets, instance=instance)
 
-    def perform_kubelet_query(self, url, verbose=True, timeout=10):
+    def perform_kubelet_query(self, url, verbose=True, timeout=10, stream=False):
         """
         Perform and return a GET request against kubelet. Support auth and TLS validation.
         """
@@ -149,11 +171,47 @@ class KubeletCheck(PrometheusCheck):
             headers = {'Authorization': 'Bearer {}'.format(self.kubelet_conn_info['token'])}
             self.extra_headers = headers  # prometheus check setting
 
-        return requests.get(url, timeout=timeout, verify=verify,
+        return requests.get(url, timeout=timeout, verify=verify, stream=stream,
                             cert=cert, headers=headers, params={'verbose': verbose})
 
     def retrieve_pod_list(self):
-        return self.perform_kubelet_query(self.pod_list_url).json()
+        """
+        Retrieve the pods of the pod list as `Pod` records, decoding them as the response is read
+        instead of loading the whole pod list. The pods whose resourceVersion didn't change
+        since the last run keep their record.
+        """
+        response = self.perform_kubelet_query(self.pod_list_url, stream=True)
+        try:
+            return list(read_pod_list(response.iter_content(chunk_size=POD_LIST_CHUNK_SIZE), self._pods_by_uid))
+        finally:
+            response.close()
+
+    def _index_pods(self, pod_list):
+        """
+        Index the pods of `pod_list` by uid, so that the metric handlers look them up in constant time
+        """
+        self._pods_by_uid = {}
+        self._host_networked_pods = set()
+        self._entity_tags = {}
+        if not pod_list:
+            return
+
+        for pod in pod_list:
+            if pod.uid is None:
+                continue
+            self._pods_by_uid[pod.uid] = pod
+            if pod.host_network:
+                self._host_networked_pods.add(pod.uid)
+
+    def _get_entity_tags(self, entity):
+        """
+        Return the high cardinality tags of `entity` from the tagger, cached until the next run.
+        The list is shared, it must not be modified.
+        """
+        tags = self._entity_tags.get(entity)
+        if tags is None:
+            tags = self._entity_tags[entity] = get_tags(entity, True) or []
+        return tags
 
     def retrieve_node_spec(self):
         """
@@ -214,9 +272,8 @@ class KubeletCheck(PrometheusCheck):
         tagged by service and creator.
         """
         tag_counter = {}
-        for pod in pods['items']:
-            pod_id = pod.get('metadata', {}).get('uid')
-            tags = get_tags('kubernetes_pod://%s' % pod_id, False) or None
+        for pod in pods:
+            tags = get_tags('kubernetes_pod://%s' % pod.uid, False) or None
             if not tags:
                 continue
             hash_tags = tuple(sorted(tags))
@@ -228,42 +285,55 @@ class KubeletCheck(PrometheusCheck):
             self.gauge(self.NAMESPACE + '.pods.running', count, list(tags))
 
     def _report_container_spec_metrics(self, pod_list, instance_tags):
-        """Reports pod requests & limits by looking at pod specs."""
-        for pod in pod_list['items']:
-            pod_name = pod.get('metadata', {}).get('name')
-            if not pod_name:
+        """
+        Reports pod requests & limits by looking at pod specs.
+        They're only computed again for the pods whose resourceVersion changed, the containers
+        they're tagged with are looked up in the status of the pod at each run.
+        """
+        pod_spec_metrics = {}
+        for pod in pod_list:
+            if not pod.name:
                 continue
 
-            for ctr in pod['spec']['containers']:
-                if not ctr.get('resources'):
-                    continue
+            cached = self._pod_spec_metrics.get(pod.uid)
+            if cached is not None and pod.resource_version is not None and cached[0] == pod.resource_version:
+                metrics = cached[1]
+            else:
+                metrics = self._get_container_spec_metrics(pod)
+            pod_spec_metrics[pod.uid] = (pod.resource_version, metrics)
 
-                c_name = ctr.get('name', '')
-                cid = None
+            container_ids = pod.container_ids or {}
+            for metric_name, value, c_name in metrics:
+                # it is already prefixed with 'docker://'
+                cid = container_ids.get(c_name)
+                if cid:
+                    self.gauge(metric_name, value, self._get_entity_tags(cid))
 
-                for ctr_status in pod['status'].get('containerStatuses', []):
-                    if ctr_status.get('name') == c_name:
-                        # it is already prefixed with 'docker://'
-                        cid = ctr_status.get('containerID')
-                        break
-                if not cid:
-                    continue
+        # forget the pods which are gone
+        self._pod_spec_metrics = pod_spec_metrics
 
-                tags = get_tags('%s' % cid, True)
+    def _get_container_spec_metrics(self, pod):
+        """
+        Return the requests & limits of the containers of a pod as (metric name, value, container name) tuples.
+        """
+        metrics = []
+        for c_name, resources in pod.containers:
 
-                try:
-                    for resource, value_str in ctr.get('resources', {}).get('requests', {}).iteritems():
-                        value = self.parse_quantity(value_str)
-                        self.gauge('{}.{}.requests'.format(self.NAMESPACE, resource), value, tags)
-                except (KeyError, AttributeError) as e:
-                    self.log.debug("Unable to retrieve container requests for %s: %s", c_name, e)
+            try:
+                for resource, value_str in resources.get('requests', {}).iteritems():
+                    value = self.parse_quantity(value_str)
+                    metrics.append(('{}.{}.requests'.format(self.NAMESPACE, resource), value, c_name))
+            except (KeyError, AttributeError) as e:
+                self.log.debug("Unable to retrieve container requests for %s: %s", c_name, e)
 
-                try:
-                    for resource, value_str in ctr.get('resources', {}).get('limits', {}).iteritems():
-                        value = self.parse_quantity(value_str)
-                        self.gauge('{}.{}.limits'.format(self.NAMESPACE, resource), value, tags)
-                except (KeyError, AttributeError) as e:
-                    self.log.debug("Unable to retrieve container limits for %s: %s", c_name, e)
+            try:
+                for resource, value_str in resources.get('limits', {}).iteritems():
+                    value = self.parse_quantity(value_str)
+                    metrics.append(('{}.{}.limits'.format(self.NAMESPACE, resource), value, c_name))
+            except (KeyError, AttributeError) as e:
+                self.log.debug("Unable to retrieve container limits for %s: %s", c_name, e)
+
+        return metrics
 
     @staticmethod
     def parse_quantity(s):
@@ -282,13 +352,13 @@ class KubeletCheck(PrometheusCheck):
         It can be about pods, or even higher levels in the cgroup hierarchy
         and we don't want to report on that.
         """
+        label_names = set()
+        for ml in metric.label:
+            if ml.name == 'container_name' and (ml.value == '' or ml.value == 'POD'):
+                return False
+            label_names.add(ml.name)
         for lbl in CONTAINER_LABELS:
-            if lbl == 'container_name':
-                for ml in metric.label:
-                    if ml.name == lbl:
-                        if ml.value == '' or ml.value == 'POD':
-                            return False
-            if lbl not in [ml.name for ml in metric.label]:
+            if lbl not in label_names:
                 return False
         return True
 
@@ -306,10 +376,27 @@ class KubeletCheck(PrometheusCheck):
             # FIXME: this was needed because of a bug:
             # https://github.com/kubernetes/kubernetes/pull/51473
             # starting from k8s 1.8 we can remove this
-            elif ml.name == 'id' and ml.value.split('/')[-1].startswith('pod'):
+            elif ml.name == 'id' and self._parse_cgroup_id(ml.value)[0].startswith('pod'):
                 return True
         return False
 
+    def _parse_cgroup_id(self, cgroup_path):
+        """
+        Return the last part of the cgroup path, and the uid of the pod it belongs to (None if it's not in a pod)
+        eg: /kubepods/burstable/pod531c80d9-9fc4-11e7-ba8b-42010af002bb/<container id>
+        """
+        parsed = self._cgroup_ids.get(cgroup_path)
+        if parsed is None:
+            parts = cgroup_path.split('/')
+            pod_uid = None
+            for part in parts:
+                if part.startswith('pod'):
+                    pod_uid = part[3:]
+                    break
+            parsed = (parts[-1], pod_uid)
+            self._cgroup_ids.set(cgroup_path, parsed)
+        return parsed
+
     def _get_container_label(self, labels, l_name):
         for label in labels:
             if label.name == l_name:
@@ -323,57 +410,39 @@ class KubeletCheck(PrometheusCheck):
         """
         for label in labels:
             if label.name == 'id':
-                return label.value.split('/')[-1]
+                return self._parse_cgroup_id(label.value)[0]
 
-    @staticmethod
-    def _get_pod_uid(labels):
+    def _get_pod_uid(self, labels):
         for label in labels:
             if label.name == 'id':
-                for part in label.value.split('/'):
-                    if part.startswith('pod'):
-                        return part[3:]
+                return self._parse_cgroup_id(label.value)[1]
 
     def _is_pod_host_networked(self, pod_uid):
-        for pod in self.pod_list['items']:
-            if pod.get('metadata', {}).get('uid', '') == pod_uid:
-                return pod.get('spec', {}).get('hostNetwork', False)
-        return False
+        return pod_uid in self._host_networked_pods
 
     def _get_pod_by_metric_label(self, labels):
         """
         :param labels: metric labels: iterable
         :return:
         """
-        pod_uid = self._get_pod_uid(labels)
-        for pod in self.pod_list["items"]:
-            try:
-                if pod["metadata"]["uid"] == pod_uid:
-                    return pod
-            except KeyError:
-                continue
-
-        return None
+        return self._pods_by_uid.get(self._get_pod_uid(labels))
 
     @staticmethod
     def _is_static_pending_pod(pod):
         """
         Return if the pod is a static pending pod
         See https://github.com/kubernetes/kubernetes/pull/57106
-        :param pod: dict
+        :param pod: Pod
         :return: bool
         """
-        try:
-            if pod["metadata"]["annotations"]["kubernetes.io/config.source"] == "api":
-                return False
-
-            pod_status = pod["status"]
-            if pod_status["phase"] != "Pending":
-                return False
+        if pod.config_source is None or pod.config_source == "api":
+            return False
 
-            return "containerStatuses" not in pod_status
-        except KeyError:
+        if pod.phase != "Pending":
             return False
 
+        return pod.container_ids is None
+
     @staticmethod
     def _get_tags_from_labels(labels):
         """
@@ -402,13 +471,13 @@ class KubeletCheck(PrometheusCheck):
         for metric in message.metric:
             if self._is_container_metric(metric):
                 c_id = self._get_container_id(metric.label)
-                tags = get_tags('docker://%s' % c_id, True)
+                tags = self._get_entity_tags('docker://%s' % c_id)
 
                 # FIXME we are forced to do that because the Kubelet PodList isn't updated
                 # for static pods, see https://github.com/kubernetes/kubernetes/pull/59948
                 pod = self._get_pod_by_metric_label(metric.label)
                 if pod is not None and self._is_static_pending_pod(pod):
-                    tags += get_tags('kubernetes_pod://%s' % pod["metadata"]["uid"], True)
+                    tags = tags + self._get_entity_tags('kubernetes_pod://%s' % pod.uid)
                     tags += self._get_tags_from_labels(metric.label)
                     tags = list(set(tags))
 
@@ -426,7 +495,7 @@ class KubeletCheck(PrometheusCheck):
                 pod_uid = self._get_pod_uid(metric.label)
                 if '.network.' in metric_name and self._is_pod_host_networked(pod_uid):
                     continue
-                tags = get_tags('kubernetes_pod://%s' % pod_uid, True)
+                tags = self._get_entity_tags('kubernetes_pod://%s' % pod_uid)
                 val = getattr(metric, METRIC_TYPES[message.type]).value
                 self.rate(metric_name, val, tags)
 
@@ -444,13 +513,13 @@ class KubeletCheck(PrometheusCheck):
                 c_name = self._get_container_label(metric.label, 'name')
                 if not c_name:
                     continue
-                tags = get_tags('docker://%s' % c_id, True)
+                tags = self._get_entity_tags('docker://%s' % c_id)
 
                 # FIXME we are forced to do that because the Kubelet PodList isn't updated
                 # for static pods, see https://github.com/kubernetes/kubernetes/pull/59948
                 pod = self._get_pod_by_metric_label(metric.label)
                 if pod is not None and self._is_static_pending_pod(pod):
-                    tags += get_tags('kubernetes_pod://%s' % pod["metadata"]["uid"], True)
+                    tags = tags + self._get_entity_tags('kubernetes_pod://%s' % pod.uid)
                     tags += self._get_tags_from_labels(metric.label)
                     tags = list(set(tags))
 
@@ -474,7 +543,7 @@ class KubeletCheck(PrometheusCheck):
             if self._is_container_metric(metric):
                 limit = getattr(metric, METRIC_TYPES[message.type]).value
                 c_id = self._get_container_id(metric.label)
-                tags = get_tags('docker://%s' % c_id, True)
+                tags = self._get_entity_tags('docker://%s' % c_id)
 
                 if m_name:
                     self.gauge(m_name, limit, tags)
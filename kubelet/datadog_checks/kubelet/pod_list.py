@@ -0,0 +1,159 @@
+# (C) Datadog, Inc. 2018
+# All rights reserved
+# Licensed under Simplified BSD License (see LICENSE)
+
+# stdlib
+from collections import namedtuple
+import codecs
+import json
+import re
+
+# The fields of a pod the check uses, the rest of the pod spec (env, volumes, ...) is dropped as soon as
+# the pod is decoded.
+# `container_ids` maps the container names to their ids, it's None when the status has no containerStatuses.
+# `containers` is a tuple of (container name, resources) for the containers of the spec with resources.
+Pod = namedtuple('Pod', 'uid name namespace resource_version host_network config_source phase container_ids containers')
+
+WHITESPACE = re.compile(r'\s*')
+
+
+def compact_pod(pod, previous=None):
+    """
+    Return the `Pod` record of a decoded pod of the pod list. If `previous` holds the record of
+    a pod with the same uid and resourceVersion, its spec didn't change and only the fields
+    of the status are computed again: the record is returned if they didn't change either.
+    """
+    metadata = pod.get('metadata') or {}
+    uid = metadata.get('uid')
+    resource_version = metadata.get('resourceVersion')
+    phase, container_ids = _pod_status(pod.get('status') or {})
+    if previous and resource_version is not None:
+        record = previous.get(uid)
+        if record is not None and record.resource_version == resource_version:
+            if record.phase == phase and record.container_ids == container_ids:
+                return record
+            return record._replace(phase=phase, container_ids=container_ids)
+
+    spec = pod.get('spec') or {}
+    containers = tuple(
+        (ctr.get('name', ''), ctr['resources']) for ctr in spec.get('containers') or [] if ctr.get('resources')
+    )
+
+    return Pod(
+        uid=uid,
+        name=metadata.get('name'),
+        namespace=metadata.get('namespace'),
+        resource_version=resource_version,
+        host_network=spec.get('hostNetwork', False),
+        config_source=(metadata.get('annotations') or {}).get('kubernetes.io/config.source'),
+        phase=phase,
+        container_ids=container_ids,
+        containers=containers,
+    )
+
+
+def _pod_status(status):
+    """
+    Return the phase and the container ids by name of the status of a pod.
+    """
+    container_ids = None
+    if 'containerStatuses' in status:
+        container_ids = {}
+        for ctr_status in status['containerStatuses'] or []:
+            container_ids.setdefault(ctr_status.get('name'), ctr_status.get('containerID'))
+    return status.get('phase'), container_ids
+
+
+def read_pod_list(chunks, previous=None):
+    """
+    Yield the `Pod` records of the items of a pod list, decoding them one by one from `chunks`,
+    the utf-8 encoded pieces of the pod list json as they are received.
+    The other keys of the pod list are skipped. See `compact_pod` for `previous`.
+    """
+    stream = _JsonStream(chunks)
+    stream.expect('{')
+    if stream.peek() == '}':
+        return
+
+    while True:
+        key = stream.value()
+        stream.expect(':')
+        if key == 'items' and stream.peek() == '[':
+            stream.expect('[')
+            if stream.peek() != ']':
+                while True:
+                    yield compact_pod(stream.value(), previous)
+                    if stream.peek() != ',':
+                        break
+                    stream.expect(',')
+            stream.expect(']')
+        else:
+            stream.value()
+
+        if stream.peek() != ',':
+            break
+        stream.expect(',')
+
+    stream.expect('}')
+
+
+class _JsonStream(object):
+    """
+    Decode the json values of a document one at a time, reading its chunks as they're needed.
+    The structure around them is walked with `peek` and `expect`.
+    """
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._json = json.JSONDecoder()
+        self._buffer = u''
+        self._pos = 0
+
+    def _read(self):
+        """
+        Append the next chunk to the buffer, dropping what was already consumed.
+        Return False at the end of the document.
+        """
+        for chunk in self._chunks:
+            if not chunk:
+                continue
+            self._buffer = self._buffer[self._pos:] + self._decoder.decode(chunk)
+            self._pos = 0
+            return True
+        return False
+
+    def peek(self):
+        """
+        Return the next character which is not a whitespace, without consuming it, or '' at the end of the document.
+        """
+        while True:
+            self._pos = WHITESPACE.match(self._buffer, self._pos).end()
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._read():
+                return ''
+
+    def expect(self, char):
+        found = self.peek()
+        if found != char:
+            raise ValueError('Expected {!r} in the json document, found {!r}'.format(char, found or 'its end'))
+        self._pos += 1
+
+    def value(self):
+        """
+        Decode and consume the next json value.
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self._json.raw_decode(self._buffer, self._pos)
+            except ValueError:
+                # the value is cut by the end of the buffer
+                if not self._read():
+                    raise
+                continue
+            # so is a number ending with the buffer
+            if end == len(self._buffer) and self._read():
+                continue
+            self._pos = end
+            return value
@@ -10,6 +10,7 @@ import json
 from collections import namedtuple
 
 from datadog_checks.kubelet import KubeletCheck
+from datadog_checks.kubelet.pod_list import compact_pod, read_pod_list
 
 # Skip the whole tests module on Windows
 pytestmark = pytest.mark.skipif(sys.platform == 'win32', reason='tests for linux only')
@@ -82,6 +83,10 @@ def mock_from_file(fname):
         return f.read()
 
 
+def pod_list_from_file(fname):
+    return list(read_pod_list([mock_from_file(fname)]))
+
+
 def test_bad_config():
     with pytest.raises(Exception):
         KubeletCheck('kubelet', None, {}, [{}, {}])
@@ -103,7 +108,7 @@ def test_parse_quantity():
 
 def test_kubelet_check(monkeypatch, aggregator):
     check = KubeletCheck('kubelet', None, {}, [{}])
-    monkeypatch.setattr(check, 'retrieve_pod_list', mock.Mock(return_value=json.loads(mock_from_file('pods.txt'))))
+    monkeypatch.setattr(check, 'retrieve_pod_list', mock.Mock(return_value=pod_list_from_file('pods.txt')))
     monkeypatch.setattr(check, 'retrieve_node_spec', mock.Mock(return_value=NODE_SPEC))
     monkeypatch.setattr(check, '_perform_kubelet_check',  mock.Mock(return_value=None))
     attrs = {
@@ -191,3 +196,107 @@ def test_is_pod_metric():
 
     for metric in true_metrics:
         assert check._is_pod_metric(metric) is True
+
+
+def test_pod_index():
+    check = KubeletCheck('kubelet', None, {}, [{}])
+    check._index_pods(pod_list_from_file('pods.txt'))
+
+    labels = [Label(name='id', value='/kubepods/burstable/pod24d6daa3-10d8-11e8-bd5a-42010af00137/'
+                                     '5f93d91c7aee0230f77fbe9ec642dd60958f5098e76de270a933285c24dfdc6f')]
+    assert check._get_pod_uid(labels) == '24d6daa3-10d8-11e8-bd5a-42010af00137'
+    assert check._get_container_id(labels) == '5f93d91c7aee0230f77fbe9ec642dd60958f5098e76de270a933285c24dfdc6f'
+    assert check._get_pod_by_metric_label(labels).name == 'demo-app-success-c485bc67b-klj45'
+    assert len(check._cgroup_ids) == 1
+
+    assert check._get_pod_by_metric_label([Label(name='id', value='/kubepods/besteffort')]) is None
+    assert check._is_pod_host_networked('260c2b1d43b094af6d6b4ccba082c2db')
+    assert not check._is_pod_host_networked('24d6daa3-10d8-11e8-bd5a-42010af00137')
+
+    # the pod list can't always be retrieved
+    check._index_pods(None)
+    assert check._get_pod_by_metric_label(labels) is None
+
+
+def test_retrieve_pod_list(monkeypatch):
+    check = KubeletCheck('kubelet', None, {}, [{}])
+    check.pod_list_url = 'http://localhost:10255/pods/'
+    content = mock_from_file('pods.txt')
+    response = mock.Mock()
+    # small chunks, so that the pods and the numbers are cut between them
+    response.iter_content.side_effect = lambda chunk_size: (content[i:i + 7] for i in xrange(0, len(content), 7))
+    monkeypatch.setattr(check, 'perform_kubelet_query', mock.Mock(return_value=response))
+
+    pod_list = check.retrieve_pod_list()
+    check.perform_kubelet_query.assert_called_once_with(check.pod_list_url, stream=True)
+    response.close.assert_called_once()
+
+    pods = json.loads(content)['items']
+    assert pod_list == [compact_pod(pod) for pod in pods]
+    pod = pod_list[[p['metadata']['name'] for p in pods].index('demo-app-success-c485bc67b-klj45')]
+    assert pod.uid == '24d6daa3-10d8-11e8-bd5a-42010af00137'
+    assert pod.namespace == 'default'
+    assert pod.config_source == 'api'
+    assert pod.containers and all(resources for _, resources in pod.containers)
+    assert all(cid.startswith('docker://') for cid in pod.container_ids.values())
+
+    # the records of the pods which didn't change are kept, static pods have no resourceVersion
+    check._index_pods(pod_list)
+    for new_pod, old_pod in zip(check.retrieve_pod_list(), pod_list):
+        assert new_pod == old_pod
+        assert (new_pod is old_pod) == (old_pod.resource_version is not None)
+
+    assert list(read_pod_list(['{"kind": "PodList", "items": null}'])) == []
+    assert list(read_pod_list([' { } '])) == []
+    with pytest.raises(ValueError):
+        list(read_pod_list(['{"items": [{"metadata": {}}']))
+
+
+def test_compact_pod_status_change():
+    pod = json.loads(mock_from_file('pods.txt'))['items'][0]
+    pod['metadata']['resourceVersion'] = '42'
+    record = compact_pod(pod)
+    previous = {record.uid: record}
+    assert compact_pod(pod, previous) is record
+
+    # the status changes without a new resourceVersion
+    pod['status']['phase'] = 'Failed'
+    pod['status']['containerStatuses'] = [{'name': 'new', 'containerID': 'docker://new'}]
+    with mock.patch.dict(pod, spec=None):
+        updated = compact_pod(pod, previous)
+
+    assert updated.phase == 'Failed'
+    assert updated.container_ids == {'new': 'docker://new'}
+    # the fields of the spec are reused
+    assert updated.containers is record.containers
+    assert updated._replace(phase=record.phase, container_ids=record.container_ids) == record
+
+
+def test_container_spec_metrics_cache(monkeypatch, aggregator):
+    check = KubeletCheck('kubelet', None, {}, [{}])
+    pod_list = pod_list_from_file('pods.txt')
+    monkeypatch.setattr(check, '_get_container_spec_metrics', mock.Mock(wraps=check._get_container_spec_metrics))
+
+    check._report_container_spec_metrics(pod_list, [])
+    calls = check._get_container_spec_metrics.call_count
+    assert calls == len([pod for pod in pod_list if pod.name])
+    metrics = dict((name, len(aggregator.metrics(name))) for name in aggregator.metric_names)
+    assert metrics['kubernetes.cpu.requests']
+
+    # unchanged pods reuse their metrics, changed ones compute them again, deleted ones are forgotten
+    aggregator.reset()
+    pod_list[0] = pod_list[0]._replace(resource_version='0')
+    check._report_container_spec_metrics(pod_list[:-1], [])
+    assert check._get_container_spec_metrics.call_count == calls + 1
+    assert pod_list[-1].uid not in check._pod_spec_metrics
+    assert check._pod_spec_metrics[pod_list[0].uid][0] == '0'
+    submitted = sum(len(aggregator.metrics(name)) for name in aggregator.metric_names)
+    assert submitted <= sum(metrics.values())
+
+    # the containers are looked up in the status of the pods at each run
+    aggregator.reset()
+    pod = next(p for p in pod_list[1:-1] if p.containers and p.container_ids)
+    pod_list[pod_list.index(pod)] = pod._replace(container_ids={})
+    check._report_container_spec_metrics(pod_list[:-1], [])
+    assert check._get_container_spec_metrics.call_count == calls + 1
+    assert sum(len(aggregator.metrics(name)) for name in aggregator.metric_names) < submitted
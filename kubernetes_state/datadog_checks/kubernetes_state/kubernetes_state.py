@@ -25,6 +25,8 @@ class KubernetesState(PrometheusCheck):
     Collect kube-state-metrics metrics in the Prometheus format
     See https://github.com/kubernetes/kube-state-metrics
     """
+    FAST_TEXT_PARSER = True
+
     def __init__(self, name, init_config, agentConfig, instances=None):
         super(KubernetesState, self).__init__(name, init_config, agentConfig, instances)
         self.NAMESPACE = 'kubernetes_state'
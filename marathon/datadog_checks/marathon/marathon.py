@@ -13,6 +13,7 @@ import requests
 # project
 from checks import AgentCheck
 from config import _is_affirmative
+from datadog_checks.utils.payload_cache import PayloadCache
 
 
 class Marathon(AgentCheck):
@@ -46,17 +47,27 @@ class Marathon(AgentCheck):
         ]
     }
 
+    def __init__(self, name, init_config, agentConfig, instances=None):
+        AgentCheck.__init__(self, name, init_config, agentConfig, instances)
+        # decoded responses of the API, only used with `cache_unchanged_payloads`
+        self._payload_cache = PayloadCache()
+        self._cache_unchanged_payloads = False
+
     def check(self, instance):
         try:
             url, auth, acs_url, ssl_verify, group, instance_tags, timeout = self.get_instance_config(instance)
         except Exception as e:
             self.log.error("Invalid instance configuration.")
             raise e
+        self._cache_unchanged_payloads = _is_affirmative(instance.get('cache_unchanged_payloads', False))
 
         self.process_apps(url, timeout, auth, acs_url, ssl_verify, instance_tags, group)
         self.process_deployments(url, timeout, auth, acs_url, ssl_verify, instance_tags)
         self.process_queues(url, timeout, auth, acs_url, ssl_verify, instance_tags)
 
+        if self._cache_unchanged_payloads:
+            self._payload_cache.submit_stats(self.gauge, 'marathon.payload_cache', tags=instance_tags)
+
     def refresh_acs_token(self, auth, acs_url):
         try:
             auth_body = {
@@ -87,6 +98,9 @@ class Marathon(AgentCheck):
                 self.refresh_acs_token(auth, acs_url)
             params['headers']['authorization'] = 'token=%s' % self.ACS_TOKEN
             del params['auth']
+        headers = params['headers']
+        if self._cache_unchanged_payloads:
+            params['headers'] = dict(headers, **self._payload_cache.request_headers(url))
 
         try:
             r = requests.get(url, **params)
@@ -118,6 +132,14 @@ class Marathon(AgentCheck):
             self.service_check(self.SERVICE_CHECK_NAME, AgentCheck.OK,
                                tags = ["url:{0}".format(url)])
 
+        if self._cache_unchanged_payloads:
+            # the payload is requested again without the conditional headers if it's not cached anymore
+            def refetch():
+                response = requests.get(url, **dict(params, headers=headers))
+                response.raise_for_status()
+                return response
+
+            return self._payload_cache.load_json(url, r, refetch)
         return r.json()
 
     def get_instance_config(self, instance):
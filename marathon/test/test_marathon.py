@@ -3,10 +3,20 @@
 # Licensed under Simplified BSD License (see LICENSE)
 
 # stdlib
+import json
 import os
 
+# 3p
+import mock
+
 # project
-from tests.checks.common import AgentCheckTest, Fixtures
+from tests.checks.common import AgentCheckTest, Fixtures, load_check
+
+def _response(payload, status_code=200, headers=None):
+    response = mock.MagicMock(status_code=status_code, content=payload, headers=headers or {}, encoding='utf-8')
+    response.json.side_effect = lambda: json.loads(payload)
+    return response
+
 
 DEPLOYMENT_METRICS_CONFIG = {
     'init_config': {
@@ -92,3 +102,23 @@ class MarathonCheckTest(AgentCheckTest):
 
         self.run_check(DEFAULT_CONFIG, mocks={"get_json": side_effect})
         self.assertMetric('marathon.apps', value=0)
+
+    def test_cache_unchanged_payloads(self):
+        url = 'http://localhost:8080/v2/apps'
+        self.check = load_check(self.CHECK_NAME, DEFAULT_CONFIG, {})
+        self.check._cache_unchanged_payloads = True
+        payload = '{"apps": []}'
+
+        with mock.patch('requests.get', return_value=_response(payload, headers={'ETag': '"1"'})):
+            first = self.check.get_json(url, 5, None, None, True)
+        with mock.patch('requests.get', return_value=_response('', status_code=304)) as get:
+            self.assertIs(self.check.get_json(url, 5, None, None, True), first)
+        self.assertEquals(get.call_args[1]['headers']['If-None-Match'], '"1"')
+
+        # a 304 for a payload which isn't cached is requested again without conditional headers
+        self.check = load_check(self.CHECK_NAME, DEFAULT_CONFIG, {})
+        self.check._cache_unchanged_payloads = True
+        with mock.patch('requests.get', side_effect=[_response('', status_code=304), _response(payload)]) as get:
+            self.assertEquals(self.check.get_json(url, 5, None, None, True), json.loads(payload))
+        self.assertEquals(get.call_count, 2)
+        self.assertNotIn('If-None-Match', get.call_args[1]['headers'])
@@ -15,6 +15,7 @@ import requests
 # project
 from checks import AgentCheck, CheckException
 from config import _is_affirmative
+from datadog_checks.utils.payload_cache import PayloadCache
 
 
 class MesosMaster(AgentCheck):
@@ -133,6 +134,9 @@ class MesosMaster(AgentCheck):
 
     def __init__(self, name, init_config, agentConfig, instances=None):
         AgentCheck.__init__(self, name, init_config, agentConfig, instances)
+        # decoded responses of the master, only used with `cache_unchanged_payloads`
+        self._payload_cache = PayloadCache()
+        self._cache_unchanged_payloads = False
         for instance in instances or []:
             url = instance.get('url', '')
             parsed_url = urlparse(url)
@@ -144,9 +148,12 @@ class MesosMaster(AgentCheck):
         tags = ["url:%s" % url]
         msg = None
         status = None
+        headers = None
+        if self._cache_unchanged_payloads:
+            headers = self._payload_cache.request_headers(url)
         try:
-            r = requests.get(url, timeout=timeout, verify=verify)
-            if r.status_code != 200:
+            r = requests.get(url, timeout=timeout, verify=verify, headers=headers)
+            if r.status_code != 200 and not (r.status_code == 304 and self._cache_unchanged_payloads):
                 status = AgentCheck.CRITICAL
                 msg = "Got %s when hitting %s" % (r.status_code, url)
             else:
@@ -172,6 +179,16 @@ class MesosMaster(AgentCheck):
         if r.encoding is None:
             r.encoding = 'UTF8'
 
+        if self._cache_unchanged_payloads:
+            # the payload is requested again without the conditional headers if it's not cached anymore
+            def refetch():
+                response = requests.get(url, timeout=timeout, verify=verify)
+                response.raise_for_status()
+                if response.encoding is None:
+                    response.encoding = 'UTF8'
+                return response
+
+            return self._payload_cache.load_json(url, r, refetch)
         return r.json()
 
     def _get_master_state(self, url, timeout, verify):
@@ -207,6 +224,7 @@ class MesosMaster(AgentCheck):
         default_timeout = self.init_config.get('default_timeout', 5)
         timeout = float(instance.get('timeout', default_timeout))
         ssl_verify = not _is_affirmative(instance.get('disable_ssl_validation', False))
+        self._cache_unchanged_payloads = _is_affirmative(instance.get('cache_unchanged_payloads', False))
 
         state_metrics = self._check_leadership(url, timeout, ssl_verify)
         if state_metrics:
@@ -250,5 +268,7 @@ class MesosMaster(AgentCheck):
                         if key_name in stats_metrics:
                             metric_func(self, metric_name, stats_metrics[key_name], tags=tags)
 
+        if self._cache_unchanged_payloads:
+            self._payload_cache.submit_stats(self.gauge, 'mesos.payload_cache', tags=instance_tags)
 
         self.service_check_needed = True
@@ -2,8 +2,17 @@
 import os
 import json
 
+# 3p
+import mock
+
 # project
-from tests.checks.common import AgentCheckTest, Fixtures, get_check_class
+from tests.checks.common import AgentCheckTest, Fixtures, get_check_class, load_check
+
+
+def _response(payload, status_code=200, headers=None):
+    response = mock.MagicMock(status_code=status_code, content=payload, headers=headers or {}, encoding='utf-8')
+    response.json.side_effect = lambda: json.loads(payload)
+    return response
 
 
 class TestMesosMaster(AgentCheckTest):
@@ -44,3 +53,24 @@ class TestMesosMaster(AgentCheckTest):
         self.assertMetric('mesos.framework.total_tasks')
         self.assertMetric('mesos.role.frameworks.count')
         self.assertMetric('mesos.role.weight')
+
+    def test_cache_unchanged_payloads(self):
+        url = 'http://localhost:5050/state.json'
+        config = {'init_config': {}, 'instances': [{'url': 'http://localhost:5050'}]}
+        self.check = load_check(self.CHECK_NAME, config, {})
+        self.check._cache_unchanged_payloads = True
+        payload = Fixtures.read_file('state.json', sdk_dir=self.FIXTURE_DIR)
+
+        with mock.patch('requests.get', return_value=_response(payload, headers={'ETag': '"1"'})):
+            first = self.check._get_json(url, 5)
+        with mock.patch('requests.get', return_value=_response('', status_code=304)) as get:
+            self.assertIs(self.check._get_json(url, 5), first)
+        self.assertEquals(get.call_args[1]['headers']['If-None-Match'], '"1"')
+
+        # a 304 for a payload which isn't cached is requested again without conditional headers
+        self.check = load_check(self.CHECK_NAME, config, {})
+        self.check._cache_unchanged_payloads = True
+        with mock.patch('requests.get', side_effect=[_response('', status_code=304), _response(payload)]) as get:
+            self.assertEquals(self.check._get_json(url, 5), json.loads(payload))
+        self.assertEquals(get.call_count, 2)
+        self.assertNotIn('headers', get.call_args[1])
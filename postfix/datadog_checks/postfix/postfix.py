@@ -9,6 +9,7 @@ import os
 # project
 from checks import AgentCheck
 from utils.subprocess_output import get_subprocess_output
+from datadog_checks.utils.subprocess_output import get_subprocesses_output
 
 class PostfixCheck(AgentCheck):
     """
@@ -74,6 +75,8 @@ class PostfixCheck(AgentCheck):
 
     """
 
+    DEFAULT_TIMEOUT = 60
+
     def check(self, instance):
         config = self._get_config(instance)
 
@@ -160,27 +163,51 @@ class PostfixCheck(AgentCheck):
         self.gauge('postfix.queue.size', hold_count, tags=tags + ['queue:hold', 'instance:{}'.format(postfix_config_dir)])
         self.gauge('postfix.queue.size', deferred_count, tags=tags + ['queue:deferred', 'instance:{}'.format(postfix_config_dir)])
 
+    @staticmethod
+    def _line_counter(counts, queue):
+        def count_line(line):
+            counts[queue] += 1
+        return count_line
+
     def _get_queue_count(self, directory, queues, tags):
+        counts = {}
+        commands = {}
         for queue in queues:
             queue_path = os.path.join(directory, queue)
             if not os.path.exists(queue_path):
                 raise Exception('{} does not exist'.format(queue_path))
 
-            count = 0
             if os.geteuid() == 0:
                 # dd-agent is running as root (not recommended)
-                count = sum(len(files) for root, dirs, files in os.walk(queue_path))
+                counts[queue] = sum(len(files) for root, dirs, files in os.walk(queue_path))
             else:
                 # can dd-agent user run sudo?
                 test_sudo = os.system('setsid sudo -l < /dev/null')
                 if test_sudo == 0:
                     # default to `root` for backward compatibility
                     postfix_user = self.init_config.get('postfix_user', 'root')
-                    output, _, _ = get_subprocess_output(['sudo', '-u', postfix_user, 'find', queue_path, '-type', 'f'], self.log, False)
-                    count = len(output.splitlines())
+                    commands[queue] = ['sudo', '-u', postfix_user, 'find', queue_path, '-type', 'f']
                 else:
                     raise Exception('The dd-agent user does not have sudo access')
 
+        if commands:
+            # count the files of the queues concurrently, without buffering the output of find
+            counts.update(dict.fromkeys(commands, 0))
+            parsers = dict((queue, self._line_counter(counts, queue)) for queue in commands)
+            timeout = float(self.init_config.get('timeout', self.DEFAULT_TIMEOUT))
+            results = get_subprocesses_output(commands, self.log, timeout=timeout, parsers=parsers)
+            for queue, result in results.iteritems():
+                if result.error is not None:
+                    raise result.error
+                # the partial counts are still reported
+                if result.timed_out:
+                    self.warning('The messages of the {} queue were not all counted after {}s'.format(queue, timeout))
+                elif result.returncode != 0:
+                    self.warning('The messages of the {} queue may not all be counted, find returned {}: {}'.format(
+                        queue, result.returncode, result.err.strip()))
+
+        for queue in queues:
+            count = counts[queue]
             # emit an individually tagged metric
             self.gauge('postfix.queue.size', count, tags=tags + ['queue:{}'.format(queue), 'instance:{}'.format(os.path.basename(directory))])
             # these can be retrieved in a single graph statement
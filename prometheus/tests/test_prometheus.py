@@ -41,7 +41,7 @@ def poll_mock():
     g2.labels(matched_label="foobar", node="host2", timestamp="123").set(12.2)
 
     poll_mock = mock.patch(
-        'requests.get',
+        'requests.Session.get',
         return_value=mock.MagicMock(
             status_code=200,
             iter_lines=lambda **kwargs: generate_latest(registry).split("\n"),
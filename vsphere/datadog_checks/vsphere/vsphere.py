@@ -15,8 +15,8 @@ from pyVmomi import vim  # pylint: disable=E0611
 from datadog_checks.config import _is_affirmative
 from datadog_checks.checks import AgentCheck
 from datadog_checks.checks.libs.vmware.basic_metrics import BASIC_METRICS
-from datadog_checks.checks.libs.vmware.all_metrics import ALL_METRICS
-from datadog_checks.checks.libs.thread_pool import Pool
+from datadog_checks.utils.lazy import lazy_import
+from datadog_checks.checks.libs.thread_pool import get_shared_pool
 from datadog_checks.checks.libs.timer import Timer
 from .common import SOURCE_TYPE
 from .event import VSphereEvent
@@ -27,12 +27,14 @@ except ImportError:
     # Agent < 6.0: the Agent pulls tags invoking `VSphereCheck.get_external_host_tags`
     set_external_tags = None
 
+# The list of all the metrics is long, only load it when it's first needed
+all_metrics = lazy_import('datadog_checks.checks.libs.vmware.all_metrics')
 
 # Default vCenter sampling interval
 REAL_TIME_INTERVAL = 20
 # Metrics are only collected on vSphere VMs marked by custom field value
 VM_MONITORING_FLAG = 'DatadogMonitored'
-# The size of the ThreadPool used to process the request queue
+# The number of jobs run at the same time in the shared thread pool
 DEFAULT_SIZE_POOL = 4
 # The interval in seconds between two refresh of the entities list
 REFRESH_MORLIST_INTERVAL = 3 * 60
@@ -40,6 +42,8 @@ REFRESH_MORLIST_INTERVAL = 3 * 60
 REFRESH_METRICS_METADATA_INTERVAL = 10 * 60
 # The amount of jobs batched at the same time in the queue to query available metrics
 BATCH_MORLIST_SIZE = 50
+# The amount of MORs whose metrics are collected by a single QueryPerf call, 0 or 1 to query them one by one
+BATCH_QUERY_PERF_SIZE = 0
 
 REALTIME_RESOURCES = {'vm', 'host'}
 
@@ -50,9 +54,8 @@ RESOURCE_TYPE_MAP = {
     'datastore': vim.Datastore
 }
 
-# Time after which we reap the jobs that clog the queue
-# TODO: use it
-JOB_TIMEOUT = 10
+# Time after which we reap the jobs that clog the queue, set with `job_timeout`. Disabled by default
+JOB_TIMEOUT = None
 MORLIST = 'morlist'
 METRICS_METADATA = 'metrics_metadata'
 LAST = 'last'
@@ -89,6 +92,9 @@ class VSphereCheck(AgentCheck):
         self.pool_started = False
         self.jobs_status = {}
         self.exceptionq = Queue()
+        self.job_timeout = init_config.get('job_timeout', JOB_TIMEOUT)
+        if self.job_timeout is not None:
+            self.job_timeout = float(self.job_timeout)
 
         # Connections open to vCenter instances
         self.server_instances = {}
@@ -131,32 +137,25 @@ class VSphereCheck(AgentCheck):
         self.log.info("Starting Thread Pool")
         self.pool_size = int(self.init_config.get('threads_count', DEFAULT_SIZE_POOL))
 
-        self.pool = Pool(self.pool_size)
+        # the jobs run in the pool shared with the other checks, `pool_size` at a time
+        self.pool = get_shared_pool().client(self.name, quota=self.pool_size, timeout=self.job_timeout)
         self.pool_started = True
         self.jobs_status = {}
 
     def stop_pool(self):
         self.log.info("Stopping Thread Pool")
         if self.pool_started:
-            self.pool.terminate()
-            self.pool.join()
+            self.pool.close()
             self.jobs_status.clear()
-            assert self.pool.get_nworkers() == 0
             self.pool_started = False
 
-    def restart_pool(self):
-        self.stop_pool()
-        self.start_pool()
-
     def _clean(self):
-        now = time.time()
-        # TODO: use that
-        for name in self.jobs_status.keys():
-            start_time = self.jobs_status[name]
-            if now - start_time > JOB_TIMEOUT:
-                self.log.critical("Restarting Pool. One check is stuck.")
-                self.restart_pool()
-                break
+        if self.job_timeout is None:
+            return
+        # their worker is replaced in the shared pool, they keep their slot until they return
+        cancelled = self.pool.cancel_expired()
+        if cancelled:
+            self.log.warning("Cancelled %d stuck jobs running for more than %ss.", cancelled, self.job_timeout)
 
     def _query_event(self, instance):
         i_key = self._instance_key(instance)
@@ -606,6 +605,57 @@ class VSphereCheck(AgentCheck):
         # Defaults to return the value without transformation
         return value
 
+    @staticmethod
+    def _get_query_spec(mor):
+        """ Return the QuerySpec of the latest values of the metrics listed in the morlist for one MOR
+        """
+        return vim.PerformanceManager.QuerySpec(maxSample=1,
+                                                entity=mor['mor'],
+                                                metricId=mor['metrics'],
+                                                intervalId=mor['interval'],
+                                                format='normal')
+
+    def _submit_metric_values(self, instance, mor, values):
+        """ Submit the metric values of one MOR returned by QueryPerf
+        """
+        i_key = self._instance_key(instance)
+        custom_tags = instance.get('tags', [])
+
+        for result in values:
+            if result.id.counterId not in self.metrics_metadata[i_key]:
+                self.log.debug("Skipping this metric value, because there is no metadata about it")
+                continue
+
+            # Metric types are absolute, delta, and rate
+            try:
+                metric_name = self.metrics_metadata[i_key][result.id.counterId]['name']
+            except KeyError:
+                metric_name = None
+
+            if metric_name not in all_metrics.ALL_METRICS:
+                self.log.debug(u"Skipping unknown `%s` metric.", metric_name)
+                continue
+
+            if not result.value:
+                self.log.debug(u"Skipping `%s` metric because the value is empty", metric_name)
+                continue
+
+            instance_name = result.id.instance or "none"
+            value = self._transform_value(instance, result.id.counterId, result.value[0])
+
+            tags = ['instance:%s' % instance_name]
+            if not mor['hostname']:  # no host tags available
+                tags.extend(mor['tags'])
+
+            # vsphere "rates" should be submitted as gauges (rate is
+            # precomputed).
+            self.gauge(
+                "vsphere.%s" % metric_name,
+                value,
+                hostname=mor['hostname'],
+                tags=['instance:%s' % instance_name] + custom_tags
+            )
+
     @atomic_method
     def _collect_metrics_atomic(self, instance, mor):
         """ Task that collects the metrics listed in the morlist for one MOR
@@ -614,60 +664,60 @@ class VSphereCheck(AgentCheck):
         t = Timer()
         # ## </TEST-INSTRUMENTATION>
 
-        i_key = self._instance_key(instance)
         server_instance = self._get_server_instance(instance)
         perfManager = server_instance.content.perfManager
-        custom_tags = instance.get('tags', [])
 
-        query = vim.PerformanceManager.QuerySpec(maxSample=1,
-                                                 entity=mor['mor'],
-                                                 metricId=mor['metrics'],
-                                                 intervalId=mor['interval'],
-                                                 format='normal')
-        results = perfManager.QueryPerf(querySpec=[query])
+        results = perfManager.QueryPerf(querySpec=[self._get_query_spec(mor)])
         if results:
-            for result in results[0].value:
-                if result.id.counterId not in self.metrics_metadata[i_key]:
-                    self.log.debug("Skipping this metric value, because there is no metadata about it")
-                    continue
-
-                # Metric types are absolute, delta, and rate
-                try:
-                    metric_name = self.metrics_metadata[i_key][result.id.counterId]['name']
-                except KeyError:
-                    metric_name = None
-
-                if metric_name not in ALL_METRICS:
-                    self.log.debug(u"Skipping unknown `%s` metric.", metric_name)
-                    continue
-
-                if not result.value:
-                    self.log.debug(u"Skipping `%s` metric because the value is empty", metric_name)
-                    continue
-
-                instance_name = result.id.instance or "none"
-                value = self._transform_value(instance, result.id.counterId, result.value[0])
-
-                tags = ['instance:%s' % instance_name]
-                if not mor['hostname']:  # no host tags available
-                    tags.extend(mor['tags'])
-
-                # vsphere "rates" should be submitted as gauges (rate is
-                # precomputed).
-                self.gauge(
-                    "vsphere.%s" % metric_name,
-                    value,
-                    hostname=mor['hostname'],
-                    tags=['instance:%s' % instance_name] + custom_tags
-                )
+            self._submit_metric_values(instance, mor, results[0].value)
 
         # ## <TEST-INSTRUMENTATION>
         self.histogram('datadog.agent.vsphere.metric_colection.time', t.total())
         # ## </TEST-INSTRUMENTATION>
 
+    @atomic_method
+    def _collect_metrics_batch_atomic(self, instance, mors):
+        """ Task that collects the metrics listed in the morlist for a batch of MORs
+        with a single QueryPerf call. If the query fails, each MOR of the batch is
+        collected by its own _collect_metrics_atomic task.
+        """
+        # ## <TEST-INSTRUMENTATION>
+        t = Timer()
+        # ## </TEST-INSTRUMENTATION>
+
+        server_instance = self._get_server_instance(instance)
+        perfManager = server_instance.content.perfManager
+        custom_tags = instance.get('tags', [])
+
+        try:
+            results = perfManager.QueryPerf(querySpec=[self._get_query_spec(mor) for mor in mors])
+        except Exception as e:
+            self.log.warning(u"Unable to collect the metrics of %d MORs in a single query, "
+                             u"collecting them one by one: %s", len(mors), e)
+            self.count('datadog.agent.vsphere.metric_batch_collection.failures', 1, tags=custom_tags)
+            for mor in mors:
+                self.pool.apply_async(self._collect_metrics_atomic, args=(instance, mor))
+            return
+
+        # the values are matched with their MOR by entity
+        mor_by_entity = dict((mor['mor'], mor) for mor in mors)
+        for result in results or []:
+            mor = mor_by_entity.get(result.entity)
+            if mor is None:
+                self.log.debug(u"Skipping the metric values of `%s`, it wasn't queried", result.entity)
+                continue
+            self._submit_metric_values(instance, mor, result.value)
+
+        # ## <TEST-INSTRUMENTATION>
+        self.histogram('datadog.agent.vsphere.metric_batch_collection.time', t.total(), tags=custom_tags)
+        self.histogram('datadog.agent.vsphere.metric_batch_collection.size', len(mors), tags=custom_tags)
+        # ## </TEST-INSTRUMENTATION>
+
     def collect_metrics(self, instance):
         """ Calls asynchronously _collect_metrics_atomic on all MORs, as the
         job queue is processed the Aggregator will receive the metrics.
+        With `batch_query_perf_size`, _collect_metrics_batch_atomic is called
+        on batches of MORs instead, the batches being collected concurrently.
         """
         i_key = self._instance_key(instance)
         if i_key not in self.morlist:
@@ -681,13 +731,26 @@ class VSphereCheck(AgentCheck):
 
         custom_tags = instance.get('tags', [])
 
+        batch_size = int(self.init_config.get('batch_query_perf_size', BATCH_QUERY_PERF_SIZE))
+        batch = []
+
         for mor_name, mor in mors:
             if mor['mor_type'] == 'vm':
                 vm_count += 1
             if 'metrics' not in mor or not mor['metrics']:
                 continue
 
-            self.pool.apply_async(self._collect_metrics_atomic, args=(instance, mor))
+            if batch_size <= 1:
+                self.pool.apply_async(self._collect_metrics_atomic, args=(instance, mor))
+                continue
+
+            batch.append(mor)
+            if len(batch) == batch_size:
+                self.pool.apply_async(self._collect_metrics_batch_atomic, args=(instance, batch))
+                batch = []
+
+        if batch:
+            self.pool.apply_async(self._collect_metrics_batch_atomic, args=(instance, batch))
 
         self.gauge('vsphere.vm.count', vm_count, tags=["vcenter_server:%s" % instance.get('name')] + custom_tags)
 
@@ -698,7 +761,7 @@ class VSphereCheck(AgentCheck):
         custom_tags = instance.get('tags', [])
 
         # ## <TEST-INSTRUMENTATION>
-        self.gauge('datadog.agent.vsphere.queue_size', self.pool._workq.qsize(), tags=['instant:initial'] + custom_tags)
+        self.gauge('datadog.agent.vsphere.queue_size', self.pool.qsize(), tags=['instant:initial'] + custom_tags)
         # ## </TEST-INSTRUMENTATION>
 
         # First part: make sure our object repository is neat & clean
@@ -733,5 +796,6 @@ class VSphereCheck(AgentCheck):
             set_external_tags(self.get_external_host_tags())
 
         # ## <TEST-INSTRUMENTATION>
-        self.gauge('datadog.agent.vsphere.queue_size', self.pool._workq.qsize(), tags=['instant:final'] + custom_tags)
+        self.gauge('datadog.agent.vsphere.queue_size', self.pool.qsize(), tags=['instant:final'] + custom_tags)
+        self.pool.submit_stats(self.gauge, tags=custom_tags)
         # ## </TEST-INSTRUMENTATION>
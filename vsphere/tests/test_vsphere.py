@@ -7,6 +7,7 @@ from datetime import datetime
 import pytest
 import mock
 from mock import MagicMock
+from pyVmomi import vim
 
 from datadog_checks.vsphere import VSphereCheck
 from datadog_checks.vsphere.vsphere import MORLIST, INTERVAL, METRICS_METADATA
@@ -79,6 +80,22 @@ def test_init():
     assert len(check.latest_event_query) == 0
 
 
+def test_clean(vsphere, instance):
+    """
+    The stuck jobs are only cancelled with a `job_timeout`
+    """
+    vsphere.pool = MagicMock()
+    vsphere._clean()
+    vsphere.pool.cancel_expired.assert_not_called()
+
+    check = VSphereCheck('disk', {'job_timeout': 60}, {}, [instance])
+    assert check.job_timeout == 60.0
+    check.pool = MagicMock()
+    check.pool.cancel_expired.return_value = 1
+    check._clean()
+    check.pool.cancel_expired.assert_called_once_with()
+
+
 def test__is_excluded():
     """
      * Exclude hosts/vms not compliant with the user's `*_include` configuration.
@@ -221,3 +238,64 @@ def test_check(vsphere, instance):
                                     'vsphere_datacenter:datacenter1', 'vsphere_cluster:compute_resource1',
                                     'vsphere_compute:compute_resource1', 'vsphere_type:host'
                          ]}) in all_the_tags
+
+
+def test_collect_metrics_batch(vsphere, instance):
+    """
+    Test the collection of the metrics of the MORs in batches, and the per-MOR fallback of the failed batches
+    """
+    i_key = vsphere._instance_key(instance)
+    vsphere.init_config['batch_query_perf_size'] = 2
+    vsphere.metrics_metadata[i_key] = {1: {'name': 'cpu.usage', 'unit': 'percent'}}
+    vsphere.morlist[i_key] = {}
+    for i in range(3):
+        mor = MockedMOR(spec='VirtualMachine', name='vm%d' % i)
+        vsphere.morlist[i_key][mor.name] = {
+            'mor': mor,
+            'mor_type': 'vm',
+            'hostname': mor.name,
+            'tags': [],
+            'interval': 20,
+            'metrics': [vim.PerformanceManager.MetricId(counterId=1, instance='')],
+        }
+
+    def query_perf(querySpec):
+        return [
+            MagicMock(entity=query.entity, value=[MagicMock(id=MagicMock(counterId=1, instance=''), value=[5000])])
+            for query in querySpec
+        ]
+
+    perf_manager = vsphere._get_server_instance(instance).content.perfManager
+    perf_manager.QueryPerf.side_effect = query_perf
+    with mock.patch.object(vsphere, 'gauge') as gauge:
+        vsphere.collect_metrics(instance)
+
+    # one batch of 2 MORs and one of 1
+    assert sorted(len(c[1]['querySpec']) for c in perf_manager.QueryPerf.call_args_list) == [1, 2]
+    gauges = [c for c in gauge.call_args_list if c[0][0] == 'vsphere.cpu.usage']
+    assert sorted(c[1]['hostname'] for c in gauges) == ['vm0', 'vm1', 'vm2']
+    assert all(c[0][1] == 50.0 for c in gauges)
+
+    # each MOR of the batches which fail is queried by its own job
+    def query_perf_failing(querySpec):
+        if len(querySpec) > 1:
+            raise Exception("Too many metrics")
+        return query_perf(querySpec)
+
+    perf_manager.QueryPerf.reset_mock()
+    perf_manager.QueryPerf.side_effect = query_perf_failing
+    vsphere.pool = MagicMock()
+    vsphere.pool.apply_async.side_effect = lambda func, args: func(*args)
+    with mock.patch.object(vsphere, 'gauge') as gauge, mock.patch.object(vsphere, 'count') as count:
+        vsphere.collect_metrics(instance)
+
+    assert sorted(len(c[1]['querySpec']) for c in perf_manager.QueryPerf.call_args_list) == [1, 1, 1, 2]
+    count.assert_called_once_with('datadog.agent.vsphere.metric_batch_collection.failures', 1, tags=[])
+    # the 2 batches, and a job for each MOR of the failed batch
+    jobs = vsphere.pool.apply_async.call_args_list
+    batches = [c[1]['args'][1] for c in jobs if c[0][0] == vsphere._collect_metrics_batch_atomic]
+    fallbacks = [c[1]['args'][1] for c in jobs if c[0][0] == vsphere._collect_metrics_atomic]
+    assert len(jobs) == 4
+    assert [mor for batch in batches if len(batch) > 1 for mor in batch] == fallbacks
+    gauges = [c for c in gauge.call_args_list if c[0][0] == 'vsphere.cpu.usage']
+    assert sorted(c[1]['hostname'] for c in gauges) == ['vm0', 'vm1', 'vm2']